@@ -1,5 +1,22 @@
-from .image import Image
-from .collection import Collection
-from .timeseries import TimeSeries
+#EARTH ENGINE CLASSES ARE IMPORTED ON FIRST ACCESS, SO geesebal.local
+#(THE NUMPY ENGINE) AND geesebal.bandregistry IMPORT WITHOUT ee
+import importlib
+
+_CLASSES = {
+    "Image": ".image",
+    "Collection": ".collection",
+    "TimeSeries": ".timeseries",
+    "SceneBatch": ".scenebatch",
+}
 
 __version__ = "0.1.1"
+
+
+def __getattr__(name):
+    if name in _CLASSES:
+        return getattr(importlib.import_module(_CLASSES[name], __name__), name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_CLASSES))
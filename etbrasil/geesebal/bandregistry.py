@@ -0,0 +1,93 @@
+#----------------------------------------------------------------------------------------#
+#---------------------------------------//GEESEBAL//-------------------------------------#
+#GEESEBAL - GOOGLE EARTH ENGINE APP FOR SURFACE ENERGY BALANCE ALGORITHM FOR LAND (SEBAL)
+#CREATE BY: LEONARDO LAIPELT, RAFAEL KAYSER, ANDERSON RUHOFF AND AYAN FLEISCHMANN
+#PROJECT - ET BRASIL https://etbrasil.org/
+#LAB - HIDROLOGIA DE GRANDE ESCALA [HGE] website: https://www.ufrgs.br/hge/author/hge/
+#UNIVERSITY - UNIVERSIDADE FEDERAL DO RIO GRANDE DO SUL - UFRGS
+#RIO GRANDE DO SUL, BRAZIL
+
+#DOI
+#VERSION 0.1.1
+#CONTACT US: leonardo.laipelt@ufrgs.br
+
+#----------------------------------------------------------------------------------------#
+#
+# BAND REGISTRY
+#   - A registry maps a derived band name to (INPUT BANDS, FUNCTION), where
+#     FUNCTION(image, bands, options) returns the band from the already built
+#     inputs in `bands`. Raw image bands are read from `image` directly
+#   - Only the bands transitively required by the requested outputs are built,
+#     so callers that need a few bands get a smaller graph (or fewer arrays)
+#   - Names starting with "_" are intermediates, never added to the image
+#   - Shared by tools.fexp_spec_ind (Earth Engine) and local.fexp_spec_ind
+#
+#----------------------------------------------------------------------------------------#
+#----------------------------------------------------------------------------------------#
+
+# DEFAULT OUTPUTS OF fexp_spec_ind (BOTH ENGINES)
+SPEC_IND_BANDS = [
+    "NDVI",
+    "EVI",
+    "SAVI",
+    "T_LST",
+    "LAI",
+    "e_0",
+    "e_NB",
+    "longitude",
+    "latitude",
+    "NDVI_neg",
+    "pos_NDVI",
+    "int",
+    "sd_ndvi",
+    "NDWI",
+]
+
+# BANDS READ BY THE REST OF THE SEBAL CHAIN (LST CORRECTION, ENDMEMBERS,
+# RADIATION BALANCE AND SENSIBLE HEAT FLUX)
+SEBAL_SPEC_IND_BANDS = [
+    "NDVI",
+    "SAVI",
+    "T_LST",
+    "LAI",
+    "e_0",
+    "longitude",
+    "latitude",
+    "NDVI_neg",
+    "pos_NDVI",
+    "int",
+    "NDWI",
+]
+
+
+#BANDS TO BUILD FOR outputs, INPUTS BEFORE THE BANDS THAT USE THEM
+def resolve_bands(registry, outputs):
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name not in registry:
+            raise ValueError("Unknown band: " + str(name))
+        if name in visiting:
+            raise ValueError("Cyclic band dependency: " + str(name))
+        visiting.add(name)
+        for dependency in registry[name][0]:
+            visit(dependency)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in outputs:
+        visit(name)
+    return order
+
+
+#BUILD THE REQUIRED BANDS, RETURNS {NAME: BAND} FOR THE REQUESTED outputs ONLY
+def build_bands(registry, outputs, image, options=None):
+    options = {} if options is None else options
+    bands = {}
+    for name in resolve_bands(registry, outputs):
+        inputs, function = registry[name]
+        bands[name] = function(image, bands, options)
+    return {name: bands[name] for name in outputs}
@@ -19,18 +19,38 @@
 #Call EE
 import ee
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 
 #FOLDERS
 from .landsatcollection import fexp_landsat_5PathRow,fexp_landsat_7PathRow, fexp_landsat_8PathRow, fexp_landsat_9PathRow
 from .masks import (f_albedoL5L7,f_albedoL8_9)
-from .meteorology import get_meteorology
-from .tools import (fexp_spec_ind, fexp_lst_export,fexp_radlong_up, LST_DEM_correction,
+from .meteorology import MeteorologyProvider
+from .terrain import TerrainProvider
+from .tools import (fexp_spec_ind, SEBAL_SPEC_IND_BANDS, fexp_atmosphere, fexp_lst_export,fexp_radlong_up, LST_DEM_correction,
 fexp_radshort_down, fexp_radlong_down, fexp_radbalance, fexp_soil_heat,fexp_sensible_heat_flux)
-from .endmembers import fexp_cold_pixel, fexp_hot_pixel
+from .endmembers import fexp_endmembers, fexp_hot_pixel_fluxes
 from .evapotranspiration import fexp_et
 from .constants import Constants
 from .landsat_utils import prepSrLandsat5and7, prepSrLandsat8and9
 
+#SCENE METADATA
+#ONE getInfo() FOR THE WHOLE COLLECTION INSTEAD OF SEVERAL PER SCENE
+def fexp_scene_metadata(collection):
+    def sceneMetadata(image):
+        image=ee.Image(image)
+        return ee.Feature(None, {
+            'index': image.get('system:index'),
+            'LANDSAT_ID': image.get('LANDSAT_ID'),
+            'SATELLITE': image.get('SATELLITE'),
+            'SOLAR_ZENITH_ANGLE': image.get('SOLAR_ZENITH_ANGLE'),
+            'time_start': image.get('system:time_start'),
+            'date': ee.Date(image.get('system:time_start')).format('YYYY-MM-dd'),
+            'bounds': image.geometry().bounds(),
+        })
+
+    features = ee.FeatureCollection(collection.map(sceneMetadata)).getInfo()['features']
+    return [feature['properties'] for feature in features]
+
 #COLLECTION FUNCTION
 class Collection():
 
@@ -49,7 +69,10 @@ class Collection():
                  NDVI_cold=5,
                  Ts_cold=20,
                  NDVI_hot=10,
-                 Ts_hot=20):
+                 Ts_hot=20,
+                 workers=1,
+                 meteorology=None,
+                 terrain=None):
 
         #INFORMATIONS
         self.path=path
@@ -68,194 +91,217 @@ class Collection():
         self.collection_l8=fexp_landsat_8PathRow(self.start_date, self.end_date, self.path, self.row, self.cloud_cover)
         self.collection_l9=fexp_landsat_9PathRow(self.start_date, self.end_date, self.path, self.row, self.cloud_cover)
 
+        self.collection = self.collection_l5.merge(self.collection_l7).merge(self.collection_l8).merge(self.collection_l9)
+
+        #METADATA OF ALL IMAGES
+        self.scenes = fexp_scene_metadata(self.collection)
+
         #LIST OF IMAGES
-        self.sceneListL5 = self.collection_l5.aggregate_array('system:index').getInfo()
-        self.sceneListL7 = self.collection_l7.aggregate_array('system:index').getInfo()
-        self.sceneListL8 = self.collection_l8.aggregate_array('system:index').getInfo()
-        self.sceneListL9 = self.collection_l9.aggregate_array('system:index').getInfo()
+        #MERGE PREFIXES THE INDEX OF EACH SOURCE COLLECTION: L5 1_1_1_, L7 1_1_2_, L8 1_2_, L9 2_
+        self.CollectionList_image = [scene['index'] for scene in self.scenes]
+        self.sceneListL5 = [index[6:] for index in self.CollectionList_image if index.startswith('1_1_1_')]
+        self.sceneListL7 = [index[6:] for index in self.CollectionList_image if index.startswith('1_1_2_')]
+        self.sceneListL8 = [index[4:] for index in self.CollectionList_image if index.startswith('1_2_')]
+        self.sceneListL9 = [index[2:] for index in self.CollectionList_image if index.startswith('2_')]
 
-        self.collection = self.collection_l5.merge(self.collection_l7).merge(self.collection_l8).merge(self.collection_l9)
-        self.CollectionList=self.collection.sort("system:time_start").aggregate_array('system:index').getInfo()
-        self.CollectionList_image = self.collection.aggregate_array('system:index').getInfo()
-        self.count = self.collection.size().getInfo()
+        self.scenes = sorted(self.scenes, key=lambda scene: scene['time_start'])
+        self.CollectionList = [scene['index'] for scene in self.scenes]
+        self.count = len(self.scenes)
 
         #PRINT NUMBER OF SCENES
         print("Number of scenes: ", self.count)
 
-        n =0
-        k=0
+        #METEOROLOGY, MEMOIZED PER (ACQUISITION HOUR, REGION TILE)
+        self.meteorology = meteorology if meteorology is not None else MeteorologyProvider()
+
+        #STATIC TERRAIN (ELEVATION, SLOPE, ASPECT, PRESSURE), BUILT ONCE AND CLIPPED PER SCENE
+        self.terrain = terrain if terrain is not None else TerrainProvider()
+        terrain_image = self.terrain.get()
 
         #====== ITERATIVE PROCESS ======#
         #FOR EACH IMAGE ON THE LIST
         #ESTIMATE ET DAILY IMAGE
-        while n < self.count:
+        #WITH workers > 1 THE BLOCKING getInfo() CALLS OF SEVERAL SCENES RUN CONCURRENTLY
+        def processScene(scene):
             #GET IMAGE
-            self.image= self.collection.filterMetadata('system:index','equals',self.CollectionList[n]).first()
-            self.image=ee.Image(self.image)
+            image= self.collection.filterMetadata('system:index','equals',scene['index']).first()
+            image=ee.Image(image)
 
             #PRINT ID
-            print(self.image.get('LANDSAT_ID').getInfo())
+            print(scene['LANDSAT_ID'])
 
             #GET INFORMATIONS FROM IMAGE
-            self._index=self.image.get('system:index')
-            self.cloud_cover=self.image.get('CLOUD_COVER')
-            self.LANDSAT_ID=self.image.get('LANDSAT_ID').getInfo()
-            self.landsat_version=self.image.get('SATELLITE').getInfo()
-            self.zenith_angle=self.image.get("SOLAR_ZENITH_ANGLE").getInfo()
-            self.azimuth_angle=self.image.get('SOLAR_AZIMUTH_ANGLE')
-            self.time_start=self.image.get('system:time_start')
-            self._date=ee.Date(self.time_start)
-            self._year=ee.Number(self._date.get('year'))
-            self._month=ee.Number(self._date.get('month'))
-            self._day=ee.Number(self._date.get('month'))
-            self._hour=ee.Number(self._date.get('hour'))
-            self._minuts = ee.Number(self._date.get('minutes'))
-            self.crs = self.image.projection().crs()
-            self.transform = ee.List(ee.Dictionary(ee.Algorithms.Describe(self.image.projection())).get('transform'))
-            self.date_string=self._date.format('YYYY-MM-dd').getInfo()
+            _index=scene['index']
+            LANDSAT_ID=scene['LANDSAT_ID']
+            landsat_version=scene['SATELLITE']
+            zenith_angle=scene['SOLAR_ZENITH_ANGLE']
+            time_start=image.get('system:time_start')
+            _date=ee.Date(time_start)
+            _hour=ee.Number(_date.get('hour'))
+            _minuts = ee.Number(_date.get('minutes'))
+            date_string=scene['date']
 
             #ENDMEMBERS
-            self.p_top_NDVI=ee.Number(NDVI_cold)
-            self.p_coldest_Ts=ee.Number(Ts_cold)
-            self.p_lowest_NDVI=ee.Number(NDVI_hot)
-            self.p_hottest_Ts=ee.Number(Ts_hot)
+            p_top_NDVI=ee.Number(NDVI_cold)
+            p_coldest_Ts=ee.Number(Ts_cold)
+            p_lowest_NDVI=ee.Number(NDVI_hot)
+            p_hottest_Ts=ee.Number(Ts_hot)
 
 
             #MAKS
-            if self.landsat_version == 'LANDSAT_5':
-                 self.image_toa=ee.Image(Constants.LANDSAT_COLLECTION_5+ "/"+ self._index.getInfo())
+            if landsat_version == 'LANDSAT_5':
+                 image_toa=ee.Image(Constants.LANDSAT_COLLECTION_5+ "/"+ _index)
 
                  #GET CALIBRATED RADIANCE
-                 self.col_rad = ee.Algorithms.Landsat.calibratedRadiance(self.image_toa);
-                 self.col_rad = self.image.addBands(self.col_rad.select([5],["T_RAD"]))
+                 col_rad = ee.Algorithms.Landsat.calibratedRadiance(image_toa);
+                 col_rad = image.addBands(col_rad.select([5],["T_RAD"]))
 
                  #CLOUD REMOTION
-                 self.image=ee.ImageCollection(self.image).map(prepSrLandsat5and7)
+                 image=ee.ImageCollection(image).map(prepSrLandsat5and7)
 
                  #ALBEDO TASUMI ET AL. (2008)
-                 self.image=self.image.map(f_albedoL5L7)
+                 image=image.map(f_albedoL5L7)
 
-            elif self.landsat_version == 'LANDSAT_7':
-                 self.image_toa=ee.Image(Constants.LANDSAT_COLLECTION_7+ "/"+ self.CollectionList[n][4:])
+            elif landsat_version == 'LANDSAT_7':
+                 image_toa=ee.Image(Constants.LANDSAT_COLLECTION_7+ "/"+ _index[4:])
 
                  #GET CALIBRATED RADIANCE
-                 self.col_rad = ee.Algorithms.Landsat.calibratedRadiance(self.image_toa);
-                 self.col_rad = self.image.addBands(self.col_rad.select([5],["T_RAD"]))
+                 col_rad = ee.Algorithms.Landsat.calibratedRadiance(image_toa);
+                 col_rad = image.addBands(col_rad.select([5],["T_RAD"]))
 
                  #CLOUD REMOTION
-                 self.image=ee.ImageCollection(self.image).map(prepSrLandsat5and7)
+                 image=ee.ImageCollection(image).map(prepSrLandsat5and7)
 
                  #ALBEDO TASUMI ET AL. (2008)
-                 self.image=self.image.map(f_albedoL5L7)
+                 image=image.map(f_albedoL5L7)
 
-            elif self.landsat_version == 'LANDSAT_8':
-                self.image_toa=ee.Image(Constants.LANDSAT_COLLECTION_8+ "/"+self._index.getInfo())
+            elif landsat_version == 'LANDSAT_8':
+                image_toa=ee.Image(Constants.LANDSAT_COLLECTION_8+ "/"+_index)
 
                 #GET CALIBRATED RADIANCE
-                self.col_rad = ee.Algorithms.Landsat.calibratedRadiance(self.image_toa)
-                self.col_rad = self.image.addBands(self.col_rad.select([9],["T_RAD"]))
+                col_rad = ee.Algorithms.Landsat.calibratedRadiance(image_toa)
+                col_rad = image.addBands(col_rad.select([9],["T_RAD"]))
 
                 #CLOUD REMOTION
-                self.image=ee.ImageCollection(self.image).map(prepSrLandsat8)
+                image=ee.ImageCollection(image).map(prepSrLandsat8and9)
 
                 #ALBEDO TASUMI ET AL. (2008) METHOD WITH KE ET AL. (2016) COEFFICIENTS
-                self.image=self.image.map(f_albedoL8_9)
+                image=image.map(f_albedoL8_9)
 
             else:
-                self.image_toa=ee.Image(Constants.LANDSAT_COLLECTION_9+ "/"+self._index.getInfo())
+                image_toa=ee.Image(Constants.LANDSAT_COLLECTION_9+ "/"+_index)
 
                 #GET CALIBRATED RADIANCE
-                self.col_rad = ee.Algorithms.Landsat.calibratedRadiance(self.image_toa)
-                self.col_rad = self.image.addBands(self.col_rad.select([9],["T_RAD"]))
+                col_rad = ee.Algorithms.Landsat.calibratedRadiance(image_toa)
+                col_rad = image.addBands(col_rad.select([9],["T_RAD"]))
 
                 #CLOUD REMOTION
-                self.image=ee.ImageCollection(self.image).map(prepSrLandsat8and9)
+                image=ee.ImageCollection(image).map(prepSrLandsat8and9)
 
                 #ALBEDO TASUMI ET AL. (2008) METHOD WITH KE ET AL. (2016) COEFFICIENTS
-                self.image=self.image.map(f_albedoL8_9)
+                image=image.map(f_albedoL8_9)
 
             #GEOMETRY
-            self.geometryReducer=self.image.geometry().bounds().getInfo()
-            self.geometry_download=self.geometryReducer['coordinates']
-            self.sun_elevation=ee.Number(90).subtract(self.zenith_angle)
+            geometryReducer=scene['bounds']
+            sun_elevation=ee.Number(90).subtract(zenith_angle)
 
             #METEOROLOGY PARAMETERS
-            col_meteorology= get_meteorology(self.image,self.time_start)
+            #SCENES OF THE SAME HOUR AND TILE SHARE ONE INTERPOLATED STACK
+            col_meteorology= self.meteorology.apply(image.first(), scene['time_start'], scene['bounds'])
 
             #AIR TEMPERATURE [C]
-            self.T_air = col_meteorology.select('AirT_G')
+            T_air = col_meteorology.select('AirT_G')
 
             #WIND SPEED [M S-1]
-            self.ux= col_meteorology.select('ux_G')
+            ux= col_meteorology.select('ux_G')
 
             #RELATIVE HUMIDITY (%)
-            self.UR = col_meteorology.select('RH_G')
+            UR = col_meteorology.select('RH_G')
 
             #NET RADIATION 24H [W M-2]
-            self.Rn24hobs = col_meteorology.select('Rn24h_G')
+            Rn24hobs = col_meteorology.select('Rn24h_G')
 
             #SRTM DATA ELEVATION
-            SRTM_ELEVATION ='USGS/SRTMGL1_003' # SRTM Data Elevation
-            self.srtm = ee.Image(SRTM_ELEVATION).clip(self.geometryReducer)
-            self.z_alt = self.srtm.select('elevation')
+            terrain = terrain_image.clip(geometryReducer)
+            z_alt = terrain.select('elevation')
 
-            #TO AVOID ERRORS DURING THE PROCESS
-            try:
-                #GET IMAGE
-                self.image=self.image.first()
+            #GET IMAGE
+            image=image.first()
+
+            #SPECTRAL IMAGES (ONLY THE BANDS THE SEBAL CHAIN READS)
+            image=fexp_spec_ind(image, bands=SEBAL_SPEC_IND_BANDS)
+
+            #ATMOSPHERIC STATE (dr, P_ATM, ES, EA, W_ATM, Tao_sw), SHARED BY THE LST CORRECTION AND Rs_down
+            atmosphere=fexp_atmosphere(image, z_alt, T_air, UR, sun_elevation, terrain)
 
-                #SPECTRAL IMAGES (NDVI, EVI, SAVI, LAI, T_LST, e_0, e_NB, long, lat)
-                self.image=fexp_spec_ind(self.image)
+            #LAND SURFACE TEMPERATURE
+            #image =fexp_lst_export(image,col_rad,landsat_version,geometryReducer)
+            image=LST_DEM_correction(image, z_alt, T_air, UR,sun_elevation,_hour,_minuts, terrain=terrain, atmosphere=atmosphere)
 
-                #LAND SURFACE TEMPERATURE
-                #self.image =fexp_lst_export(self.image,self.col_rad,self.landsat_version,self.geometryReducer)
-                self.image=LST_DEM_correction(self.image, self.z_alt, self.T_air, self.UR,self.sun_elevation,self._hour,self._minuts)
+            #COLD AND HOT PIXELS
+            d_cold_pixel, d_hot_pixel=fexp_endmembers(image, geometryReducer, p_top_NDVI, p_coldest_Ts,
+                                                      p_lowest_NDVI, p_hottest_Ts)
 
-                #COLD PIXEL
-                self.d_cold_pixel=fexp_cold_pixel(self.image, self.geometryReducer, self.p_top_NDVI, self.p_coldest_Ts)
+            #COLD PIXEL NUMBER
+            n_Ts_cold = ee.Number(d_cold_pixel.get('temp').getInfo())
 
-                #COLD PIXEL NUMBER
-                self.n_Ts_cold = ee.Number(self.d_cold_pixel.get('temp').getInfo())
+            #INSTANTANEOUS OUTGOING LONG-WAVE RADIATION [W M-2]
+            image=fexp_radlong_up(image)
 
-                #INSTANTANEOUS OUTGOING LONG-WAVE RADIATION [W M-2]
-                self.image=fexp_radlong_up(self.image)
+            #INSTANTANEOUS INCOMING SHORT-WAVE RADIATION [W M-2]
+            image=fexp_radshort_down(image,z_alt,T_air,UR, sun_elevation, atmosphere=atmosphere)
 
-                #INSTANTANEOUS INCOMING SHORT-WAVE RADIATION [W M-2]
-                self.image=fexp_radshort_down(self.image,self.z_alt,self.T_air,self.UR, self.sun_elevation)
+            #INSTANTANEOUS INCOMING LONGWAVE RADIATION [W M-2]
+            image=fexp_radlong_down(image, n_Ts_cold)
 
-                #INSTANTANEOUS INCOMING LONGWAVE RADIATION [W M-2]
-                self.image=fexp_radlong_down(self.image, self.n_Ts_cold)
+            #INSTANTANEOUS NET RADIATON BALANCE [W M-2]
+            image=fexp_radbalance(image)
 
-                #INSTANTANEOUS NET RADIATON BALANCE [W M-2]
-                self.image=fexp_radbalance(self.image)
+            #SOIL HEAT FLUX (G) [W M-2]
+            image=fexp_soil_heat(image)
 
-                #SOIL HEAT FLUX (G) [W M-2]
-                self.image=fexp_soil_heat(self.image)
+            #HOT PIXEL Rn AND G
+            d_hot_pixel=fexp_hot_pixel_fluxes(image, d_hot_pixel)
+            #SENSIBLE HEAT FLUX (H) [W M-2]
+            image=fexp_sensible_heat_flux(image, ux, UR,Rn24hobs,n_Ts_cold,
+                                          d_hot_pixel, date_string,geometryReducer)
 
-                #HOT PIXEL
-                self.d_hot_pixel=fexp_hot_pixel(self.image, self.geometryReducer,self.p_lowest_NDVI, self.p_hottest_Ts)
-                #SENSIBLE HEAT FLUX (H) [W M-2]
-                self.image=fexp_sensible_heat_flux(self.image, self.ux, self.UR,self.Rn24hobs,self.n_Ts_cold,
-                                                   self.d_hot_pixel, self.date_string,self.geometryReducer)
+            #DAILY EVAPOTRANSPIRATION (ET_24H) [MM DAY-1]
+            image=fexp_et(image,Rn24hobs)
 
-                #DAILY EVAPOTRANSPIRATION (ET_24H) [MM DAY-1]
-                self.image=fexp_et(self.image,self.Rn24hobs)
 
+            NAME_FINAL=LANDSAT_ID[:5]+LANDSAT_ID[10:17]+LANDSAT_ID[17:25]
+            return NAME_FINAL, image.select(['ET_24h'],[NAME_FINAL])
 
-                self.NAME_FINAL=self.LANDSAT_ID[:5]+self.LANDSAT_ID[10:17]+self.LANDSAT_ID[17:25]
-                self.ET_daily=self.image.select(['ET_24h'],[self.NAME_FINAL])
+        if workers > 1:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            results = [executor.submit(processScene, scene) for scene in self.scenes]
+        else:
+            executor = None
+            results = self.scenes
+
+        #ADD THE ET BANDS IN DATE ORDER, SKIPPING SCENES THAT FAILED
+        self.Collection_ET = None
+        self.ETList = []
+        self.errors = {}
+        for scene, result in zip(self.scenes, results):
+            #TO AVOID ERRORS DURING THE PROCESS
+            try:
+                NAME_FINAL, ET_daily = result.result() if executor else processScene(result)
 
-                if k ==0:
-                    self.Collection_ET=self.ET_daily
+                if self.Collection_ET is None:
+                    self.Collection_ET=ET_daily
                 else:
-                    self.Collection_ET=self.Collection_ET.addBands(self.ET_daily)
-                k=k+1
-            except:
+                    self.Collection_ET=self.Collection_ET.addBands(ET_daily)
+                self.ETList.append(NAME_FINAL)
+            except Exception as e:
                 # ERRORS CAN OCCUR WHEN:
                 # - THERE IS NO METEOROLOGICAL INFORMATION.
                 # - ET RETURN NULL IF AT THE POINT WAS APPLIED MASK CLOUD.
                 # - CONEECTION ISSUES.
                 # - SEBAL DOESN'T FIND A REASONABLE LINEAR RELATIONSHIP (dT).
+                self.errors[scene['index']] = repr(e)
+                print('Error.', scene['index'], repr(e))
 
-                print('Error.')
-            n=n+1
+        if executor:
+            executor.shutdown()
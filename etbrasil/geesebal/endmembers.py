@@ -154,3 +154,103 @@ def fexp_hot_pixel(image, refpoly, p_lowest_NDVI, p_hottest_Ts):
 
   #RETURN DICTIONARY
   return d_hot_pixel
+
+#SELECT COLD AND HOT PIXELS TOGETHER
+#SAME SELECTION AS fexp_cold_pixel AND fexp_hot_pixel, WITH THREE PASSES
+#OVER refpoly INSTEAD OF EIGHT:
+#1) NDVI PERCENTILES OF BOTH ENDMEMBERS
+#2) LST PERCENTILES OF BOTH ENDMEMBERS
+#3) NUMBER OF CANDIDATES AND ONE RANDOM CANDIDATE PER ENDMEMBER
+#Rn AND G ARE NOT AVAILABLE YET WHEN THE COLD PIXEL IS NEEDED,
+#ADD THEM TO THE HOT PIXEL WITH fexp_hot_pixel_fluxes AFTER fexp_soil_heat
+def fexp_endmembers(image, refpoly, p_top_NDVI, p_coldest_Ts, p_lowest_NDVI, p_hottest_Ts, seed=0):
+
+  #IDENTIFY THE TOP % AND DOWN % NDVI PIXELS
+  d_perc_ndvi=image.select(['NDVI_neg','pos_NDVI']).reduceRegion(
+      reducer=ee.Reducer.percentile([p_top_NDVI, p_lowest_NDVI], ['cold', 'hot']),
+      geometry= refpoly,
+      scale= 30,
+      maxPixels=9e14)
+
+  #GET VALUES
+  n_perc_top_NDVI= ee.Number(d_perc_ndvi.get('NDVI_neg_cold'))
+  n_perc_low_NDVI= ee.Number(d_perc_ndvi.get('pos_NDVI_hot'))
+  i_top_NDVI = image.select('NDVI_neg').lte(n_perc_top_NDVI)
+  i_low_NDVI = image.select('pos_NDVI').lte(n_perc_low_NDVI)
+
+  #SELECT THE COLDEST AND HOTTEST TS FROM PREVIOUS NDVI GROUPS
+  i_lst = image.select('LST_NW').updateMask(i_top_NDVI).rename('cold').addBands(
+      image.select('LST_neg').updateMask(i_low_NDVI).rename('hot'))
+  d_perc_lst = i_lst.reduceRegion(
+    reducer= ee.Reducer.percentile([p_coldest_Ts, p_hottest_Ts], ['cold', 'hot']),
+    geometry=refpoly,
+    scale= 30,
+    maxPixels=9e14
+    )
+
+  #GET VALUES
+  n_perc_low_LST = ee.Number(d_perc_lst.get('cold_cold'))
+  n_perc_top_lst = ee.Number(d_perc_lst.get('hot_hot'))
+
+  #FILTERS
+  i_cold = i_top_NDVI.And(image.select('LST_NW').lte(n_perc_low_LST)).And(image.select('LST_NW').gte(200))
+  #ONLY PIXELS WITH A VALID LST_NW (NOT WATER), AS THE 'int' BAND COUNTED BEFORE
+  i_hot = i_low_NDVI.And(image.select('LST_neg').lte(n_perc_top_lst)).And(image.select('LST_NW').mask())
+
+  #CANDIDATE CLASS: 1 COLD, 2 HOT
+  i_class = ee.Image(0).where(i_hot, 2).where(i_cold, 1).rename('class')
+
+  #COUNT NUMBER OF PIXELS AND SELECT ONE PIXEL RANDOMLY FOR EACH CLASS
+  #THE MIN REDUCER KEEPS THE BANDS OF THE PIXEL WITH THE LOWEST RANDOM VALUE
+  i_candidates = ee.Image.random(seed).rename('random') \
+      .addBands(image.select(['LST_NW', 'NDVI', 'longitude', 'latitude'])) \
+      .addBands(ee.Image(1).rename('sum')) \
+      .addBands(i_class) \
+      .updateMask(i_class.gt(0))
+
+  reducer = ee.Reducer.min(5).setOutputs(['random', 'temp', 'ndvi', 'x', 'y']) \
+      .combine(reducer2=ee.Reducer.count().setOutputs(['sum']), sharedInputs=False) \
+      .group(groupField=6, groupName='class')
+
+  d_groups = i_candidates.reduceRegion(
+        reducer= reducer,
+        geometry= refpoly,
+        scale= 30,
+        maxPixels=9e14)
+
+  fc_groups = ee.FeatureCollection(
+      ee.List(d_groups.get('groups')).map(lambda d: ee.Feature(None, d)))
+  fc_cold_pix = fc_groups.filter(ee.Filter.eq('class', 1))
+  fc_hot_pix = fc_groups.filter(ee.Filter.eq('class', 2))
+
+  #CREATE DICTIONARIES WITH THOSE RESULTS
+  d_cold_pixel = ee.Dictionary({
+          'temp': ee.Number(fc_cold_pix.aggregate_first('temp')),
+          'ndvi': ee.Number(fc_cold_pix.aggregate_first('ndvi')),
+          'x': ee.Number(fc_cold_pix.aggregate_first('x')),
+          'y': ee.Number(fc_cold_pix.aggregate_first('y')),
+          'sum': ee.Number(fc_cold_pix.aggregate_sum('sum'))})
+
+  d_hot_pixel = ee.Dictionary({
+        'temp': ee.Number(fc_hot_pix.aggregate_first('temp')),
+        'x': ee.Number(fc_hot_pix.aggregate_first('x')),
+        'y': ee.Number(fc_hot_pix.aggregate_first('y')),
+        'ndvi': ee.Number(fc_hot_pix.aggregate_first('ndvi')),
+        'sum': ee.Number(fc_hot_pix.aggregate_sum('sum'))})
+
+  #RETURN DICTIONARIES
+  return d_cold_pixel, d_hot_pixel
+
+#ADD Rn AND G AT THE HOT PIXEL (SEE fexp_endmembers)
+def fexp_hot_pixel_fluxes(image, d_hot_pixel, scale=30):
+
+  p_hot_pix = ee.Geometry.Point([d_hot_pixel.get('x'), d_hot_pixel.get('y')])
+  d_fluxes = image.select(['Rn', 'G']).reduceRegion(
+        reducer=ee.Reducer.first(),
+        geometry=p_hot_pix,
+        scale=scale,
+        maxPixels=5556)
+
+  return ee.Dictionary(d_hot_pixel).combine(ee.Dictionary({
+        'Rn': ee.Number(d_fluxes.get('Rn')),
+        'G': ee.Number(d_fluxes.get('G'))}))
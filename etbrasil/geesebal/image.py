@@ -28,11 +28,12 @@ import ee
 #FOLDERS
 from .landsatcollection import fexp_landsat_5Coordinate, fexp_landsat_7Coordinate, fexp_landsat_8Coordinate, fexp_landsat_9Coordinate
 from .masks import (f_albedoL5L7,f_albedoL8_9)
-from .meteorology import get_meteorology, retrievePrecipImage, verifyMeteoAvail
-from .tools import (fexp_spec_ind, fexp_lst_export,fexp_radlong_up, LST_DEM_correction,
+from .meteorology import buildPrecipCube, fexp_meteorology_collection, retrievePrecipImage
+from .terrain import fexp_terrain
+from .tools import (fexp_spec_ind, SEBAL_SPEC_IND_BANDS, fexp_atmosphere, fexp_lst_export,fexp_radlong_up, LST_DEM_correction,
 fexp_radshort_down, fexp_radlong_down, fexp_radbalance, fexp_soil_heat, fexp_sensible_heat_flux,
 fexp_sensible_heat_flux_ver_server)
-from .endmembers import fexp_cold_pixel, fexp_hot_pixel
+from .endmembers import fexp_endmembers, fexp_hot_pixel_fluxes
 from .evapotranspiration import fexp_et
 from .constants import Constants
 from .landsat_utils import prepSrLandsat5and7, prepSrLandsat8and9
@@ -55,6 +56,7 @@ class Image():
                  aoi=None,
                  cloud_max=10,
                  scale=30,
+                 solver='image',
               ):
 
         #output variable
@@ -66,6 +68,12 @@ class Image():
         collection_l8=fexp_landsat_8Coordinate(window_start, window_end, aoi, cloud_max)
         collection_l9=fexp_landsat_9Coordinate(window_start, window_end, aoi, cloud_max)
 
+        #DAILY PRECIPITATION FOR THE WHOLE WINDOW, SLICED PER IMAGE
+        precip_cube=buildPrecipCube(window_start, window_end, precip_window, region=aoi)
+
+        #STATIC TERRAIN (ELEVATION, SLOPE, ASPECT, PRESSURE), SHARED BY EVERY IMAGE
+        aoi_terrain=fexp_terrain(aoi)
+
         def retrieveETandMeteo(image):
             #GET INFORMATIONS FROM IMAGE
             image = ee.Image(image)
@@ -99,19 +107,23 @@ class Image():
             Rn24hobs = image.select('Rn24h_G');
 
             #SRTM DATA ELEVATION
-            srtm = ee.Image(Constants.SRTM_ELEVATION_COLLECTION).clip(geometryReducer)
-            z_alt = srtm.select('elevation')
-            slope = ee.Terrain.slope(z_alt)
+            terrain = aoi_terrain.clip(geometryReducer)
+            z_alt = terrain.select('elevation')
+            slope = terrain.select('slope')
+
+            #SPECTRAL IMAGES (ONLY THE BANDS THE SEBAL CHAIN READS)
+            image=fexp_spec_ind(image, scale=scale, bands=SEBAL_SPEC_IND_BANDS)
 
-            #SPECTRAL IMAGES (NDVI, EVI, SAVI, LAI, T_LST, e_0, e_NB, long, lat)
-            image=fexp_spec_ind(image, scale=scale)
+            #ATMOSPHERIC STATE (dr, P_ATM, ES, EA, W_ATM, Tao_sw), SHARED BY THE LST CORRECTION AND Rs_down
+            atmosphere=fexp_atmosphere(image, z_alt, T_air, UR, sun_elevation, terrain)
 
             #LAND SURFACE TEMPERATURE
-            image=LST_DEM_correction(image, z_alt, T_air, UR,sun_elevation,_hour,_minuts)
+            image=LST_DEM_correction(image, z_alt, T_air, UR,sun_elevation,_hour,_minuts, terrain=terrain, atmosphere=atmosphere)
             LandT_G = image.select('T_LST_DEM').rename('LandT_G')
 
-            #COLD PIXEL
-            d_cold_pixel=fexp_cold_pixel(image, geometryReducer, p_top_NDVI, p_coldest_Ts)
+            #COLD AND HOT PIXELS
+            d_cold_pixel, d_hot_pixel=fexp_endmembers(image, geometryReducer, p_top_NDVI, p_coldest_Ts,
+                                                      p_lowest_NDVI, p_hottest_Ts)
 
             #COLD PIXEL NUMBER
             n_Ts_cold = ee.Number(d_cold_pixel.get('temp'))
@@ -120,7 +132,7 @@ class Image():
             image=fexp_radlong_up(image)
 
             #INSTANTANEOUS INCOMING SHORT-WAVE RADIATION [W M-2]
-            image=fexp_radshort_down(image,z_alt,T_air,UR, sun_elevation)
+            image=fexp_radshort_down(image,z_alt,T_air,UR, sun_elevation, atmosphere=atmosphere)
 
             #INSTANTANEOUS INCOMING LONGWAVE RADIATION [W M-2]
             image=fexp_radlong_down(image, n_Ts_cold)
@@ -131,12 +143,13 @@ class Image():
             #SOIL HEAT FLUX (G) [W M-2]
             image=fexp_soil_heat(image)
 
-            #HOT PIXEL
-            d_hot_pixel=fexp_hot_pixel(image, geometryReducer,p_lowest_NDVI, p_hottest_Ts)
+            #HOT PIXEL Rn AND G
+            d_hot_pixel=fexp_hot_pixel_fluxes(image, d_hot_pixel)
 
             #SENSIBLE HEAT FLUX (H) [W M-2]
             image=fexp_sensible_heat_flux_ver_server(image, ux, UR,Rn24hobs,n_Ts_cold,
-                                               d_hot_pixel, date_string,geometryReducer, scale=scale)
+                                               d_hot_pixel, date_string,geometryReducer, scale=scale,
+                                               solver=solver)
 
             #DAILY EVAPOTRANSPIRATION (ET_24H) [MM DAY-1]
             image=fexp_et(image,Rn24hobs)
@@ -145,7 +158,8 @@ class Image():
             last_rain, cum_precip = retrievePrecipImage(date_string,
                                                         image,
                                                         precip_window=precip_window,
-                                                        cum_precip_window=cum_precip_window)
+                                                        cum_precip_window=cum_precip_window,
+                                                        cube=precip_cube)
 
             # Date bands
             mm = ee.Image(ee.Number.parse(_date.format('MM'))).rename('mm')
@@ -164,53 +178,34 @@ class Image():
                     'mm', 'dd', 'yyyy',
                     'R', 'GR', 'B',
                 ]
-            return (
-                image
-                    .reduceRegion(
-                        reducer=ee.Reducer.mean(),
-                        geometry=self.coordinate,
-                        scale=scale,
-                        maxPixels=1e14)
-                    .select(cols)
-            )
+            #PER PIXEL FEATURES, CLASSIFIED OR EXPORTED BY THE CALLER
+            return image.select(cols)
 
 
         ic5 = (
-            collection_l5
-                .map(f_albedoL5L7)
-                .map(verifyMeteoAvail)
+            fexp_meteorology_collection(collection_l5.map(f_albedoL5L7), scale=scale)
                 .filter(ee.Filter.gt('meteo_count', 0))
-                .map(lambda image: get_meteorology(image, scale=scale))
                 .map(retrieveETandMeteo)
         )
         self.ETandMeteo = ic5
 
         ic7 = (
-            collection_l7
-                .map(f_albedoL5L7)
-                .map(verifyMeteoAvail)
+            fexp_meteorology_collection(collection_l7.map(f_albedoL5L7), scale=scale)
                 .filter(ee.Filter.gt('meteo_count', 0))
-                .map(lambda image: get_meteorology(image, scale=scale))
                 .map(retrieveETandMeteo)
         )
         self.ETandMeteo = self.ETandMeteo.merge(ic7)
 
         ic8 = (
-            collection_l8
-                .map(f_albedoL8_9)
-                .map(verifyMeteoAvail)
+            fexp_meteorology_collection(collection_l8.map(f_albedoL8_9), scale=scale)
                 .filter(ee.Filter.gt('meteo_count', 0))
-                .map(lambda image: get_meteorology(image, scale=scale))
                 .map(retrieveETandMeteo)
         )
         self.ETandMeteo = self.ETandMeteo.merge(ic8)
 
         ic9 = (
-            collection_l9
-                .map(f_albedoL8_9)
-                .map(verifyMeteoAvail)
+            fexp_meteorology_collection(collection_l9.map(f_albedoL8_9), scale=scale)
                 .filter(ee.Filter.gt('meteo_count', 0))
-                .map(lambda image: get_meteorology(image, scale=scale))
                 .map(retrieveETandMeteo)
         )
         self.ETandMeteo = self.ETandMeteo.merge(ic9)
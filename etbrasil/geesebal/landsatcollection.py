@@ -31,7 +31,7 @@ def fexp_landsat_9PathRow(start_date, end_date, n_path, n_row, th_cloud_cover):
         .filterDate(start_date, end_date)
         .filterMetadata("WRS_PATH", "equals", n_path)
         .filterMetadata("WRS_ROW", "equals", n_row)
-        .map(prepSrLandsat8)
+        .map(prepSrLandsat8and9)
         .select(Constants.LANDSAT_9_BANDS["OFFICIAL"], Constants.LANDSAT_9_BANDS["CUSTOM"])
         .filterMetadata("CLOUD_COVER_LAND", "less_than", th_cloud_cover)
     )
@@ -45,7 +45,7 @@ def fexp_landsat_8PathRow(start_date, end_date, n_path, n_row, th_cloud_cover):
         .filterDate(start_date, end_date)
         .filterMetadata("WRS_PATH", "equals", n_path)
         .filterMetadata("WRS_ROW", "equals", n_row)
-        .map(prepSrLandsat8)
+        .map(prepSrLandsat8and9)
         .select(Constants.LANDSAT_8_BANDS["OFFICIAL"], Constants.LANDSAT_8_BANDS["CUSTOM"])
         .filterMetadata("CLOUD_COVER_LAND", "less_than", th_cloud_cover)
     )
@@ -0,0 +1,903 @@
+# ----------------------------------------------------------------------------------------#
+# ---------------------------------------//GEESEBAL//-------------------------------------#
+# GEESEBAL - GOOGLE EARTH ENGINE APP FOR SURFACE ENERGY BALANCE ALGORITHM FOR LAND (SEBAL)
+# CREATE BY: LEONARDO LAIPELT, RAFAEL KAYSER, ANDERSON RUHOFF AND AYAN FLEISCHMANN
+# PROJECT - ET BRASIL https://etbrasil.org/
+# LAB - HIDROLOGIA DE GRANDE ESCALA [HGE] website: https://www.ufrgs.br/hge/author/hge/
+# UNIVERSITY - UNIVERSIDADE FEDERAL DO RIO GRANDE DO SUL - UFRGS
+# RIO GRANDE DO SUL, BRAZIL
+
+# DOI
+# VERSION 0.1.1
+# CONTACT US: leonardo.laipelt@ufrgs.br
+
+# ----------------------------------------------------------------------------------------#
+#
+# LOCAL ENGINE
+#   - Same equations as tools.py, endmembers.py and evapotranspiration.py
+#     evaluated with NumPy over in-memory band arrays (no Earth Engine calls)
+#   - An "image" is a dict of band name -> ndarray. Masked pixels are NaN.
+#   - Every function returns a new dict with the same band names the
+#     Earth Engine version adds, so results can be compared band by band
+#
+# ----------------------------------------------------------------------------------------#
+# ----------------------------------------------------------------------------------------#
+
+# PYTHON PACKAGES
+import os
+import threading
+
+import numpy as np
+
+from .bandregistry import build_bands, SPEC_IND_BANDS, SEBAL_SPEC_IND_BANDS
+
+
+def _add_bands(image, bands):
+    # EQUIVALENT OF ee.Image.addBands: RETURN A NEW IMAGE, INPUT IS NOT MODIFIED
+    out = dict(image)
+    out.update(bands)
+    return out
+
+
+def _band(value):
+    # ACCEPT SCALARS, ARRAYS OR SINGLE BAND DICTS (e.g. {'AirT_G': array})
+    if isinstance(value, dict):
+        if len(value) != 1:
+            raise ValueError("Expected a single band, got " + str(list(value)))
+        value = next(iter(value.values()))
+    return np.asarray(value, dtype=np.float64)
+
+
+def _day_of_year(doy):
+    # SAME CONVENTION AS ee.Date.getRelative('day', 'year'), I.E. 0-BASED
+    return float(doy)
+
+
+# SPECTRAL INDICES MODULE
+# SAME BAND REGISTRY AS tools.fexp_spec_ind, ONLY THE ARRAYS THE REQUESTED
+# OUTPUTS NEED ARE COMPUTED (SEE bandregistry.py)
+def _ratio(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return numerator / denominator
+
+
+# NORMALIZED DIFFERENCE VEGETATION INDEX (NDVI)
+def _spec_ndvi(image, bands, options):
+    nir, red = _band(image["NIR"]), _band(image["R"])
+    return _ratio(nir - red, nir + red)
+
+
+# ENHANCED VEGETATION INDEX (EVI)
+def _spec_evi(image, bands, options):
+    nir, red, blue = _band(image["NIR"]), _band(image["R"]), _band(image["B"])
+    return 2.5 * _ratio(nir - red, nir + (6 * red) - (7.5 * blue) + 1)
+
+
+# SOIL ADHUSTED VEGETATION INDEX (SAVI)
+def _spec_savi(image, bands, options):
+    nir, red = _band(image["NIR"]), _band(image["R"])
+    return _ratio((1 + 0.5) * (nir - red), 0.5 + (nir + red))
+
+
+# NORMALIZED DIFFERENCE WATER INDEX (NDWI)
+def _spec_ndwi(image, bands, options):
+    green, nir = _band(image["GR"]), _band(image["NIR"])
+    return _ratio(green - nir, green + nir)
+
+
+# LEAF AREA INDEX (LAI)
+def _spec_lai(image, bands, options):
+    savi1 = np.where(bands["SAVI"] > 0.689, 0.689, bands["SAVI"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -(np.log((0.69 - savi1) / 0.59) / 0.91)
+
+
+def _spec_fipar(image, bands, options):
+    return np.clip(np.clip(bands["NDVI"], 0.0, 1.0) - 0.05, 0, 1)
+
+
+# BROAD-BAND SURFACE EMISSIVITY (e_0)
+def _spec_e_0(image, bands, options):
+    return np.where(bands["LAI"] > 3, 0.98, 0.95 + 0.01 * bands["LAI"])
+
+
+# NARROW BAND TRANSMISSIVITY (e_NB)
+def _spec_e_NB(image, bands, options):
+    return np.where(bands["LAI"] > 3, 0.98, 0.97 + (0.0033 * bands["LAI"]))
+
+
+# PIXEL COORDINATES, ee.Image.pixelLonLat() IN THE EARTH ENGINE VERSION
+def _spec_coordinate(name):
+    def coordinate(image, bands, options):
+        value = options.get(name)
+        if value is None:
+            value = image[name]
+        return np.broadcast_to(_band(value), _band(image["NIR"]).shape)
+    return coordinate
+
+
+# FOR FUTHER USE
+def _spec_pos_ndvi(image, bands, options):
+    return np.where(bands["NDVI"] > 0, bands["NDVI"], np.nan)
+
+
+def _spec_ones(image, bands, options):
+    return np.ones_like(_band(image["NIR"]))
+
+
+SPEC_IND_REGISTRY = {
+    "NDVI": ((), _spec_ndvi),
+    "EVI": ((), _spec_evi),
+    "SAVI": ((), _spec_savi),
+    "NDWI": ((), _spec_ndwi),
+    "LAI": (("SAVI",), _spec_lai),
+    "fipar": (("NDVI",), _spec_fipar),
+    "e_0": (("LAI",), _spec_e_0),
+    "e_NB": (("LAI",), _spec_e_NB),
+    # LAND SURFACE TEMPERATURE (LST) [K]
+    "T_LST": ((), lambda image, bands, options: _band(image["T_LST"])),
+    "longitude": ((), _spec_coordinate("longitude")),
+    "latitude": ((), _spec_coordinate("latitude")),
+    "pos_NDVI": (("NDVI",), _spec_pos_ndvi),
+    "NDVI_neg": (("pos_NDVI",), lambda image, bands, options: bands["pos_NDVI"] * -1),
+    "int": ((), _spec_ones),
+    "sd_ndvi": ((), _spec_ones),
+}
+
+
+# bands: OUTPUT BANDS TO ADD, DEFAULTS TO SPEC_IND_BANDS
+def fexp_spec_ind(image, longitude=None, latitude=None, bands=None):
+    bands = SPEC_IND_BANDS if bands is None else bands
+    options = {"longitude": longitude, "latitude": latitude}
+
+    # ADD BANDS
+    return _add_bands(image, build_bands(SPEC_IND_REGISTRY, bands, image, options))
+
+
+# SLOPE AND ASPECT [DEGREES], LOCAL EQUIVALENT OF ee.Terrain.products
+# pixel_size IS THE GROUND DISTANCE BETWEEN PIXEL CENTERS [M]
+def terrain_products(z_alt, pixel_size=30):
+    z = _band(z_alt)
+    dz_dy, dz_dx = np.gradient(z, pixel_size)
+    slope = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+    # ROWS INCREASE TO THE SOUTH, ASPECT IS CLOCKWISE FROM NORTH
+    aspect = np.degrees(np.arctan2(-dz_dx, dz_dy)) % 360
+    return {"elevation": z, "slope": slope, "aspect": aspect}
+
+
+# STATIC TERRAIN, LOCAL EQUIVALENT OF terrain.fexp_terrain:
+# elevation, slope, aspect AND THE ATMOSPHERIC PRESSURE P_ATM [KPA]
+def fexp_terrain(z_alt, pixel_size=30):
+    terrain = terrain_products(z_alt, pixel_size)
+    # SHUTTLEWORTH (2012)
+    terrain["P_ATM"] = 101.3 * ((293 - (0.0065 * terrain["elevation"])) / 293) ** 5.26
+    return terrain
+
+
+# ON-DISK TERRAIN TILE CACHE
+#   - fexp_terrain IS COMPUTED ONCE PER TILE AND STORED AS ONE .npy PER BAND
+#     UNDER cache_dir/<key>/, LATER SCENES (AND PROCESSES) MEMORY-MAP THEM
+#   - key IDENTIFIES THE TILE (e.g. WRS PATH/ROW OR A GRID CELL), THE CALLER
+#     MUST USE A NEW KEY IF THE DEM OR THE PIXEL SIZE CHANGES
+class TerrainTileCache:
+
+    BANDS = ("elevation", "slope", "aspect", "P_ATM")
+
+    def __init__(self, cache_dir, pixel_size=30):
+        self.cache_dir = cache_dir
+        self.pixel_size = pixel_size
+        self.tiles = {}
+        self.stats = {"hits": 0, "misses": 0}
+        self.lock = threading.Lock()
+
+    def path(self, key, band):
+        return os.path.join(self.cache_dir, str(key), band + ".npy")
+
+    def __contains__(self, key):
+        return all(os.path.exists(self.path(key, band)) for band in self.BANDS)
+
+    def get(self, key, z_alt=None):
+        with self.lock:
+            if key in self.tiles:
+                self.stats["hits"] += 1
+                return self.tiles[key]
+            if key in self:
+                self.stats["hits"] += 1
+            else:
+                if z_alt is None:
+                    raise KeyError("Terrain tile not cached and no elevation given: " + str(key))
+                self.stats["misses"] += 1
+                self._write(key, fexp_terrain(z_alt, self.pixel_size))
+            tile = {band: np.load(self.path(key, band), mmap_mode="r") for band in self.BANDS}
+            self.tiles[key] = tile
+            return tile
+
+    def _write(self, key, terrain):
+        os.makedirs(os.path.join(self.cache_dir, str(key)), exist_ok=True)
+        for band in self.BANDS:
+            # WRITE THEN RENAME, SO A CRASH NEVER LEAVES A TRUNCATED TILE BEHIND
+            path = self.path(key, band)
+            tmp = path[:-len(".npy")] + ".tmp.npy"
+            np.save(tmp, np.asarray(terrain[band], dtype=np.float64))
+            os.replace(tmp, path)
+
+
+# INVERSE RELATIVE  DISTANCE EARTH-SUN
+def _earth_sun_distance(doy):
+    Pi = 3.14
+    return 1 + 0.033 * np.cos(2 * Pi / 365 * _day_of_year(doy))
+
+
+# ATMOSPHERIC PRESSURE [KPA], VAPOR PRESSURES [KPA], WATER IN THE ATMOSPHERE [mm]
+# AND BROAD-BAND ATMOSPHERIC TRANSMISSIVITY, SEE fexp_atmosphere
+# pres IS THE P_ATM BAND OF fexp_terrain WHEN THE TERRAIN IS PRECOMPUTED
+def _atmosphere(z_alt, T_air, UR, SUN_ELEVATION, pres=None):
+    T_air = _band(T_air)
+
+    # SHUTTLEWORTH (2012)
+    if pres is None:
+        pres = 101.3 * ((293 - (0.0065 * _band(z_alt))) / 293) ** 5.26
+    else:
+        pres = _band(pres)
+    es = 0.6108 * np.exp((17.27 * T_air) / (T_air + 237.3))
+    ea = es * _band(UR) / 100
+
+    # GARRISON AND ADLER (1990)
+    W = (0.14 * ea * pres) + 2.1
+
+    # SOLAR ZENITH ANGLE OVER A HORIZONTAL SURFACE
+    degree2radian = 0.01745
+    cos_theta = np.cos((90 - float(SUN_ELEVATION)) * degree2radian)
+
+    # ASCE-EWRI (2005)
+    Kt = 1
+    tao_sw = 0.35 + 0.627 * np.exp(
+        ((-0.00146 * pres) / (Kt * cos_theta)) - (0.075 * (W / cos_theta) ** 0.4)
+    )
+    return {
+        "P_ATM": pres,
+        "ES": es,
+        "EA": ea,
+        "W_ATM": W,
+        "cos_theta": cos_theta,
+        "Tao_sw": tao_sw,
+    }
+
+
+# ATMOSPHERIC STATE OF A SCENE, LOCAL EQUIVALENT OF tools.fexp_atmosphere:
+# _atmosphere PLUS THE EARTH-SUN DISTANCE dr, COMPUTED ONCE AND PASSED TO
+# LST_DEM_correction AND fexp_radshort_down
+def fexp_atmosphere(z_alt, T_air, UR, SUN_ELEVATION, doy, terrain=None):
+    atm = _atmosphere(z_alt, T_air, UR, SUN_ELEVATION, None if terrain is None else terrain["P_ATM"])
+    atm["dr"] = _earth_sun_distance(doy)
+    return atm
+
+
+# LAND SURFACE TEMPERATURE WITH DEM CORRECTION AND ASPECT/SLOPE
+# JAAFAR AND AHMAD (2020)
+# slope/aspect DEFAULT TO terrain_products(z_alt, pixel_size)
+# terrain (fexp_terrain OR A TerrainTileCache TILE) PROVIDES slope, aspect AND P_ATM
+# longitude_center DEFAULTS TO THE MEAN OF THE longitude BAND
+def LST_DEM_correction(
+    image,
+    z_alt,
+    T_air,
+    UR,
+    SUN_ELEVATION,
+    hour,
+    minuts,
+    doy,
+    slope=None,
+    aspect=None,
+    longitude_center=None,
+    pixel_size=30,
+    terrain=None,
+    atmosphere=None,
+):
+    # SOLAR CONSTANT [W M-2]
+    gsc = 1367
+    degree2radian = 0.01745
+    doy = _day_of_year(doy)
+    z = _band(z_alt)
+
+    if terrain is not None:
+        slope = terrain["slope"] if slope is None else slope
+        aspect = terrain["aspect"] if aspect is None else aspect
+
+    atm = atmosphere
+    if atm is None:
+        atm = fexp_atmosphere(z, T_air, UR, SUN_ELEVATION, doy, terrain)
+    dr = atm["dr"]
+    tao_sw = atm["Tao_sw"]
+    cos_theta = atm["cos_theta"]
+
+    t_lst = _band(image["T_LST"])
+
+    # AIR DENSITY [KG M-3]
+    air_dens = (1000 * atm["P_ATM"]) / (1.01 * t_lst * 287)
+
+    # LAND SURFACE TEMPERATURE CORRECTION DEM [K]
+    Temp_lapse_rate = 0.0065
+    Temp_corr = t_lst + z * Temp_lapse_rate
+
+    # COS ZENITH ANGLE SUN ELEVATION #ALLEN ET AL. (2006)
+    if slope is None or aspect is None:
+        terrain = terrain_products(z, pixel_size)
+        slope = terrain["slope"] if slope is None else slope
+        aspect = terrain["aspect"] if aspect is None else aspect
+
+    B = (360 / 365) * (doy - 81)
+    delta = np.arcsin(np.sin(23.45 * degree2radian)) * np.sin(B * degree2radian)
+    s = _band(slope) * degree2radian
+    gamma = (_band(aspect) - 180) * degree2radian
+    phi = _band(image["latitude"]) * degree2radian
+
+    # CONSTANTS ALLEN ET AL. (2006)
+    a = (np.sin(delta) * np.cos(phi) * np.sin(s) * np.cos(gamma)) - (
+        np.sin(delta) * (np.sin(phi) * np.cos(s))
+    )
+    b = (np.cos(delta) * np.cos(phi) * np.cos(s)) + (
+        np.cos(delta) * (np.sin(phi) * np.sin(s) * np.cos(gamma))
+    )
+    c = np.cos(delta) * np.sin(s) * np.sin(gamma)
+
+    # GET IMAGE CENTROID
+    if longitude_center is None:
+        longitude_center = np.nanmean(_band(image["longitude"]))
+
+    # DELTA GTM (ee.Number.int() TRUNCATES TOWARDS ZERO)
+    DELTA_GTM = int(float(longitude_center) / 15)
+
+    # LOCAL HOUR TIME
+    Local_hour_time = float(hour) + DELTA_GTM + float(minuts) / 60
+    HOUR_A = (Local_hour_time - 12) * 15
+    w = HOUR_A * degree2radian
+
+    cos_zn = -a + b * np.cos(w) + c * np.sin(w)
+
+    # LAND SURFACE TEMPERATURE WITH ASPECT/SLOPE CORRECTION [K]
+    TS_DEM = Temp_corr + (
+        gsc * dr * tao_sw * cos_zn - gsc * dr * tao_sw * cos_theta
+    ) / (air_dens * 1004 * 0.050)
+
+    # MASKS FOR SELECT PRE-CANDIDATES PIXELS
+    lst_neg = TS_DEM * -1
+    lst_nw = np.where(_band(image["NDWI"]) <= 0, TS_DEM, np.nan)
+
+    # ADD BANDS
+    return _add_bands(image, {"T_LST_DEM": TS_DEM, "LST_neg": lst_neg, "LST_NW": lst_nw})
+
+
+# INSTANTANEOUS OUTGOING LONG-WAVE RADIATION (Rl_up) [W M-2]
+def fexp_radlong_up(image):
+    # BROAD-BAND SURFACE THERMAL EMISSIVITY
+    # TASUMI ET AL. (2003)
+    # ALLEN ET AL. (2007)
+    lai = _band(image["LAI"])
+    emi = np.where(lai > 3, 0.98, 0.95 + (0.01 * lai))
+    stefBol = 5.67e-8
+
+    Rl_up = emi * stefBol * (_band(image["T_LST"]) ** 4)
+
+    # ADD BANDS
+    return _add_bands(image, {"Rl_up": Rl_up})
+
+
+# INSTANTANEOUS INCOMING SHORT-WAVE RADIATION (Rs_down) [W M-2]
+def fexp_radshort_down(image, z_alt, T_air, UR, SUN_ELEVATION, doy, terrain=None, atmosphere=None):
+    # SOLAR CONSTANT
+    gsc = 1367  # [W M-2]
+
+    atm = atmosphere
+    if atm is None:
+        atm = fexp_atmosphere(z_alt, T_air, UR, SUN_ELEVATION, doy, terrain)
+    dr = atm["dr"]
+
+    # INSTANTANEOUS SHORT-WAVE RADIATION (Rs_down) [W M-2]
+    Rs_down = gsc * atm["cos_theta"] * atm["Tao_sw"] * dr
+
+    # ADD BANDS (SCALAR METEOROLOGY IS EXPANDED TO FULL BANDS)
+    shape = _band(image["T_LST"]).shape
+    bands = {"Rs_down": Rs_down, "Tao_sw": atm["Tao_sw"], "ES": atm["ES"], "EA": atm["EA"]}
+    return _add_bands(image, {k: np.broadcast_to(v, shape) for k, v in bands.items()})
+
+
+# INSTANTANEOUS INCOMING LONGWAVE RADIATION (Rl_down) [W M-2]
+# ALLEN ET AL (2007)
+def fexp_radlong_down(image, n_Ts_cold):
+    log_taosw = np.log(_band(image["Tao_sw"]))
+    Rl_down = (0.85 * (-log_taosw) ** 0.09) * 5.67e-8 * (float(n_Ts_cold) ** 4)
+
+    # ADD BANDS
+    return _add_bands(image, {"Rl_down": Rl_down})
+
+
+# INSTANTANEOUS NET RADIATON BALANCE (Rn) [W M-2]
+def fexp_radbalance(image):
+    Rl_down = _band(image["Rl_down"])
+    Rn = (
+        ((1 - _band(image["ALFA"])) * _band(image["Rs_down"]))
+        + Rl_down
+        - _band(image["Rl_up"])
+        - ((1 - _band(image["e_0"])) * Rl_down)
+    )
+
+    # ADD BANDS
+    return _add_bands(image, {"Rn": Rn})
+
+
+# SOIL HEAT FLUX (G) [W M-2]
+# BASTIAANSSEN (2000)
+def fexp_soil_heat(image):
+    alfa = _band(image["ALFA"])
+    G = (
+        _band(image["Rn"])
+        * (_band(image["T_LST_DEM"]) - 273.15)
+        * (0.0038 + (0.0074 * alfa))
+        * (1 - 0.98 * (_band(image["NDVI"]) ** 4))
+    )
+
+    # ADD BANDS
+    return _add_bands(image, {"G": G})
+
+
+# SELECT COLD PIXEL
+# SEE endmembers.fexp_cold_pixel. stratifiedSample IS REPLACED BY A
+# UNIFORM DRAW FROM THE CANDIDATES, USE seed FOR REPRODUCIBLE RESULTS
+def fexp_cold_pixel(image, refpoly, p_top_NDVI, p_coldest_Ts, seed=None):
+    region = _region(image, refpoly)
+
+    # IDENTIFY THE TOP % NDVI PIXELS
+    ndvi_neg = np.where(region, _band(image["NDVI_neg"]), np.nan)
+    n_perc_top_NDVI = _nanpercentile(ndvi_neg, p_top_NDVI)
+    top_ndvi = ndvi_neg <= n_perc_top_NDVI
+
+    # SELECT THE COLDEST TS FROM PREVIOUS NDVI GROUP
+    lst_nw = _band(image["LST_NW"])
+    n_perc_low_LST = _nanpercentile(np.where(top_ndvi, lst_nw, np.nan), p_coldest_Ts)
+
+    # FILTERS
+    candidates = top_ndvi & (lst_nw <= n_perc_low_LST) & (lst_nw >= 200)
+
+    return _pick_pixel(image, candidates, {"temp": "LST_NW", "ndvi": "NDVI"}, seed)
+
+
+# SELECT HOT PIXEL
+def fexp_hot_pixel(image, refpoly, p_lowest_NDVI, p_hottest_Ts, seed=None):
+    region = _region(image, refpoly)
+
+    # IDENTIFY THE DOWN % NDVI PIXELS
+    pos_ndvi = np.where(region, _band(image["pos_NDVI"]), np.nan)
+    n_perc_low_NDVI = _nanpercentile(pos_ndvi, p_lowest_NDVI)
+    low_ndvi = pos_ndvi <= n_perc_low_NDVI
+
+    # SELECT THE HOTTEST TS FROM PREVIOUS NDVI GROUP
+    lst_neg = _band(image["LST_neg"])
+    n_perc_top_lst = _nanpercentile(np.where(low_ndvi, lst_neg, np.nan), p_hottest_Ts)
+
+    candidates = low_ndvi & (lst_neg <= n_perc_top_lst) & ~np.isnan(_band(image["LST_NW"]))
+
+    bands = {"temp": "LST_NW", "ndvi": "NDVI", "Rn": "Rn", "G": "G"}
+    return _pick_pixel(image, candidates, bands, seed)
+
+
+# SELECT COLD AND HOT PIXELS TOGETHER, SEE endmembers.fexp_endmembers
+# Rn AND G ARE ADDED TO THE HOT PIXEL BY fexp_hot_pixel_fluxes
+def fexp_endmembers(
+    image, refpoly, p_top_NDVI, p_coldest_Ts, p_lowest_NDVI, p_hottest_Ts, seed=None
+):
+    region = _region(image, refpoly)
+    lst_nw = _band(image["LST_NW"])
+    lst_neg = _band(image["LST_neg"])
+
+    # IDENTIFY THE TOP % AND DOWN % NDVI PIXELS
+    ndvi_neg = np.where(region, _band(image["NDVI_neg"]), np.nan)
+    pos_ndvi = np.where(region, _band(image["pos_NDVI"]), np.nan)
+    top_ndvi = ndvi_neg <= _nanpercentile(ndvi_neg, p_top_NDVI)
+    low_ndvi = pos_ndvi <= _nanpercentile(pos_ndvi, p_lowest_NDVI)
+
+    # SELECT THE COLDEST AND HOTTEST TS FROM PREVIOUS NDVI GROUPS
+    n_perc_low_LST = _nanpercentile(np.where(top_ndvi, lst_nw, np.nan), p_coldest_Ts)
+    n_perc_top_lst = _nanpercentile(np.where(low_ndvi, lst_neg, np.nan), p_hottest_Ts)
+
+    # FILTERS
+    cold = top_ndvi & (lst_nw <= n_perc_low_LST) & (lst_nw >= 200)
+    hot = low_ndvi & (lst_neg <= n_perc_top_lst) & ~np.isnan(lst_nw)
+
+    bands = {"temp": "LST_NW", "ndvi": "NDVI"}
+    return _pick_pixel(image, cold, bands, seed), _pick_pixel(image, hot, bands, seed)
+
+
+# ADD Rn AND G AT THE HOT PIXEL
+def fexp_hot_pixel_fluxes(image, d_hot_pixel):
+    row, col = _hot_pixel_index(image, d_hot_pixel)
+    d_hot_pixel = dict(d_hot_pixel)
+    d_hot_pixel["Rn"] = float(_band(image["Rn"])[row, col])
+    d_hot_pixel["G"] = float(_band(image["G"])[row, col])
+    return d_hot_pixel
+
+
+def _region(image, refpoly):
+    # refpoly IS AN OPTIONAL BOOLEAN MASK WITH THE SHAPE OF THE BANDS
+    shape = _band(image["NDVI"]).shape
+    if refpoly is None:
+        return np.ones(shape, dtype=bool)
+    return np.broadcast_to(np.asarray(refpoly, dtype=bool), shape)
+
+
+def _nanpercentile(values, p):
+    if np.all(np.isnan(values)):
+        return np.nan
+    return np.nanpercentile(values, float(p))
+
+
+def _pick_pixel(image, candidates, bands, seed):
+    rows, cols = np.nonzero(candidates)
+    out = {"sum": int(rows.size)}
+    if rows.size == 0:
+        out.update({key: None for key in list(bands) + ["x", "y", "row", "col"]})
+        return out
+
+    k = np.random.default_rng(seed).integers(rows.size)
+    row, col = int(rows[k]), int(cols[k])
+    for key, name in bands.items():
+        out[key] = float(_band(image[name])[row, col]) if name in image else None
+    out["x"] = float(_band(image["longitude"])[row, col])
+    out["y"] = float(_band(image["latitude"])[row, col])
+    out["row"] = row
+    out["col"] = col
+    return out
+
+
+def _hot_pixel_index(image, d_hot_pixel):
+    # PIXEL INDEX OF THE HOT PIXEL, FROM THE DICTIONARY OR NEAREST TO (x, y)
+    if d_hot_pixel.get("row") is not None and d_hot_pixel.get("col") is not None:
+        return int(d_hot_pixel["row"]), int(d_hot_pixel["col"])
+    dist = (_band(image["longitude"]) - float(d_hot_pixel["x"])) ** 2 + (
+        _band(image["latitude"]) - float(d_hot_pixel["y"])
+    ) ** 2
+    return np.unravel_index(np.nanargmin(dist), dist.shape)
+
+
+# STABILITY CORRECTIONS FOR MOMENTUM AND HEAT TRANSPORT
+# PAULSON (1970)
+# WEBB (1970)
+def _stability_corrections(L):
+    L = np.asarray(L, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # STABILITY CORRECTIONS FOR STABLE CONDITIONS
+        psim_200 = -5 * (200 / L)
+        psih_2 = -5 * (2 / L)
+        psih_01 = -5 * (0.1 / L)
+
+        # FOR DIFFERENT HEIGHT
+        x200 = (1 - (16 * (200 / L))) ** 0.25
+        x2 = (1 - (16 * (2 / L))) ** 0.25
+        x01 = (1 - (16 * (0.1 / L))) ** 0.25
+
+        # STABILITY CORRECTIONS FOR UNSTABLE CONDITIONS
+        psimu_200 = (
+            2 * np.log((1 + x200) / 2)
+            + np.log((1 + x200**2) / 2)
+            - 2 * np.arctan(x200)
+            + 0.5 * 3.14159265
+        )
+        psihu_2 = 2 * np.log((1 + x2**2) / 2)
+        psihu_01 = 2 * np.log((1 + x01**2) / 2)
+
+    # FOR EACH PIXEL
+    psim_200 = np.where(L < 0, psimu_200, psim_200)
+    psih_2 = np.where(L < 0, psihu_2, psih_2)
+    psih_01 = np.where(L < 0, psihu_01, psih_01)
+    psim_200 = np.where(L == 0, 0, psim_200)
+    psih_2 = np.where(L == 0, 0, psih_2)
+    psih_01 = np.where(L == 0, 0, psih_01)
+    return psim_200, psih_2, psih_01
+
+
+# SENSIBLE HEAT FLUX (H) AT THE HOT PIXEL ONLY
+# RETURNS THE dT = a*Ts + b COEFFICIENTS AND THE NUMBER OF ITERATIONS RUN.
+# STOPS WHEN THE HOT PIXEL dT CHANGES LESS THAN tolerance [K]
+def _hot_pixel_iteration(
+    n_rah_hot, n_ufric_hot, n_u200_hot, n_zom_hot, n_Ts_cold, n_Ts_hot, n_H_hot,
+    tolerance=0.01, max_iterations=15,
+):
+    n_Cp = 1004
+    n_ro_hot = (-0.0046 * n_Ts_hot) + 2.5538
+    n_coef_a = n_coef_b = np.nan
+    n = 0
+    while n < max_iterations:
+        n += 1
+        n_dT_hot = (n_H_hot * n_rah_hot) / (n_ro_hot * n_Cp)
+        n_coef_a = (0 - n_dT_hot) / (n_Ts_cold - n_Ts_hot)
+        n_coef_b = n_dT_hot - (n_coef_a * n_Ts_hot)
+
+        n_ro = (-0.0046 * (n_Ts_hot - n_dT_hot)) + 2.5538
+        n_H = (n_ro * n_Cp * n_dT_hot) / n_rah_hot
+        n_L = -(n_ro * n_Cp * (n_ufric_hot**3) * n_Ts_hot) / (0.41 * 9.81 * n_H)
+        n_psim_200, n_psih_2, n_psih_01 = (float(v) for v in _stability_corrections(n_L))
+
+        n_ufric_hot = (n_u200_hot * 0.41) / (np.log(200 / n_zom_hot) - n_psim_200)
+        n_rah_new = (np.log(2 / 0.1) - n_psih_2 + n_psih_01) / (n_ufric_hot * 0.41)
+        n_dif = abs((n_H_hot * n_rah_new) / (n_ro_hot * n_Cp) - n_dT_hot)
+        n_rah_hot = n_rah_new
+        if n_dif < tolerance:
+            break
+    return n_coef_a, n_coef_b, n
+
+
+# SENSIBLE HEAT FLUX (H) [W M-2]
+# UR, Rn24hobs AND date_string ARE ACCEPTED FOR PARITY WITH tools.py AND UNUSED
+# solver="scalar" ITERATES ON THE HOT PIXEL ONLY (STOPS ON dT), SEE tools.py
+# SAME dT AS solver="image", rah AND H FROM ONE STABILITY CORRECTION
+def fexp_sensible_heat_flux_ver_server(
+    image, ux, UR, Rn24hobs, n_Ts_cold, d_hot_pixel, date_string=None, refpoly=None, scale=30,
+    solver="image", tolerance=0.01, max_iterations=15,
+):
+    # VEGETATION HEIGHTS  [M]
+    n_veg_hight = 3
+
+    # WIND SPEED AT HEIGHT Zx [M]
+    n_zx = 2
+
+    # BLENDING HEIGHT [M]
+    n_hight = 200
+
+    # AIR SPECIFIC HEAT [J kg-1/K-1]
+    n_Cp = 1004
+
+    # VON KARMAN'S CONSTANT
+    n_K = 0.41
+
+    n_Ts_cold = float(n_Ts_cold)
+    n_Ts_hot = float(d_hot_pixel["temp"])
+    n_G_hot = float(d_hot_pixel["G"])
+    n_Rn_hot = float(d_hot_pixel["Rn"])
+    hot = _hot_pixel_index(image, d_hot_pixel)
+
+    i_savi = _band(image["SAVI"])
+    ux = _band(ux)
+
+    # MOMENTUM ROUGHNESS LENGHT (ZOM) AT THE WEATHER STATION [M]
+    # BRUTSAERT (1982)
+    n_zom = n_veg_hight * 0.12
+
+    # FRICTION VELOCITY AT WEATHER STATION [M S-1]
+    i_ufric_ws = (n_K * ux) / np.log(n_zx / n_zom)
+
+    # WIND SPEED AT BLENDING HEIGHT AT THE WEATHER STATION [M S-1]
+    i_u200 = np.broadcast_to(i_ufric_ws * (np.log(n_hight / n_zom) / n_K), i_savi.shape)
+
+    # MOMENTUM ROUGHNESS LENGHT (ZOM) FOR EACH PIXEL [M]
+    i_zom = np.exp((5.62 * i_savi) - 5.809)
+
+    # FRICTION VELOCITY FOR EACH PIXEL  [M S-1]
+    # (AS IN tools.py THE FIRST ESTIMATE USES THE WEATHER STATION ZOM)
+    i_u_fr = (n_K * i_u200) / np.log(n_hight / n_zom)
+    i_ufric = i_u_fr
+
+    # Z1 AND Z2 ARE HEIGHTS [M] ABOVE THE ZERO PLANE DISPLACEMENT
+    # OF THE VEGETATION
+    z1 = 0.1
+    z2 = 2
+    i_rah = np.log(z2 / z1) / (i_ufric * 0.41)
+    i_rah_first = i_rah
+
+    # AIR DENSITY HOT PIXEL
+    n_ro_hot = (-0.0046 * n_Ts_hot) + 2.5538
+
+    # SENSIBLE HEAT FLUX AT THE HOT PIXEL (H_hot)
+    n_H_hot = n_Rn_hot - n_G_hot
+
+    # NEAR SURFACE TEMPERATURE DIFFERENCE IN COLD PIXEL (dT= tZ1-tZ2)
+    n_dT_cold = 0
+
+    i_lst_med = _band(image["T_LST_DEM"])
+    region = None if refpoly is None else _region(image, refpoly)
+
+    def coefficients(n_rah_hot):
+        # NEAR SURFACE TEMPERATURE DIFFERENCE IN HOT PIXEL (dT= Tz1-Tz2)  [K] dThot= Hhot*rah/(ρCp)
+        n_dT_hot = (n_H_hot * n_rah_hot) / (n_ro_hot * n_Cp)
+
+        # ANGULAR COEFFICIENT
+        n_coef_a = (n_dT_cold - n_dT_hot) / (n_Ts_cold - n_Ts_hot)
+
+        # LINEAR COEFFICIENT
+        n_coef_b = n_dT_hot - (n_coef_a * n_Ts_hot)
+        return n_coef_a, n_coef_b
+
+    def pixel_step(n_coef_a, n_coef_b, i_ufric, i_rah):
+        # dT FOR EACH PIXEL [K]
+        i_dT_int = (n_coef_a * i_lst_med) + n_coef_b
+        if region is not None:
+            i_dT_int = np.where(region, i_dT_int, np.nan)
+
+        # AIR TEMPERATURE (TA) FOR EACH PIXEL (TA=TS-dT) [K]
+        i_Ta = i_lst_med - i_dT_int
+
+        # AIR DENSITY (ro) [KM M-3]
+        i_ro = (-0.0046 * i_Ta) + 2.5538
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # SENSIBLE HEAT FLUX (H) FOR EACH PIXEL  [W M-2]
+            i_H_int = (i_ro * n_Cp * i_dT_int) / i_rah
+
+            # MONIN-OBUKHOV LENGTH (L) - FOR STABILITY CONDITIONS OF THE ATMOSPHERE IN THE ITERATIVE PROCESS
+            i_L_int = -(i_ro * n_Cp * (i_ufric**3) * i_lst_med) / (0.41 * 9.81 * i_H_int)
+
+            i_psim_200, i_psih_2, i_psih_01 = _stability_corrections(i_L_int)
+
+            # CORRECTED VALUE FOR THE FRICTION VELOCITY (i_ufric) [M S-1]
+            i_ufric = (i_u200 * 0.41) / (np.log(n_hight / i_zom) - i_psim_200)
+
+            # CORRECTED VALUE FOR THE AERODYNAMIC RESISTANCE TO THE HEAT TRANSPORT (rah) [S M-1]
+            i_rah = (np.log(z2 / z1) - i_psih_2 + i_psih_01) / (i_ufric * 0.41)
+        return i_dT_int, i_ro, i_ufric, i_rah
+
+    # ========ITERATIVE PROCESS=========#
+    if solver == "image":
+        for n in range(15):
+            # AERODYNAMIC RESISTANCE TO HEAT TRANSPORT IN HOT PIXEL
+            n_coef_a, n_coef_b = coefficients(float(i_rah[hot]))
+            i_dT_int, i_ro, i_ufric, i_rah = pixel_step(n_coef_a, n_coef_b, i_ufric, i_rah)
+    elif solver == "scalar":
+        n_coef_a, n_coef_b, _ = _hot_pixel_iteration(
+            float(i_rah[hot]), float(i_ufric[hot]), float(i_u200[hot]), float(i_zom[hot]),
+            n_Ts_cold, n_Ts_hot, n_H_hot, tolerance=tolerance, max_iterations=max_iterations,
+        )
+        i_dT_int, i_ro, i_ufric, i_rah = pixel_step(n_coef_a, n_coef_b, i_ufric, i_rah)
+    else:
+        raise ValueError("solver must be 'image' or 'scalar'")
+
+    # =========END ITERATION =========#
+
+    # GET FINAL rah, dT AND H
+    with np.errstate(divide="ignore", invalid="ignore"):
+        i_H_final = (i_ro * n_Cp * i_dT_int) / i_rah  # [W M-2]
+
+    # ADD BANDS
+    return _add_bands(
+        image,
+        {
+            "H": i_H_final,
+            "rah": i_rah,
+            "dT": i_dT_int,
+            "rah_first": i_rah_first,
+            "zom": i_zom,
+            "u_fr": i_u_fr,
+            "ufric_star": i_ufric,
+        },
+    )
+
+
+# DAILY EVAPOTRANSPIRATION (ET_24h) [MM DAY-1]
+def fexp_et(image, Rn24hobs):
+    # NET DAILY RADIATION (Rn24h) [W M-2]
+    # BRUIN (1982)
+    if isinstance(Rn24hobs, dict) and "Rn24h_G" in Rn24hobs:
+        Rn24hobs = Rn24hobs["Rn24h_G"]
+    Rn24hobs = _band(Rn24hobs)
+
+    # GET ENERGY FLUXES VARIABLES AND LST
+    i_Rn = _band(image["Rn"])
+    i_G = _band(image["G"])
+    i_lst = _band(image["T_LST_DEM"])
+    i_H_final = _band(image["H"])
+
+    # FILTER VALUES
+    i_H_final = np.where(i_H_final < 0, 0, i_H_final)
+
+    # INSTANTANEOUS LATENT HEAT FLUX (LE) [W M-2]
+    # BASTIAANSSEN ET AL. (1998)
+    i_lambda_ET = i_Rn - i_G - i_H_final
+
+    # LATENT HEAT OF VAPORIZATION (LAMBDA) [J KG-1]
+    # BISHT ET AL.(2005)
+    # LAGOUARDE AND BURNET (1983)
+    i_lambda = 2.501 - 0.002361 * (i_lst - 273.15)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # INSTANTANEOUS ET (ET_inst) [MM H-1]
+        i_ET_inst = 0.0036 * (i_lambda_ET / i_lambda)
+
+        # EVAPORATIVE FRACTION (EF)
+        # CRAGO (1996)
+        i_EF = i_lambda_ET / (i_Rn - i_G)
+
+        # DAILY EVAPOTRANSPIRATION (ET_24h) [MM DAY-1]
+        i_ET24h_calc = (0.0864 * i_EF * Rn24hobs) / i_lambda
+
+    # ADD BANDS
+    return _add_bands(
+        image, {"ET_inst": i_ET_inst, "ET_24h": i_ET24h_calc, "LE": i_lambda_ET, "EF": i_EF}
+    )
+
+
+# ALBEDO
+# TASUMI ET AL(2008) FOR LANDSAT 5 AND 7
+def f_albedoL5L7(image):
+    alfa = (
+        (0.254 * _band(image["B"]))
+        + (0.149 * _band(image["GR"]))
+        + (0.147 * _band(image["R"]))
+        + (0.311 * _band(image["NIR"]))
+        + (0.103 * _band(image["SWIR_1"]))
+        + (0.036 * _band(image["SWIR_2"]))
+    )
+    return _add_bands(image, {"ALFA": alfa})
+
+
+# ALBEDO
+# USING TASUMI ET AL. (2008) METHOD FOR LANDSAT 8 and 9
+# COEFFICIENTS FROM KE ET AL. (2016)
+def f_albedoL8_9(image):
+    alfa = (
+        (0.130 * _band(image["UB"]))
+        + (0.115 * _band(image["B"]))
+        + (0.143 * _band(image["GR"]))
+        + (0.180 * _band(image["R"]))
+        + (0.281 * _band(image["NIR"]))
+        + (0.108 * _band(image["SWIR_1"]))
+        + (0.042 * _band(image["SWIR_2"]))
+    )
+    return _add_bands(image, {"ALFA": alfa})
+
+
+# FULL SEBAL CHAIN FOR ONE SCENE, SAME ORDER AS TimeSeries.retrieveETandMeteo
+# image NEEDS THE LANDSAT BANDS, ALFA, longitude AND latitude.
+# meteorology NEEDS AirT_G, ux_G, RH_G AND Rn24h_G (ARRAYS OR SCALARS)
+# terrain (OPTIONAL) IS fexp_terrain(z_alt) OR A TerrainTileCache TILE, REUSED ACROSS SCENES
+def fexp_sebal(
+    image,
+    z_alt,
+    meteorology,
+    sun_elevation,
+    hour,
+    minuts,
+    doy,
+    NDVI_cold=5,
+    Ts_cold=20,
+    NDVI_hot=10,
+    Ts_hot=20,
+    refpoly=None,
+    slope=None,
+    aspect=None,
+    pixel_size=30,
+    seed=None,
+    solver="image",
+    terrain=None,
+):
+    T_air = meteorology["AirT_G"]
+    ux = meteorology["ux_G"]
+    UR = meteorology["RH_G"]
+    Rn24hobs = meteorology["Rn24h_G"]
+
+    image = fexp_spec_ind(image, bands=SEBAL_SPEC_IND_BANDS)
+    atmosphere = fexp_atmosphere(z_alt, T_air, UR, sun_elevation, doy, terrain)
+    image = LST_DEM_correction(
+        image, z_alt, T_air, UR, sun_elevation, hour, minuts, doy,
+        slope=slope, aspect=aspect, pixel_size=pixel_size, terrain=terrain,
+        atmosphere=atmosphere,
+    )
+
+    d_cold_pixel, d_hot_pixel = fexp_endmembers(
+        image, refpoly, NDVI_cold, Ts_cold, NDVI_hot, Ts_hot, seed=seed
+    )
+    if d_cold_pixel["temp"] is None:
+        raise ValueError("No cold pixel candidates")
+    if d_hot_pixel["temp"] is None:
+        raise ValueError("No hot pixel candidates")
+
+    image = fexp_radlong_up(image)
+    image = fexp_radshort_down(image, z_alt, T_air, UR, sun_elevation, doy, atmosphere=atmosphere)
+    image = fexp_radlong_down(image, d_cold_pixel["temp"])
+    image = fexp_radbalance(image)
+    image = fexp_soil_heat(image)
+
+    d_hot_pixel = fexp_hot_pixel_fluxes(image, d_hot_pixel)
+
+    image = fexp_sensible_heat_flux_ver_server(
+        image, ux, UR, Rn24hobs, d_cold_pixel["temp"], d_hot_pixel, refpoly=refpoly, solver=solver
+    )
+    image = fexp_et(image, Rn24hobs)
+    return image, d_cold_pixel, d_hot_pixel
@@ -24,6 +24,9 @@
 #PYTHON PACKAGES
 #Call EE
 import ee
+import math
+import threading
+from collections import OrderedDict
 from .constants import Constants
 
 #GLOBAL LAND DATA ASSIMILATION SYSTEM (GLDAS)
@@ -31,42 +34,37 @@ from .constants import Constants
 #2000 TO PRESENT - GLDAS 2.1
 #3h, 6h, 9h, 12h, 15h, 18h, 21h, 00h
 
-def verifyMeteoAvail(image):
-    DATASET = ee.ImageCollection(Constants.WEATHER_COLLECTION)
-
-    time_start = image.get('system:time_start')
-    TIME_START_NUM=ee.Number(time_start)
-    PREVIOUS_TIME=TIME_START_NUM.subtract(3*60*60*1000)
-    NEXT_TIME=TIME_START_NUM.add(3*60*60*1000)
-
-    PREVIOUS_IMAGE=(DATASET.filter(ee.Filter.date(PREVIOUS_TIME,TIME_START_NUM))
-                          .limit(1, 'system:time_start', False))#.first())
-
-    return image.set('meteo_count', PREVIOUS_IMAGE.aggregate_count('system:time_start'))
-
-def get_meteorology(image, scale=None):
+#INTERPOLATION BETWEEN THE HOURLY ERA5-LAND IMAGES AROUND THE ACQUISITION
+#EVERYTHING THAT ONLY DEPENDS ON THE ACQUISITION HOUR (THE ERA5 IMAGES BEFORE AND
+#AFTER IT, GLDAS HUMIDITY, Ra_24h AND Rs_24h) IS BUILT ONCE PER HOUR BY
+#fexp_meteo_stack, ONLY THE INTERPOLATION WEIGHT, THE ALBEDO AND THE
+#REPROJECTION ARE PER IMAGE (fexp_apply_meteorology)
+HOUR_MS = 60*60*1000
+STACK_BANDS = ['temperature_2m', 'u_component_of_wind_10m', 'v_component_of_wind_10m',
+               'dewpoint_temperature_2m', 'surface_pressure']
+
+def fexp_meteo_hour(time_start):
+    # start of the hour of the acquisition [ms]
+    if isinstance(time_start, (int, float)):
+        return int(time_start // HOUR_MS) * HOUR_MS
+    TIME_START_NUM = ee.Number(time_start)
+    return TIME_START_NUM.subtract(TIME_START_NUM.mod(HOUR_MS))
+
+def fexp_meteo_stack(hour_start, region=None):
     DATASET = ee.ImageCollection(Constants.WEATHER_COLLECTION)
+    HOUR = ee.Number(hour_start)
 
-    #LINEAR INTERPOLATION
-    time_start = image.get('system:time_start')
-    TIME_START_NUM=ee.Number(time_start)
-    PREVIOUS_TIME=TIME_START_NUM.subtract(3*60*60*1000)
-    NEXT_TIME=TIME_START_NUM.add(3*60*60*1000)
-
-    PREVIOUS_IMAGE=(DATASET.filter(ee.Filter.date(PREVIOUS_TIME,TIME_START_NUM))
-                          .limit(1, 'system:time_start', False).first())
-
-    NEXT_IMAGE=(DATASET.filter(ee.Filter.date(TIME_START_NUM,NEXT_TIME))
-                          .limit(1, 'system:time_start', False).first())
+    #FOR AN ACQUISITION AT HOUR + m (0 < m < 1h) THE PREVIOUS IMAGE IS THE LAST ONE
+    #IN [t - 3h, t) AND THE NEXT IS THE LAST ONE IN [t, t + 3h), i.e. HOUR AND HOUR + 3h
+    PREVIOUS_COLLECTION = DATASET.filter(ee.Filter.date(HOUR, HOUR.add(HOUR_MS)))
+    NEXT_COLLECTION = DATASET.filter(ee.Filter.date(HOUR.add(3*HOUR_MS), HOUR.add(4*HOUR_MS)))
+    meteo_count = PREVIOUS_COLLECTION.size().min(NEXT_COLLECTION.size())
 
-    IMAGE_PREVIOUS_TIME= ee.Number(PREVIOUS_IMAGE.get('system:time_start'))
-
-    IMAGE_NEXT_TIME=ee.Number(NEXT_IMAGE.get('system:time_start'))
-
-    DELTA_TIME=(TIME_START_NUM.subtract(IMAGE_PREVIOUS_TIME)).divide(IMAGE_NEXT_TIME.subtract(IMAGE_PREVIOUS_TIME))
+    PREVIOUS_IMAGE = ee.Image(PREVIOUS_COLLECTION.first())
+    NEXT_IMAGE = ee.Image(NEXT_COLLECTION.first())
 
     #DAY OF THE YEAR
-    dateStr = ee.Date(time_start);
+    dateStr = ee.Date(HOUR);
     doy = dateStr.getRelative('day', 'year');
     Pi=ee.Number(3.14);
 
@@ -110,15 +108,54 @@ def get_meteorology(image, scale=None):
           'solar_dec': solar_dec,
           'lat_rad': i_lat_rad}).rename('Ra_24h');
 
-    i_Ra_24h=i_Ra_24h.select('Ra_24h').reduce(ee.Reducer.mean());
+    i_Ra_24h=i_Ra_24h.select('Ra_24h').reduce(ee.Reducer.mean()).rename('Ra_24h');
 
     #INCOMING SHORT-WAVE RADIATION DAILY EAN [W M-2]
-    i_Rs_24h = ee.ImageCollection(Constants.WEATHER_COLLECTION)\
-                .filterDate(ee.Date(time_start).advance(-11,'hour'),ee.Date(time_start).advance(13,'hour'))\
+    #THE 24 HOURLY IMAGES FROM t - 11h TO t + 13h
+    i_Rs_24h = DATASET\
+                .filterDate(HOUR.subtract(10*HOUR_MS), HOUR.add(14*HOUR_MS))\
                 .select("surface_solar_radiation_downwards_hourly")\
                 .sum()\
                 .divide(86400).rename('SW_Down')
 
+    # SPECIFIC HUMIDITY [KG KG-1]
+    #FIRST GLDAS IMAGE AFTER THE ACQUISITION
+    i_q_col = ee.ImageCollection(Constants.WEATHER_NASA_GLDAS_V021_NOAH_G025_T3H).select(['Qair_f_inst'],["specific_humidity"])
+    if region is not None:
+        i_q_col = i_q_col.filterBounds(region)
+    i_q_med = i_q_col.filter(ee.Filter.date(HOUR.add(HOUR_MS), HOUR.add(HOUR_MS).add(24*HOUR_MS))).first();
+
+    stack = ee.Image.cat(
+        PREVIOUS_IMAGE.select(STACK_BANDS, ['prev_' + band for band in STACK_BANDS]),
+        NEXT_IMAGE.select(STACK_BANDS, ['next_' + band for band in STACK_BANDS]),
+        i_q_med, i_Ra_24h, i_Rs_24h)
+
+    # without ERA5 images the stack is empty, only meteo_count can be read from it
+    stack = ee.Image(ee.Algorithms.If(meteo_count.gt(0), stack, ee.Image()))
+    return stack.set({
+        'meteo_hour': HOUR,
+        'meteo_count': meteo_count,
+        'previous_time': HOUR,
+        'next_time': HOUR.add(3*HOUR_MS),
+    })
+
+def fexp_apply_meteorology(image, stack, scale=None):
+    stack = ee.Image(stack)
+
+    #LINEAR INTERPOLATION
+    TIME_START_NUM=ee.Number(image.get('system:time_start'))
+    IMAGE_PREVIOUS_TIME= ee.Number(stack.get('previous_time'))
+    IMAGE_NEXT_TIME=ee.Number(stack.get('next_time'))
+    DELTA_TIME=(TIME_START_NUM.subtract(IMAGE_PREVIOUS_TIME)).divide(IMAGE_NEXT_TIME.subtract(IMAGE_PREVIOUS_TIME))
+
+    def interpolate(band):
+        return stack.select('next_' + band)\
+            .subtract(stack.select('prev_' + band))\
+            .multiply(DELTA_TIME).add(stack.select('prev_' + band))
+
+    i_Ra_24h = stack.select('Ra_24h')
+    i_Rs_24h = stack.select('SW_Down')
+
     # TASUMI
     i_albedo_ls =image.select('ALFA')
 
@@ -132,19 +169,11 @@ def get_meteorology(image, scale=None):
            'i_Ra_24h': i_Ra_24h}).rename('Rn24h_G');
 
     # AIR TEMPERATURE [K]
-    tair_c = NEXT_IMAGE.select('temperature_2m')\
-        .subtract(PREVIOUS_IMAGE.select('temperature_2m'))\
-        .multiply(DELTA_TIME).add(PREVIOUS_IMAGE.select('temperature_2m'))\
-        .rename('AirT_G')
+    tair_c = interpolate('temperature_2m').rename('AirT_G')
 
     # WIND SPEED [M S-1]
-    wind_u = NEXT_IMAGE.select('u_component_of_wind_10m')\
-        .subtract(PREVIOUS_IMAGE.select('u_component_of_wind_10m'))\
-        .multiply(DELTA_TIME).add(PREVIOUS_IMAGE.select('u_component_of_wind_10m'))
-
-    wind_v = NEXT_IMAGE.select('v_component_of_wind_10m')\
-        .subtract(PREVIOUS_IMAGE.select('v_component_of_wind_10m'))\
-        .multiply(DELTA_TIME).add(PREVIOUS_IMAGE.select('v_component_of_wind_10m'))
+    wind_u = interpolate('u_component_of_wind_10m')
+    wind_v = interpolate('v_component_of_wind_10m')
 
     # TODO: CGM check if the select calls are needed
     wind_med = wind_u.expression(
@@ -155,21 +184,18 @@ def get_meteorology(image, scale=None):
         'ux * (4.87) / log(67.8 * z - 5.42)', {'ux': wind_med, 'z': 10.0}).rename('ux_G')
 
     # PRESSURE [PA] CONVERTED TO KPA
-    tdp = NEXT_IMAGE.select('dewpoint_temperature_2m')\
-        .subtract(PREVIOUS_IMAGE.select('dewpoint_temperature_2m'))\
-        .multiply(DELTA_TIME).add(PREVIOUS_IMAGE.select('dewpoint_temperature_2m'))\
-        .rename('tdp')
+    tdp = interpolate('dewpoint_temperature_2m').rename('tdp')
 
     # ACTUAL VAPOR PRESSURE [KPA]
     #PRESSURE [PA] CONVERTED TO KPA
-    i_P_med= NEXT_IMAGE.select('surface_pressure').subtract(PREVIOUS_IMAGE.select('surface_pressure')).multiply(DELTA_TIME).add(PREVIOUS_IMAGE.select('surface_pressure')).divide(ee.Number(1000));
+    i_P_med= interpolate('surface_pressure').divide(ee.Number(1000));
 
     # SPECIFIC HUMIDITY [KG KG-1]
-    i_q_med =ee.ImageCollection(Constants.WEATHER_NASA_GLDAS_V021_NOAH_G025_T3H).select(['Qair_f_inst'],["specific_humidity"]).filterBounds(image.geometry()).filter(ee.Filter.date(ee.Date(time_start),ee.Date(time_start).advance(1,'day'))).first(); 
+    i_q_med = stack.select('specific_humidity')
     ea = i_P_med.expression('(1/0.622)*Q*P',{
             'Q': i_q_med,
             'P':i_P_med}).rename('i_ea')
-    
+
     # TODO: This equation is not correct
     # ea = tdp.expression(
     #     '0.6108 * (exp((17.27 * T_air) / (T_air + 237.3)))',{
@@ -199,110 +225,182 @@ def get_meteorology(image, scale=None):
 
     return out
 
-def retrievePrecip(metadate, location, window_days=10, scale=None):
-    startDate = ee.Date(metadate).advance(-window_days, 'day')
-    endDate = ee.Date(metadate).advance(-1, 'day')
+#ONE PASS: SETS meteo_count AND, WHEN THERE IS DATA, ADDS THE METEOROLOGY BANDS
+def fexp_meteorology(image, scale=None, stack=None):
+    image = ee.Image(image)
+    if stack is None:
+        stack = fexp_meteo_stack(fexp_meteo_hour(image.get('system:time_start')))
+    stack = ee.Image(stack)
+    meteo_count = ee.Number(stack.get('meteo_count'))
+
+    out = ee.Image(ee.Algorithms.If(meteo_count.gt(0),
+                                    fexp_apply_meteorology(image, stack, scale=scale),
+                                    image))
+    return out.set('meteo_count', meteo_count)
+
+#SAME AS MAPPING fexp_meteorology, BUT EACH DISTINCT ACQUISITION HOUR OF THE
+#COLLECTION GETS ONE STACK THAT ALL ITS IMAGES JOIN TO
+def fexp_meteorology_collection(collection, scale=None):
+    collection = collection.map(lambda image: image.set(
+                    'meteo_hour', fexp_meteo_hour(image.get('system:time_start'))))
+    hours = collection.aggregate_array('meteo_hour').distinct()
+    stacks = ee.ImageCollection(hours.map(lambda hour: fexp_meteo_stack(hour)))
+
+    joined = ee.Join.saveFirst('meteo_stack').apply(
+                primary=collection,
+                secondary=stacks,
+                condition=ee.Filter.equals(leftField='meteo_hour', rightField='meteo_hour'))
+
+    return ee.ImageCollection(joined).map(
+                lambda image: fexp_meteorology(image, scale=scale, stack=image.get('meteo_stack')))
+
+#CLIENT SIDE MEMO OF THE STACKS, KEYED BY (ACQUISITION HOUR, REGION TILE),
+#FOR CALLERS THAT KNOW THE ACQUISITION TIME AND FOOTPRINT (e.g. Collection)
+class MeteorologyProvider():
+
+    def __init__(self, maxsize=64, tile_degrees=1.0):
+        self.maxsize = maxsize
+        self.tile_degrees = tile_degrees
+        self.cache = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+        self.lock = threading.Lock()
+
+    def tile(self, region):
+        # tile holding the centre of a GeoJSON geometry (e.g. image bounds)
+        if region is None:
+            return None
+        coords = region['coordinates']
+        while isinstance(coords[0][0], (list, tuple)):
+            coords = coords[0]
+        lon = sum(c[0] for c in coords) / len(coords)
+        lat = sum(c[1] for c in coords) / len(coords)
+        return (int(math.floor(lon / self.tile_degrees)), int(math.floor(lat / self.tile_degrees)))
+
+    def stack(self, time_start, region=None):
+        tile = self.tile(region)
+        key = (fexp_meteo_hour(time_start), tile)
+        with self.lock:
+            if key in self.cache:
+                self.stats['hits'] += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.stats['misses'] += 1
+
+        tile_region = None
+        if tile is not None:
+            tile_region = ee.Geometry.Rectangle([tile[0] * self.tile_degrees, tile[1] * self.tile_degrees,
+                                                 (tile[0] + 1) * self.tile_degrees, (tile[1] + 1) * self.tile_degrees])
+        stack = fexp_meteo_stack(key[0], region=tile_region)
+
+        with self.lock:
+            self.cache[key] = stack
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return stack
+
+    def apply(self, image, time_start, region=None, scale=None):
+        return fexp_meteorology(image, scale=scale, stack=self.stack(time_start, region))
+
+#KEPT FOR EXISTING CALLERS, BOTH NOW READ THE SAME STACK
+def verifyMeteoAvail(image):
+    stack = fexp_meteo_stack(fexp_meteo_hour(image.get('system:time_start')))
+    return image.set('meteo_count', stack.get('meteo_count'))
 
-    collection = ee.ImageCollection(Constants.NOAA_CFSV2_6H)
+def get_meteorology(image, scale=None):
+    stack = fexp_meteo_stack(fexp_meteo_hour(image.get('system:time_start')))
+    return fexp_apply_meteorology(image, stack, scale=scale)
+
+#DAILY PRECIPITATION CUBE
+#ONE DAILY-SUM IMAGE [MM] PER DAY OF THE EXTRACTION WINDOW, BUILT ONCE AND
+#SLICED FOR EVERY IMAGE, SO THE 6-HOURLY CFSv2 COLLECTION IS SUMMED ONCE PER
+#DAY INSTEAD OF ONCE PER (IMAGE, DAY)
+def buildPrecipCube(start_date, end_date, window_days=10, region=None):
+    # covers the window_days before start_date up to the day before end_date
+    startDate = ee.Date(start_date).advance(-window_days, 'day')
+    numberOfDays = ee.Date(end_date).difference(startDate, 'day').ceil()
+
+    collection = ee.ImageCollection(Constants.NOAA_CFSV2_6H) \
+                    .select('Precipitation_rate_surface_6_Hour_Average')
+    if region is not None:
+        collection = collection.filterBounds(region)
+
+    # convert from kg/m^2/s to mm/s over 6 hours
+    precip_conversion_factor = ee.Number(6 * 60 * 60) # num hours in sample * num mins * num secs
 
     # function to sum the values by day
-    def sumPrecip(dayOffset, start_):
-        start = start_.advance(dayOffset, 'days')
-        end = start.advance(1, 'days')
-        return collection.select('Precipitation_rate_surface_6_Hour_Average') \
-                      .filterDate(start, end) \
+    def sumPrecip(dayOffset):
+        start = startDate.advance(dayOffset, 'day')
+        return collection.filterDate(start, start.advance(1, 'day')) \
                       .sum() \
+                      .multiply(precip_conversion_factor) \
+                      .rename('daily_rain') \
                       .set('system:time_start', start.millis())
 
-    # function to extract the precipitation values
-    def extractPrecip(image):
-        # convert from kg/m^2/s to mm/s over 6 hours
-        precip_conversion_factor = ee.Number(6 * 60 * 60) # num hours in sample * num mins * num secs
+    return ee.ImageCollection(ee.List.sequence(0, numberOfDays.subtract(1)).map(sumPrecip))
+
+def slicePrecipCube(cube, metadate, window_days=10):
+    # the window_days before metadate, most recent first
+    return cube.filterDate(ee.Date(metadate).advance(-window_days, 'day'), ee.Date(metadate)) \
+               .sort('system:time_start', False)
 
-        target_scale = scale if scale else image.projection().nominalScale()
+def retrievePrecip(metadate, location, window_days=10, scale=None, cube=None):
+    if cube is None:
+        cube = buildPrecipCube(metadate, metadate, window_days)
+    window = slicePrecipCube(cube, metadate, window_days)
 
-        precip_value = image.select('Precipitation_rate_surface_6_Hour_Average').reduceRegion(
+    target_scale = scale if scale else ee.Image(window.first()).projection().nominalScale()
+
+    # all days with one reduction, one band per day in most-recent-first order
+    daily = window.toBands()
+    precip_values = daily.reduceRegion(
           reducer=ee.Reducer.first(),
           geometry=location.centroid(),
           scale=ee.Number(target_scale)
-        ).get('Precipitation_rate_surface_6_Hour_Average')
-        precip_value = ee.Number(precip_value)
-
-        return ee.Feature(None, {
-          'precip_value': precip_value.multiply(precip_conversion_factor),
-          'date': image.date().format('yyyy-MM-dd'),
-          'system:time_start': image.date().millis()
-        })
-
-    # create a list of dates to use to extract precip values
-    numberOfDays = endDate.difference(startDate, 'days')
-    daily = ee.ImageCollection(
-                        ee.List.sequence(0, numberOfDays) \
-                            .map(lambda x: sumPrecip(x, startDate))
-                    )
-
-    # calculate the total precipitation for each of prior X days
-    # extract as features
-    precip_ts = ee.FeatureCollection(daily.map(extractPrecip)) \
-                  .sort('date', opt_ascending=False)
-
-    return precip_ts.aggregate_array('precip_value')
-
-def retrievePrecipImage(metadate, image, precip_window=10, cum_precip_window=3):
-    # this method is intended to be used separately from the generalized ETandMeteo method
-    # goal being to speed up the data retrieval
-    startDate = ee.Date(metadate).advance(-precip_window, 'day')
-    endDate = ee.Date(metadate).advance(-1, 'day')
+        )
 
-    collection = ee.ImageCollection("NOAA/CFSV2/FOR6H") \
-                    .filterBounds(image.geometry().bounds())
+    return precip_values.values(daily.bandNames())
 
-    # function to sum the values by day
-    def sumPrecip(dayOffset, start_):
-        precip_conversion_factor = ee.Image(6 * 60 * 60) # num hours in sample * num mins * num secs
-        start = start_.advance(dayOffset, 'days')
-        end = start.advance(1, 'days')
-        return collection.select('Precipitation_rate_surface_6_Hour_Average') \
-                      .filterDate(start, end) \
-                      .sum() \
-                      .multiply(precip_conversion_factor) \
-                      .rename('daily_rain') \
-                      .set('system:time_start', start.millis()) \
-                      .set('custom:index', (ee.Number(precip_window).subtract(dayOffset)))
-
-    # create a list of dates to use to extract precip values
-    numberOfDays = endDate.difference(startDate, 'days')
-    daily = ee.ImageCollection(
-                        ee.List.sequence(0, numberOfDays) \
-                            .map(lambda x: sumPrecip(x, startDate))
-                    )
-
-    def maskLowPrecip(img):
-        # creates image from difference between retrieval
-        # date (metadate) and the daily-precip reading date (img)
-        # then creates mask where rain less than threshold
-        # outer function then takes minimum # days (since last rain)
-        rain_threshold = ee.Number(0.254) # 0.254 mm = 0.01 inches of rainfall in a day, source:  Paolo
-        img = ee.Image(img)
-        delta = ee.Date(metadate).difference(img.date(), 'day')
-        mask = img.gt(rain_threshold)
-        out = ee.Image(delta).toFloat().updateMask(mask)
-        ten = ee.Image(ee.Number(10))
-        return out.unmask(ten) # replace where the image was masked with a 10
-                                # so that there is a value for last_rain and
-                                # the result is not masked out
-
-    # number of days since last rain
-    last_rain = daily \
-                    .map(maskLowPrecip) \
-                    .min() \
+def retrievePrecipBands(metadate, window_days=10, cube=None):
+    # same daily sums as retrievePrecip, but as one image with a band per day
+    # so many locations can be sampled with a single reduceRegions call.
+    # band precip_0 is the day before metadate, precip_1 the day before that, ...
+    # which matches the most-recent-first order of retrievePrecip
+    if cube is None:
+        cube = buildPrecipCube(metadate, metadate, window_days)
+
+    return slicePrecipCube(cube, metadate, window_days) \
+                .toBands() \
+                .rename(['precip_' + str(day) for day in range(window_days)])
+
+def retrievePrecipImage(metadate, image, precip_window=10, cum_precip_window=3, cube=None):
+    # this method is intended to be used separately from the generalized ETandMeteo method
+    # goal being to speed up the data retrieval
+    if cube is None:
+        cube = buildPrecipCube(metadate, metadate, precip_window, region=image.geometry().bounds())
+
+    rain_threshold = ee.Number(0.254) # 0.254 mm = 0.01 inches of rainfall in a day, source:  Paolo
+
+    # per pixel array of the daily rain, most recent day first
+    daily = slicePrecipCube(cube, metadate, precip_window) \
+                .toArray() \
+                .arrayProject([0])
+
+    # number of days since last rain, 10 when it did not rain in the window
+    # so that there is a value for last_rain and the result is not masked out
+    rained = daily.gt(rain_threshold)
+    first_rain = rained.arrayArgmax().arrayGet([0]).add(1)
+    any_rain = rained.arrayReduce(ee.Reducer.max(), [0]).arrayGet([0])
+    last_rain = ee.Image(ee.Number(10)) \
+                    .where(any_rain, first_rain) \
+                    .toFloat() \
                     .rename('last_rain') \
                     .clip(image.geometry().bounds())
 
     # cumulative precipation of last 3 days (agreed in team meeting)
     cum_precip = daily \
-                    .limit(cum_precip_window, 'custom:index') \
-                    .sum() \
+                    .arraySlice(0, 0, cum_precip_window) \
+                    .arrayReduce(ee.Reducer.sum(), [0]) \
+                    .arrayGet([0]) \
                     .rename('sum_precip_priorX') \
                     .clip(image.geometry().bounds())
 
@@ -0,0 +1,240 @@
+#----------------------------------------------------------------------------------------#
+#---------------------------------------//GEESEBAL//-------------------------------------#
+#GEESEBAL - GOOGLE EARTH ENGINE APP FOR SURFACE ENERGY BALANCE ALGORITHM FOR LAND (SEBAL)
+#CREATE BY: LEONARDO LAIPELT, RAFAEL KAYSER, ANDERSON RUHOFF AND AYAN FLEISCHMANN
+#PROJECT - ET BRASIL https://etbrasil.org/
+#LAB - HIDROLOGIA DE GRANDE ESCALA [HGE] website: https://www.ufrgs.br/hge/author/hge/
+#UNIVERSITY - UNIVERSIDADE FEDERAL DO RIO GRANDE DO SUL - UFRGS
+#RIO GRANDE DO SUL, BRAZIL
+
+#DOI
+#VERSION 0.1.1
+#CONTACT US: leonardo.laipelt@ufrgs.br
+
+#----------------------------------------------------------------------------------------#
+#
+# Bulk version of TimeSeries for many sample locations at once.
+#
+# TimeSeries runs the whole SEBAL chain for every (location, scene) pair, so
+# N locations inside one Landsat scene cost N SEBAL runs. SceneBatch filters
+# the collections by the bounds of all locations, so every scene (WRS path/row
+# plus acquisition date) is visited once, runs SEBAL once on it and samples
+# every location inside the scene footprint with a single reduceRegions call.
+# The features it produces carry the same properties as TimeSeries.ETandMeteo
+# plus any properties of the input location features (e.g. loc_type).
+#
+#----------------------------------------------------------------------------------------#
+#----------------------------------------------------------------------------------------#
+
+#PYTHON PACKAGES
+#Call EE
+import ee
+
+#FOLDERS
+from .landsatcollection import fexp_landsat_5Coordinate, fexp_landsat_7Coordinate, fexp_landsat_8Coordinate, fexp_landsat_9Coordinate
+from .masks import (f_albedoL5L7,f_albedoL8_9)
+from .meteorology import buildPrecipCube, fexp_meteorology_collection, retrievePrecipBands
+from .terrain import fexp_terrain
+from .tools import (fexp_spec_ind, SEBAL_SPEC_IND_BANDS, fexp_atmosphere, fexp_radlong_up, LST_DEM_correction,
+fexp_radshort_down, fexp_radlong_down, fexp_radbalance, fexp_soil_heat,fexp_sensible_heat_flux_ver_server)
+from .endmembers import fexp_endmembers, fexp_hot_pixel_fluxes
+from .evapotranspiration import fexp_et
+from .constants import Constants
+
+#BANDS SAMPLED AT EACH LOCATION AND THE PROPERTY THEY ARE STORED IN
+SAMPLE_BANDS = ['ET_24h', 'NDVI', 'AirT_G', 'LandT_G', 'ux_G', 'RH_G', 'elevation', 'slope']
+SAMPLE_PROPERTIES = ['ET_24h', 'NDVI', 'AirT_G', 'LandT_G', 'ux', 'UR', 'z_alt', 'slope']
+PRECIP_WINDOW_DAYS = 10
+
+#SCENE BATCH FUNCTION
+class SceneBatch():
+
+    #ENDMEMBERS DEFAULT
+    #ALLEN ET AL. (2013)
+    def __init__(self,
+                 year_i,
+                 month_i,
+                 day_i,
+                 year_e,
+                 month_e,
+                 day_e,
+                 cloud_cover,
+                 locations,
+                 NDVI_cold=5,
+                 Ts_cold=20,
+                 NDVI_hot=10,
+                 Ts_hot=20,
+                 calcRegionalET=False,
+                 scale=30,
+                 solver='image'
+        ):
+        # locations: ee.FeatureCollection of sample regions (e.g. buffered points),
+        # each one is reduced the same way TimeSeries reduces its coordinate
+
+        #output variable
+        self.ETandMeteo = None
+
+        #INFORMATIONS
+        self.locations=ee.FeatureCollection(locations)
+        self.cloud_cover=cloud_cover
+        self.start_date = ee.Date.fromYMD(year_i,month_i,day_i)
+        self.end_date = ee.Date.fromYMD(year_e,month_e,day_e)
+        bounds = self.locations.geometry()
+
+        #COLLECTIONS
+        #ONE IMAGE PER SCENE (WRS PATH/ROW AND DATE) TOUCHING ANY LOCATION
+        self.collection_l5=fexp_landsat_5Coordinate(self.start_date, self.end_date, bounds, self.cloud_cover)
+        self.collection_l7=fexp_landsat_7Coordinate(self.start_date, self.end_date, bounds, self.cloud_cover)
+        self.collection_l8=fexp_landsat_8Coordinate(self.start_date, self.end_date, bounds, self.cloud_cover)
+        self.collection_l9=fexp_landsat_9Coordinate(self.start_date, self.end_date, bounds, self.cloud_cover)
+
+        #DAILY PRECIPITATION FOR THE WHOLE WINDOW, SLICED PER SCENE
+        self.precip_cube = buildPrecipCube(self.start_date, self.end_date, PRECIP_WINDOW_DAYS, region=bounds)
+
+        #STATIC TERRAIN (ELEVATION, SLOPE, ASPECT, PRESSURE), SHARED BY EVERY SCENE
+        self.terrain = fexp_terrain(bounds)
+
+        if calcRegionalET:
+            # outputs are named <band>_first, <band>_min and <band>_max
+            reducer = ee.Reducer.first() \
+                        .combine(reducer2=ee.Reducer.min(), sharedInputs=True) \
+                        .combine(reducer2=ee.Reducer.max(), sharedInputs=True)
+            sampled = [band + '_first' for band in SAMPLE_BANDS]
+            reducer_outputs = [band + suffix for band in SAMPLE_BANDS for suffix in ('_first', '_min', '_max')]
+        else:
+            # single output reducer, outputs are named after the bands
+            reducer = ee.Reducer.first()
+            sampled = list(SAMPLE_BANDS)
+            reducer_outputs = sampled
+        precip_bands = ['precip_' + str(day) for day in range(PRECIP_WINDOW_DAYS)]
+
+        #FOR EACH SCENE IN THE COLLECTION
+        #ESTIMATE ET DAILY IMAGE AND EXTRACT
+        #VALUES AT EVERY LOCATION INSIDE THE SCENE
+
+        def retrieveETandMeteo(image):
+            image=ee.Image(image) # just used to ensure correct type casting
+
+            #GET INFORMATIONS FROM IMAGE
+            landsat_version=ee.String(image.get('SPACECRAFT_ID'))
+            sun_elevation = image.get("SUN_ELEVATION")
+            time_start=image.get('system:time_start')
+            _date=ee.Date(time_start)
+            _hour=ee.Number(_date.get('hour'))
+            _minutes = ee.Number(_date.get('minutes'))
+            date_string=_date.format('YYYY-MM-dd')
+
+            #ENDMEMBERS
+            p_top_NDVI=ee.Number(NDVI_cold)
+            p_coldest_Ts=ee.Number(Ts_cold)
+            p_lowest_NDVI=ee.Number(NDVI_hot)
+            p_hottest_Ts=ee.Number(Ts_hot)
+
+            #GEOMETRY
+            geometryReducer=image.geometry().bounds()
+            scene_locations=self.locations.filterBounds(image.geometry())
+
+            #METEOROLOGY (AIR TEMPERATURE [C], WIND SPEED [M S-1], RELATIVE HUMIDITY (%), NET RADIATION 24H [W M-2])
+            T_air = image.select('AirT_G')
+            ux= image.select('ux_G')
+            UR = image.select('RH_G')
+            Rn24hobs = image.select('Rn24h_G')
+
+            #SRTM DATA ELEVATION
+            terrain = self.terrain.clip(geometryReducer)
+            z_alt = terrain.select('elevation')
+            slope = terrain.select('slope')
+
+            #SPECTRAL IMAGES (ONLY THE BANDS THE SEBAL CHAIN READS)
+            image=fexp_spec_ind(image, scale=scale, bands=SEBAL_SPEC_IND_BANDS)
+
+            #ATMOSPHERIC STATE (dr, P_ATM, ES, EA, W_ATM, Tao_sw), SHARED BY THE LST CORRECTION AND Rs_down
+            atmosphere=fexp_atmosphere(image, z_alt, T_air, UR, sun_elevation, terrain)
+
+            #LAND SURFACE TEMPERATURE
+            image=LST_DEM_correction(image, z_alt, T_air, UR,sun_elevation,_hour,_minutes, terrain=terrain, atmosphere=atmosphere)
+            T_land = image.select('T_LST_DEM').rename('LandT_G')
+
+            #COLD AND HOT PIXELS
+            d_cold_pixel, d_hot_pixel=fexp_endmembers(image, geometryReducer, p_top_NDVI, p_coldest_Ts,
+                                                      p_lowest_NDVI, p_hottest_Ts)
+
+            #COLD PIXEL NUMBER
+            n_Ts_cold = ee.Number(d_cold_pixel.get('temp'))
+
+            #INSTANTANEOUS OUTGOING LONG-WAVE RADIATION [W M-2]
+            image=fexp_radlong_up(image)
+
+            #INSTANTANEOUS INCOMING SHORT-WAVE RADIATION [W M-2]
+            image=fexp_radshort_down(image,z_alt,T_air,UR, sun_elevation, atmosphere=atmosphere)
+
+            #INSTANTANEOUS INCOMING LONGWAVE RADIATION [W M-2]
+            image=fexp_radlong_down(image, n_Ts_cold)
+
+            #INSTANTANEOUS NET RADIATON BALANCE [W M-2]
+            image=fexp_radbalance(image)
+
+            #SOIL HEAT FLUX (G) [W M-2]
+            image=fexp_soil_heat(image)
+
+            #HOT PIXEL Rn AND G
+            d_hot_pixel=fexp_hot_pixel_fluxes(image, d_hot_pixel)
+
+            #SENSIBLE HEAT FLUX (H) [W M-2]
+            image=fexp_sensible_heat_flux_ver_server(image, ux, UR,Rn24hobs,n_Ts_cold,
+                                        d_hot_pixel, date_string, geometryReducer, scale=scale,
+                                        solver=solver)
+
+            #DAILY EVAPOTRANSPIRATION (ET_24H) [MM DAY-1]
+            image=fexp_et(image,Rn24hobs)
+
+            #EXTRACT VALUES AT ALL LOCATIONS OF THE SCENE
+            samples = ee.Image.cat(image.select(['ET_24h', 'NDVI']), T_air, T_land, ux, UR, z_alt, slope) \
+                        .select(SAMPLE_BANDS) \
+                        .reduceRegions(
+                            collection=scene_locations,
+                            reducer=reducer,
+                            scale=scale)
+
+            # precipitation is read at the location centroid, as in retrievePrecip
+            samples = samples.map(lambda f: f.setGeometry(f.geometry().centroid()))
+            samples = retrievePrecipBands(date_string, PRECIP_WINDOW_DAYS, cube=self.precip_cube).reduceRegions(
+                            collection=samples,
+                            reducer=ee.Reducer.first(),
+                            scale=scale)
+
+            def toETFeature(f):
+                f = ee.Feature(f)
+                properties = {
+                    'date': date_string,
+                    'version': landsat_version,
+                    'status': 'ok',
+                    'precip': ee.List([f.get(band) for band in precip_bands]),
+                }
+                for band, name in zip(sampled, SAMPLE_PROPERTIES):
+                    properties[name] = f.get(band)
+
+                if calcRegionalET:
+                    properties['ET_R_min'] = f.get('ET_24h_min')
+                    properties['ET_R_max'] = f.get('ET_24h_max')
+                else: # this will effectively cause any downstream ET_R calculations to return the ET_24h value
+                    properties['ET_R_min'] = ee.Number(0.0)
+                    properties['ET_R_max'] = ee.Number(1.0)
+
+                # keep the caller's location properties, drop the raw samples
+                return ee.Feature(f.geometry(), properties) \
+                         .copyProperties(f, exclude=reducer_outputs + precip_bands)
+
+            return samples.map(toETFeature)
+
+        self.ETandMeteo = ee.FeatureCollection([])
+        for collection, albedo in ((self.collection_l5, f_albedoL5L7),
+                                   (self.collection_l7, f_albedoL5L7),
+                                   (self.collection_l8, f_albedoL8_9),
+                                   (self.collection_l9, f_albedoL8_9)):
+            # one FeatureCollection of locations per scene, flattened into one
+            fc = ee.FeatureCollection(fexp_meteorology_collection(collection.map(albedo), scale=scale)
+                    .filter(ee.Filter.gt('meteo_count', 0))
+                    .map(retrieveETandMeteo)
+            ).flatten()
+            self.ETandMeteo = self.ETandMeteo.merge(fc)
@@ -0,0 +1,91 @@
+#----------------------------------------------------------------------------------------#
+#---------------------------------------//GEESEBAL//-------------------------------------#
+#GEESEBAL - GOOGLE EARTH ENGINE APP FOR SURFACE ENERGY BALANCE ALGORITHM FOR LAND (SEBAL)
+#CREATE BY: LEONARDO LAIPELT, RAFAEL KAYSER, ANDERSON RUHOFF AND AYAN FLEISCHMANN
+#PROJECT - ET BRASIL https://etbrasil.org/
+#LAB - HIDROLOGIA DE GRANDE ESCALA [HGE] website: https://www.ufrgs.br/hge/author/hge/
+#UNIVERSITY - UNIVERSIDADE FEDERAL DO RIO GRANDE DO SUL - UFRGS
+#RIO GRANDE DO SUL, BRAZIL
+
+#DOI
+#VERSION 0.1.1
+#CONTACT US: leonardo.laipelt@ufrgs.br
+
+#----------------------------------------------------------------------------------------#
+#
+# STATIC TERRAIN
+#   - Elevation, slope, aspect and the atmospheric pressure derived from the
+#     elevation do not change between acquisitions, so they are derived once
+#     per AOI (or tile) and every scene only clips the shared image
+#   - LST_DEM_correction and fexp_radshort_down take it as terrain=...
+#
+#----------------------------------------------------------------------------------------#
+#----------------------------------------------------------------------------------------#
+
+#PYTHON PACKAGES
+#Call EE
+import ee
+import json
+import threading
+from collections import OrderedDict
+
+from .constants import Constants
+
+#ELEVATION [M], SLOPE AND ASPECT [DEGREES], ATMOSPHERIC PRESSURE [KPA]
+def fexp_terrain(region=None):
+    srtm = ee.Image(Constants.SRTM_ELEVATION_COLLECTION)
+
+    #SLOPE AND ASPECT
+    #DERIVED BEFORE CLIPPING SO PIXELS AT THE AOI EDGE KEEP THEIR NEIGHBOURS
+    slope_aspect = ee.Terrain.products(srtm)
+
+    # ATMOSPHERIC PRESSURE [KPA]
+    # SHUTTLEWORTH (2012)
+    pres = srtm.expression(
+        "101.3 * ((293 - (0.0065 * Z))/ 293) ** 5.26 ", {"Z": srtm.select('elevation')}
+    ).rename("P_ATM")
+
+    terrain = ee.Image.cat(srtm.select('elevation'), slope_aspect.select(['slope', 'aspect']), pres)
+    if region is not None:
+        terrain = terrain.clip(region)
+    return terrain
+
+#CLIENT SIDE MEMO OF fexp_terrain PER AOI, FOR CALLERS THAT PROCESS
+#MANY SCENES OF THE SAME FOOTPRINT (e.g. Collection)
+class TerrainProvider():
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+        self.lock = threading.Lock()
+
+    def key(self, region):
+        # GeoJSON dicts (e.g. getInfo() bounds) are keyed by their coordinates
+        # rounded to ~1 km, ee objects by identity
+        if region is None:
+            return None
+        if isinstance(region, dict):
+            def rounded(value):
+                if isinstance(value, (list, tuple)):
+                    return [rounded(v) for v in value]
+                return round(value, 2) if isinstance(value, float) else value
+            return json.dumps(rounded(region.get('coordinates')))
+        return id(region)
+
+    def get(self, region=None):
+        key = self.key(region)
+        with self.lock:
+            if key in self.cache:
+                self.stats['hits'] += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.stats['misses'] += 1
+
+        terrain = fexp_terrain(region)
+
+        with self.lock:
+            self.cache[key] = terrain
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return terrain
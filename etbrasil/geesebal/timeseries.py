@@ -23,7 +23,6 @@
 #PYTHON PACKAGES
 #Call EE
 import ee
-ee.Initialize()
 from datetime import date
 import datetime
 
@@ -32,16 +31,27 @@ import sys
 #FOLDERS
 from .landsatcollection import fexp_landsat_5Coordinate, fexp_landsat_7Coordinate, fexp_landsat_8Coordinate, fexp_landsat_9Coordinate
 from .masks import (f_albedoL5L7,f_albedoL8_9)
-from .meteorology import get_meteorology, retrievePrecip, verifyMeteoAvail
-from .tools import (fexp_spec_ind, fexp_radlong_up, LST_DEM_correction,
+from .meteorology import buildPrecipCube, fexp_meteorology_collection, retrievePrecip
+from .terrain import fexp_terrain
+from .tools import (fexp_spec_ind, SEBAL_SPEC_IND_BANDS, fexp_atmosphere, fexp_radlong_up, LST_DEM_correction,
 fexp_radshort_down, fexp_radlong_down, fexp_radbalance, fexp_soil_heat,fexp_sensible_heat_flux_ver_server)
-from .endmembers import fexp_cold_pixel, fexp_hot_pixel
+from .endmembers import fexp_endmembers, fexp_hot_pixel_fluxes
 from .evapotranspiration import fexp_et
 from .constants import Constants
 from .landsat_utils import prepSrLandsat5and7, prepSrLandsat8and9
 
 
     
+#EARTH ENGINE IS INITIALIZED ON FIRST USE INSTEAD OF AT IMPORT, SO THE
+#PACKAGE (AND THE NUMPY ENGINE IN local.py) IMPORTS WITHOUT CREDENTIALS
+_initialized = False
+
+def initialize():
+    global _initialized
+    if not _initialized:
+        ee.Initialize()
+        _initialized = True
+
 #TIMESRIES FUNCTION
 class TimeSeries():
 
@@ -63,9 +73,12 @@ class TimeSeries():
                  Ts_hot=20,
                  calcRegionalET=False,
                  debug=False,
-                 scale=30
+                 scale=30,
+                 solver='image'
         ):
 
+        initialize()
+
         #output variable
         self.ETandMeteo = None
 
@@ -82,6 +95,12 @@ class TimeSeries():
         self.collection_l8=fexp_landsat_8Coordinate(self.start_date, self.end_date, self.coordinate, self.cloud_cover)
         self.collection_l9=fexp_landsat_9Coordinate(self.start_date, self.end_date, self.coordinate, self.cloud_cover)
 
+        #DAILY PRECIPITATION FOR THE WHOLE WINDOW, SLICED PER IMAGE
+        self.precip_cube = buildPrecipCube(self.start_date, self.end_date, region=self.coordinate)
+
+        #STATIC TERRAIN (ELEVATION, SLOPE, ASPECT, PRESSURE), SHARED BY EVERY IMAGE
+        self.terrain = fexp_terrain(self.coordinate)
+
         #FOR EACH IMAGE IN THE COLLECTION
         #ESTIMATE ET DAILY IMAGE AND EXTRACT
         #ET VALUE AT THE COORDINATE
@@ -152,22 +171,26 @@ class TimeSeries():
                 Rn24hobs = image.select('Rn24h_G')
 
                 #SRTM DATA ELEVATION
-                srtm = ee.Image(Constants.SRTM_ELEVATION_COLLECTION).clip(geometryReducer)
-                z_alt = srtm.select('elevation')
-                slope = ee.Terrain.slope(z_alt)
+                terrain = self.terrain.clip(geometryReducer)
+                z_alt = terrain.select('elevation')
+                slope = terrain.select('slope')
 
-                #SPECTRAL IMAGES (NDVI, EVI, SAVI, LAI, T_LST, e_0, e_NB, long, lat)
-                image=fexp_spec_ind(image, scale=scale)
+                #SPECTRAL IMAGES (ONLY THE BANDS THE SEBAL CHAIN READS)
+                image=fexp_spec_ind(image, scale=scale, bands=SEBAL_SPEC_IND_BANDS)
                 
+                #ATMOSPHERIC STATE (dr, P_ATM, ES, EA, W_ATM, Tao_sw), SHARED BY THE LST CORRECTION AND Rs_down
+                atmosphere=fexp_atmosphere(image, z_alt, T_air, UR, sun_elevation, terrain)
+
                 #LAND SURFACE TEMPERATURE
                 # TODO: IS THIS CORRECTION NECESSARY? Answer: No, because it uses the brightness temperature
-                image=LST_DEM_correction(image, z_alt, T_air, UR,sun_elevation,_hour,_minutes)
+                image=LST_DEM_correction(image, z_alt, T_air, UR,sun_elevation,_hour,_minutes, terrain=terrain, atmosphere=atmosphere)
                 T_land = image.select('T_LST_DEM').rename('LandT_G')
                 
                 
                 
-                #COLD PIXEL
-                d_cold_pixel=fexp_cold_pixel(image, geometryReducer, p_top_NDVI, p_coldest_Ts)
+                #COLD AND HOT PIXELS
+                d_cold_pixel, d_hot_pixel=fexp_endmembers(image, geometryReducer, p_top_NDVI, p_coldest_Ts,
+                                                          p_lowest_NDVI, p_hottest_Ts)
 
                 #COLD PIXEL NUMBER
                 n_Ts_cold = ee.Number(d_cold_pixel.get('temp'))
@@ -176,7 +199,7 @@ class TimeSeries():
                 image=fexp_radlong_up(image)
                 
                 #INSTANTANEOUS INCOMING SHORT-WAVE RADIATION [W M-2]
-                image=fexp_radshort_down(image,z_alt,T_air,UR, sun_elevation)
+                image=fexp_radshort_down(image,z_alt,T_air,UR, sun_elevation, atmosphere=atmosphere)
                 
                 #INSTANTANEOUS INCOMING LONGWAVE RADIATION [W M-2]
                 image=fexp_radlong_down(image, n_Ts_cold)
@@ -187,12 +210,13 @@ class TimeSeries():
                 #SOIL HEAT FLUX (G) [W M-2]
                 image=fexp_soil_heat(image)
                 
-                #HOT PIXEL
-                d_hot_pixel=fexp_hot_pixel(image, geometryReducer,p_lowest_NDVI, p_hottest_Ts)
+                #HOT PIXEL Rn AND G
+                d_hot_pixel=fexp_hot_pixel_fluxes(image, d_hot_pixel)
                 
                 #SENSIBLE HEAT FLUX (H) [W M-2]
                 image=fexp_sensible_heat_flux_ver_server(image, ux, UR,Rn24hobs,n_Ts_cold,
-                                            d_hot_pixel, date_string, geometryReducer, scale=scale)
+                                            d_hot_pixel, date_string, geometryReducer, scale=scale,
+                                            solver=solver)
 
                 #DAILY EVAPOTRANSPIRATION (ET_24H) [MM DAY-1]
                 image=fexp_et(image,Rn24hobs)
@@ -247,7 +271,7 @@ class TimeSeries():
                 UR_daily=UR.select(['RH_G'],[NAME_FINAL])
                 UR_point = extractValue(UR_daily)
 
-                z_alt_daily=srtm.select(['elevation'],[NAME_FINAL])
+                z_alt_daily=terrain.select(['elevation'],[NAME_FINAL])
                 z_alt_point = extractValue(z_alt_daily)
 
                 slope_daily=slope.select(['slope'],[NAME_FINAL])
@@ -273,7 +297,7 @@ class TimeSeries():
                 z_alt_point_get = ee.Number(z_alt_point.get(NAME_FINAL))
                 slope_point_get = ee.Number(slope_point.get(NAME_FINAL))
 
-                precip = retrievePrecip(date_string, self.coordinate, scale=scale)
+                precip = retrievePrecip(date_string, self.coordinate, scale=scale, cube=self.precip_cube)
 
                 etFeature = ee.Feature(self.coordinate.centroid(), {
                     'date': date_string,
@@ -339,38 +363,26 @@ class TimeSeries():
            
         
     
-        fc5 = (self.collection_l5.
-                    map(f_albedoL5L7)
-                    .map(verifyMeteoAvail)
+        fc5 = (fexp_meteorology_collection(self.collection_l5.map(f_albedoL5L7), scale=scale)
                     .filter(ee.Filter.gt('meteo_count', 0))
-                    .map(lambda image: get_meteorology(image, scale=scale))
                     .map(lambda image: retrieveETandMeteo(image, debug=debug))
         )
         self.ETandMeteo = fc5
            
-        fc7 = (self.collection_l7
-                    .map(f_albedoL5L7)
-                    .map(verifyMeteoAvail)
+        fc7 = (fexp_meteorology_collection(self.collection_l7.map(f_albedoL5L7), scale=scale)
                     .filter(ee.Filter.gt('meteo_count', 0))
-                    .map(lambda image: get_meteorology(image, scale=scale))
                     .map(lambda image: retrieveETandMeteo(image, debug=debug))
         )
         self.ETandMeteo = self.ETandMeteo.merge(fc7)
         
-        fc8 = (self.collection_l8
-                    .map(f_albedoL8_9)
-                    .map(verifyMeteoAvail)
+        fc8 = (fexp_meteorology_collection(self.collection_l8.map(f_albedoL8_9), scale=scale)
                     .filter(ee.Filter.gt('meteo_count', 0))
-                    .map(lambda image: get_meteorology(image, scale=scale))
                     .map(lambda image: retrieveETandMeteo(image, debug=debug))
         )
         self.ETandMeteo = self.ETandMeteo.merge(fc8)
 
-        fc9 = (self.collection_l9
-                    .map(f_albedoL8_9)
-                    .map(verifyMeteoAvail)
+        fc9 = (fexp_meteorology_collection(self.collection_l9.map(f_albedoL8_9), scale=scale)
                     .filter(ee.Filter.gt('meteo_count', 0))
-                    .map(lambda image: get_meteorology(image, scale=scale))
                     .map(lambda image: retrieveETandMeteo(image, debug=debug))
         )
         self.ETandMeteo = self.ETandMeteo.merge(fc9)
@@ -23,15 +23,21 @@
 # Call EE
 import ee
 from .constants import Constants
+from .bandregistry import build_bands, SPEC_IND_BANDS, SEBAL_SPEC_IND_BANDS
 
 
 # SPECTRAL INDICES MODULE
-def fexp_spec_ind(image, scale=30):
-    # NORMALIZED DIFFERENCE VEGETATION INDEX (NDVI)
-    ndvi = image.normalizedDifference(["NIR", "R"]).rename("NDVI")
+# EACH BAND DECLARES ITS INPUTS, fexp_spec_ind ONLY BUILDS THE BANDS THAT THE
+# REQUESTED OUTPUTS NEED (SEE bandregistry.py)
 
-    # ENHANCED VEGETATION INDEX (EVI)
-    evi = image.expression(
+# NORMALIZED DIFFERENCE VEGETATION INDEX (NDVI)
+def _spec_ndvi(image, bands, options):
+    return image.normalizedDifference(["NIR", "R"]).rename("NDVI")
+
+
+# ENHANCED VEGETATION INDEX (EVI)
+def _spec_evi(image, bands, options):
+    return image.expression(
         "2.5 * ((N - R) / (N + (6 * R) - (7.5 * B) + 1))",
         {
             "N": image.select("NIR"),
@@ -40,8 +46,10 @@ def fexp_spec_ind(image, scale=30):
         },
     ).rename("EVI")
 
-    # SOIL ADHUSTED VEGETATION INDEX (SAVI)
-    savi = image.expression(
+
+# SOIL ADHUSTED VEGETATION INDEX (SAVI)
+def _spec_savi(image, bands, options):
+    return image.expression(
         "((1 + 0.5)*(B5 - B4)) / (0.5 + (B5 + B4))",
         {
             "B4": image.select("R"),
@@ -49,73 +57,98 @@ def fexp_spec_ind(image, scale=30):
         },
     ).rename("SAVI")
 
-    # NORMALIZED DIFFERENCE WATER INDEX (NDWI)
-    ndwi = image.normalizedDifference(["GR", "NIR"]).rename("NDWI")
-    savi1 = savi.where(savi.gt(0.689), 0.689)
 
-    # LEAF AREA INDEX (LAI)
-    lai = image.expression("-(log(( 0.69-SAVI)/0.59 ) / 0.91)", {"SAVI": savi1}).rename(
+# NORMALIZED DIFFERENCE WATER INDEX (NDWI)
+def _spec_ndwi(image, bands, options):
+    return image.normalizedDifference(["GR", "NIR"]).rename("NDWI")
+
+
+# LEAF AREA INDEX (LAI)
+def _spec_lai(image, bands, options):
+    savi1 = bands["SAVI"].where(bands["SAVI"].gt(0.689), 0.689)
+    return image.expression("-(log(( 0.69-SAVI)/0.59 ) / 0.91)", {"SAVI": savi1}).rename(
         "LAI"
     )
 
-    NDVI_adjust = ndvi.clamp(0.0, 1.00)
+
+def _spec_fipar(image, bands, options):
+    NDVI_adjust = bands["NDVI"].clamp(0.0, 1.00)
     fipar = (NDVI_adjust.multiply(1).subtract(ee.Number(0.05))).rename("fipar")
-    fipar = fipar.clamp(0, 1)
+    return fipar.clamp(0, 1)
+
 
-    # BROAD-BAND SURFACE EMISSIVITY (e_0)
+# BROAD-BAND SURFACE EMISSIVITY (e_0)
+def _spec_e_0(image, bands, options):
+    lai = bands["LAI"]
     e_0 = image.expression("0.95 + 0.01 * LAI", {"LAI": lai})
-    e_0 = e_0.where(lai.gt(3), 0.98).rename("e_0")
+    return e_0.where(lai.gt(3), 0.98).rename("e_0")
+
 
-    # NARROW BAND TRANSMISSIVITY (e_NB)
+# NARROW BAND TRANSMISSIVITY (e_NB)
+def _spec_e_NB(image, bands, options):
+    lai = bands["LAI"]
     e_NB = image.expression("0.97 + (0.0033 * LAI)", {"LAI": lai})
-    e_NB = e_NB.where(lai.gt(3), 0.98).rename("e_NB")
-    log_eNB = e_NB.log()
-
-    # LAND SURFACE TEMPERATURE (LST) [K]
-    # comp_onda = ee.Number(1.115e-05)
-    # TODO: This is no longer necessary. In collection 2 we have LST
-    # lst = image.expression(
-    #   'Tb / ( 1+ ( ( comp_onda * Tb / fator) * log_eNB))',{
-    #     'Tb': image.select('BRT').divide(10),
-    #     'comp_onda': comp_onda,
-    #     'log_eNB': log_eNB,
-    #     'fator': ee.Number(1.438e-02),
-    #   }).rename('T_LST');
-    
-    lst = image.select('T_LST')
-    # RESCALED BRIGHTNESS TEMPERATURE
-    # brt_r = image.select('BRT').divide(10).rename('BRT_R');
+    return e_NB.where(lai.gt(3), 0.98).rename("e_NB")
+
+
+# LAND SURFACE TEMPERATURE (LST) [K]
+# comp_onda = ee.Number(1.115e-05)
+# TODO: This is no longer necessary. In collection 2 we have LST
+# lst = image.expression(
+#   'Tb / ( 1+ ( ( comp_onda * Tb / fator) * log_eNB))',{
+#     'Tb': image.select('BRT').divide(10),
+#     'comp_onda': comp_onda,
+#     'log_eNB': e_NB.log(),
+#     'fator': ee.Number(1.438e-02),
+#   }).rename('T_LST');
+# RESCALED BRIGHTNESS TEMPERATURE
+# brt_r = image.select('BRT').divide(10).rename('BRT_R');
+def _spec_lst(image, bands, options):
+    return image.select("T_LST")
+
+
+# PIXEL COORDINATES IN THE PROJECTION OF THE SCENE
+def _spec_lonlat(image, bands, options):
     proj = image.select("B").projection()
-    latlon = ee.Image.pixelLonLat().reproject(proj, scale=scale)
-    coords = latlon.select(["longitude", "latitude"])
-
-    # FOR FUTHER USE
-    pos_ndvi = ndvi.updateMask(ndvi.gt(0)).rename("pos_NDVI")
-    ndvi_neg = pos_ndvi.multiply(-1).rename("NDVI_neg")
-    # lst_neg = lst.multiply(-1).rename('LST_neg');
-    int_ = ee.Image(1).rename("int")
-    # lst_nw = lst.updateMask(ndwi.lte(0)).rename('LST_NW');
-    sd_ndvi = ee.Image(1).rename("sd_ndvi")
+    latlon = ee.Image.pixelLonLat().reproject(proj, scale=options.get("scale", 30))
+    return latlon.select(["longitude", "latitude"])
+
+
+# FOR FUTHER USE
+def _spec_pos_ndvi(image, bands, options):
+    return bands["NDVI"].updateMask(bands["NDVI"].gt(0)).rename("pos_NDVI")
+
+
+def _spec_ndvi_neg(image, bands, options):
+    return bands["pos_NDVI"].multiply(-1).rename("NDVI_neg")
+
+
+SPEC_IND_REGISTRY = {
+    "NDVI": ((), _spec_ndvi),
+    "EVI": ((), _spec_evi),
+    "SAVI": ((), _spec_savi),
+    "NDWI": ((), _spec_ndwi),
+    "LAI": (("SAVI",), _spec_lai),
+    "fipar": (("NDVI",), _spec_fipar),
+    "e_0": (("LAI",), _spec_e_0),
+    "e_NB": (("LAI",), _spec_e_NB),
+    "T_LST": ((), _spec_lst),
+    "_lonlat": ((), _spec_lonlat),
+    "longitude": (("_lonlat",), lambda image, bands, options: bands["_lonlat"].select("longitude")),
+    "latitude": (("_lonlat",), lambda image, bands, options: bands["_lonlat"].select("latitude")),
+    "pos_NDVI": (("NDVI",), _spec_pos_ndvi),
+    "NDVI_neg": (("pos_NDVI",), _spec_ndvi_neg),
+    "int": ((), lambda image, bands, options: ee.Image(1).rename("int")),
+    "sd_ndvi": ((), lambda image, bands, options: ee.Image(1).rename("sd_ndvi")),
+}
+
+# bands: OUTPUT BANDS TO ADD, DEFAULTS TO SPEC_IND_BANDS
+def fexp_spec_ind(image, scale=30, bands=None):
+    bands = SPEC_IND_BANDS if bands is None else bands
+    spec_ind = build_bands(SPEC_IND_REGISTRY, bands, image, {"scale": scale})
 
     # ADD BANDS
-    image = image.addBands(
-        [
-            ndvi,
-            evi,
-            savi,
-            lst,
-            lai,
-            e_0,
-            e_NB,
-            coords,
-            ndvi_neg,
-            pos_ndvi,
-            int_,
-            sd_ndvi,
-            ndwi,
-            # brt_r
-        ]
-    )
+    image = image.addBands([spec_ind[name] for name in bands])
     return image
 
 
@@ -261,15 +294,11 @@ def fexp_lst_export(img_main, img_main_RAD, landsat_version, refpoly):
     return img_main
 
 
-# LAND SURFACE TEMPERATURE WITH DEM CORRECTION AND ASPECT/SLOPE
-# JAAFAR AND AHMAD (2020)
-# PYSEBAL (BASTIAANSSEN) Reference?
-
-
-def LST_DEM_correction(image, z_alt, T_air, UR, SUN_ELEVATION, hour, minuts):
-    # SOLAR CONSTANT [W M-2]
-    gsc = ee.Number(1367)
-
+# ATMOSPHERIC STATE OF A SCENE, SHARED BY LST_DEM_correction AND fexp_radshort_down
+# RETURNS A DICT WITH THE SCALARS doy, dr, cos_theta (ee.Number) AND THE
+# P_ATM, ES, EA, W_ATM AND Tao_sw BANDS, SO EACH SCENE BUILDS THE SUBGRAPH ONCE
+# terrain: OPTIONAL IMAGE FROM terrain.fexp_terrain WITH A PRECOMPUTED P_ATM
+def fexp_atmosphere(image, z_alt, T_air, UR, SUN_ELEVATION, terrain=None):
     # DAY OF YEAR
     dateStr = image.date()
     doy = dateStr.getRelative("day", "year")
@@ -283,30 +312,30 @@ def LST_DEM_correction(image, z_alt, T_air, UR, SUN_ELEVATION, hour, minuts):
 
     # ATMOSPHERIC PRESSURE [KPA]
     # SHUTTLEWORTH (2012)
-    pres = image.expression(
-        "101.3 * ((293 - (0.0065 * Z))/ 293) ** 5.26 ", {"Z": z_alt}
-    ).rename("P_ATM")
+    if terrain is not None:
+        pres = terrain.select("P_ATM")
+    else:
+        pres = image.expression(
+            "101.3 * ((293 - (0.0065 * Z))/ 293) ** 5.26 ", {"Z": z_alt}
+        ).rename("P_ATM")
 
     # SATURATION VAPOR PRESSURE (es) [KPA]
     es = image.expression(
         " 0.6108 *(exp( (17.27 * T_air) / (T_air + 237.3)))", {"T_air": T_air}
     ).rename("ES")
 
-    try:
-        # ACTUAL VAPOR PRESSURE (ea) [KPA]
-        ea = es.multiply(UR).divide(100).rename("EA")
-    except:
-        raise
+    # ACTUAL VAPOR PRESSURE (ea) [KPA]
+    ea = es.multiply(UR).divide(100).rename("EA")
 
     # WATER IN THE ATMOSPHERE [mm]
-    # Garrison and Adler (1990)
+    # GARRISON AND ADLER (1990)
     W = image.expression("(0.14 * EA * PATM) + 2.1", {"PATM": pres, "EA": ea}).rename(
         "W_ATM"
     )
 
-    # SOLAR ZENITH ANGLE OVER A HORZONTAL SURFACE
+    # SOLAR ZENITH ANGLE OVER A HORIZONTAL SURFACE
     solar_zenith = ee.Number(90).subtract(SUN_ELEVATION)
-    
+
     degree2radian = ee.Number(0.01745)
     solar_zenith_radians = solar_zenith.multiply(degree2radian)
     cos_theta = solar_zenith_radians.cos()
@@ -318,6 +347,39 @@ def LST_DEM_correction(image, z_alt, T_air, UR, SUN_ELEVATION, hour, minuts):
         {"P": pres, "W": W, "Kt": ee.Number(1), "cos_theta": cos_theta},
     ).rename("Tao_sw")
 
+    return {
+        "doy": doy,
+        "dr": dr,
+        "cos_theta": cos_theta,
+        "P_ATM": pres,
+        "ES": es,
+        "EA": ea,
+        "W_ATM": W,
+        "Tao_sw": tao_sw,
+    }
+
+
+# LAND SURFACE TEMPERATURE WITH DEM CORRECTION AND ASPECT/SLOPE
+# JAAFAR AND AHMAD (2020)
+# PYSEBAL (BASTIAANSSEN) Reference?
+
+
+def LST_DEM_correction(image, z_alt, T_air, UR, SUN_ELEVATION, hour, minuts, terrain=None, atmosphere=None):
+    # terrain: OPTIONAL IMAGE FROM terrain.fexp_terrain WITH THE STATIC
+    # slope, aspect AND P_ATM BANDS, SO THEY ARE NOT DERIVED PER SCENE
+    # atmosphere: OPTIONAL fexp_atmosphere OF THE SCENE, REUSED BY fexp_radshort_down
+    # SOLAR CONSTANT [W M-2]
+    gsc = ee.Number(1367)
+
+    if atmosphere is None:
+        atmosphere = fexp_atmosphere(image, z_alt, T_air, UR, SUN_ELEVATION, terrain)
+    doy = atmosphere["doy"]
+    dr = atmosphere["dr"]
+    pres = atmosphere["P_ATM"]
+    cos_theta = atmosphere["cos_theta"]
+    tao_sw = atmosphere["Tao_sw"]
+    degree2radian = ee.Number(0.01745)
+
     # AIR DENSITY [KG M-3]
     air_dens = image.expression(
         "(1000* Pair)/(1.01*LST*287)", {"Pair": pres, "LST": image.select("T_LST")}
@@ -332,7 +394,10 @@ def LST_DEM_correction(image, z_alt, T_air, UR, SUN_ELEVATION, hour, minuts):
     )
 
     # COS ZENITH ANGLE SUN ELEVATION #ALLEN ET AL. (2006)
-    slope_aspect = ee.Terrain.products(z_alt)
+    if terrain is not None:
+        slope_aspect = terrain
+    else:
+        slope_aspect = ee.Terrain.products(z_alt)
 
     B = (ee.Number(360).divide(ee.Number(365))).multiply(doy.subtract(ee.Number(81)))
     delta = ee.Image(
@@ -431,58 +496,17 @@ def fexp_radlong_up(image):
 
 
 # INSTANTANEOUS INCOMING SHORT-WAVE RADIATION (Rs_down) [W M-2]
-def fexp_radshort_down(image, z_alt, T_air, UR, SUN_ELEVATION):
+def fexp_radshort_down(image, z_alt, T_air, UR, SUN_ELEVATION, terrain=None, atmosphere=None):
     # SOLAR CONSTANT
     gsc = ee.Number(1367)  # [W M-2]
 
-    # DAY OF THE YEAR
-    dateStr = image.date()
-    doy = dateStr.getRelative("day", "year")
-    Pi = ee.Number(3.14)
-
-    # INVERSE RELATIVE  DISTANCE EARTH-SUN
-    d1 = ee.Number(2).multiply(Pi).divide(ee.Number(365))
-    d2 = d1.multiply(doy)
-    d3 = d2.cos()
-    dr = ee.Number(1).add(ee.Number(0.033).multiply(d3))
-
-    # ATMOSPHERIC PRESSURE [KPA]
-    # SHUTTLEWORTH (2012)
-    pres = image.expression(
-        "101.3 * ((293 - (0.0065 * Z))/ 293) ** 5.26 ", {"Z": z_alt}
-    ).rename("P_ATM")
-
-    # SATURATION VAPOR PRESSURE (es) [KPA]
-    es = image.expression(
-        " 0.6108 *(exp( (17.27 * T_air) / (T_air + 237.3)))", {"T_air": T_air}
-    ).rename("ES")
-
-    # ACTUAL VAPOR PRESSURE (ea) [KPA]
-    ea = es.multiply(UR).divide(100).rename("EA")
-
-    # WATER IN THE ATMOSPHERE [mm]
-    # GARRISON AND ADLER (1990)
-    W = image.expression(
-        "(0.14 * EA * PATM) + 2.1",
-        {
-            "PATM": pres,
-            "EA": ea,
-        },
-    ).rename("W_ATM")
-
-    # SOLAR ZENITH ANGLE OVER A HORIZONTAL SURFACE
-    solar_zenith = ee.Number(90).subtract(SUN_ELEVATION)
-    
-    degree2radian = 0.01745
-    solar_zenith_radians = solar_zenith.multiply(degree2radian)
-    cos_theta = solar_zenith_radians.cos()
-
-    # BROAD-BAND ATMOSPHERIC TRANSMISSIVITY (tao_sw)
-    # ASCE-EWRI (2005)
-    tao_sw = image.expression(
-        "0.35 + 0.627 * exp(((-0.00146 * P)/(Kt * cos_theta)) - (0.075 * (W / cos_theta)**0.4))",
-        {"P": pres, "W": W, "Kt": ee.Number(1), "cos_theta": cos_theta},
-    ).rename("Tao_sw")
+    if atmosphere is None:
+        atmosphere = fexp_atmosphere(image, z_alt, T_air, UR, SUN_ELEVATION, terrain)
+    dr = atmosphere["dr"]
+    cos_theta = atmosphere["cos_theta"]
+    tao_sw = atmosphere["Tao_sw"]
+    es = atmosphere["ES"]
+    ea = atmosphere["EA"]
 
     # INSTANTANEOUS SHORT-WAVE RADIATION (Rs_down) [W M-2]
     Rs_down = image.expression(
@@ -856,8 +880,15 @@ def fexp_sensible_heat_flux(
     # SENSIBLE HEAT FLUX (H) [W M-2]
 
 
+# solver="image" RUNS THE 15 STEP ITERATION OVER THE FULL IMAGE (DEFAULT).
+# solver="scalar" RUNS THE ITERATION ONLY ON THE HOT PIXEL VALUES, STOPS
+# WHEN THE HOT PIXEL dT CHANGES LESS THAN tolerance [K] AND THEN APPLIES THE
+# CONVERGED dT COEFFICIENTS TO THE FULL IMAGE. dT IS THE SAME AS IN THE IMAGE
+# SOLVER; rah AND H GET ONE STABILITY CORRECTION FROM THE NEUTRAL rah INSTEAD
+# OF 15 PER PIXEL, SO THEY ARE AN APPROXIMATION OF THE IMAGE SOLVER VALUES.
 def fexp_sensible_heat_flux_ver_server(
-    image, ux, UR, Rn24hobs, n_Ts_cold, d_hot_pixel, date_string, refpoly, scale=30
+    image, ux, UR, Rn24hobs, n_Ts_cold, d_hot_pixel, date_string, refpoly, scale=30,
+    solver="image", tolerance=0.01, max_iterations=15
 ):
     # VEGETATION HEIGHTS  [M]
     n_veg_hight = ee.Number(3)
@@ -954,6 +985,15 @@ def fexp_sensible_heat_flux_ver_server(
     # STABILITY CORRECTIONS FOR MOMENTUM AND HEAT TRANSPORT, PAULSON (1970), WEBB (1970)
     img = ee.Image().clip(refpoly)
 
+    if solver == "scalar":
+        return _fexp_sensible_heat_flux_scalar(
+            image, ux, n_Ts_cold, n_Ts_hot, n_H_hot, n_ro_hot, p_hot_pix,
+            i_zom, i_u200, i_ufric, i_rah, i_rah_first, refpoly,
+            scale=scale, tolerance=tolerance, max_iterations=max_iterations,
+        )
+    elif solver != "image":
+        raise ValueError("solver must be 'image' or 'scalar'")
+
     # NUMBER OF ITERATIVE STEPS: 15
     # CAN BE CHANGED, BUT BE AWARE THAT
     # A MINIMUM NUMBER OF ITERATIVE PROCESSES
@@ -1108,3 +1148,240 @@ def fexp_sensible_heat_flux_ver_server(
         ]
     )
     return image
+
+
+# STABILITY CORRECTIONS FOR MOMENTUM AND HEAT TRANSPORT (IMAGES)
+# PAULSON (1970)
+# WEBB (1970)
+def _fexp_stability_corrections(i_L_int, refpoly):
+    img = ee.Image().clip(refpoly)
+
+    # STABILITY CORRECTIONS FOR STABLE CONDITIONS
+    i_psim_200 = img.expression(
+        "-5*(hight/i_L_int)", {"hight": ee.Number(200), "i_L_int": i_L_int}
+    ).rename("psim_200")
+    i_psih_2 = img.expression(
+        "-5*(hight/i_L_int)", {"hight": ee.Number(2), "i_L_int": i_L_int}
+    ).rename("psih_2")
+    i_psih_01 = img.expression(
+        "-5*(hight/i_L_int)", {"hight": ee.Number(0.1), "i_L_int": i_L_int}
+    ).rename("psih_01")
+
+    # FOR DIFFERENT HEIGHT
+    i_x200 = i_L_int.expression(
+        "(1-(16*(hight/i_L_int)))**0.25", {"hight": ee.Number(200), "i_L_int": i_L_int}
+    )
+    i_x2 = i_L_int.expression(
+        "(1-(16*(hight/i_L_int)))**0.25", {"hight": ee.Number(2), "i_L_int": i_L_int}
+    )
+    i_x01 = i_L_int.expression(
+        "(1-(16*(hight/i_L_int)))**0.25", {"hight": ee.Number(0.1), "i_L_int": i_L_int}
+    )
+
+    # STABILITY CORRECTIONS FOR UNSTABLE CONDITIONS
+    i_psimu_200 = i_x200.expression(
+        "2*log((1+i_x200)/2)+log((1+i_x200**2)/2)-2*atan(i_x200)+0.5*pi",
+        {"i_x200": i_x200, "pi": ee.Number(3.14159265)},
+    )
+    i_psihu_2 = i_x2.expression("2*log((1+i_x2**2)/2)", {"i_x2": i_x2})
+    i_psihu_01 = i_x01.expression("2*log((1+i_x01**2)/2)", {"i_x01": i_x01})
+
+    # FOR EACH PIXEL
+    i_L_int_lt0 = i_L_int.lt(0)
+    i_psim_200 = i_psim_200.where(i_L_int_lt0, i_psimu_200)
+    i_psih_2 = i_psih_2.where(i_L_int_lt0, i_psihu_2)
+    i_psih_01 = i_psih_01.where(i_L_int_lt0, i_psihu_01)
+
+    i_L_int_eq0 = i_L_int.eq(0)
+    i_psim_200 = i_psim_200.where(i_L_int_eq0, 0)
+    i_psih_2 = i_psih_2.where(i_L_int_eq0, 0)
+    i_psih_01 = i_psih_01.where(i_L_int_eq0, 0)
+    return i_psim_200, i_psih_2, i_psih_01
+
+
+# STABILITY CORRECTIONS FOR MOMENTUM AND HEAT TRANSPORT (NUMBERS)
+# SAME EQUATIONS AS _fexp_stability_corrections FOR ONE VALUE OF L
+def _fexp_stability_corrections_number(n_L):
+    n_L = ee.Number(n_L)
+
+    def stable(hight):
+        return ee.Number(-5).multiply(ee.Number(hight).divide(n_L))
+
+    def x(hight):
+        return ee.Number(1).subtract(ee.Number(16).multiply(ee.Number(hight).divide(n_L))).pow(0.25)
+
+    def log_half(v):
+        return ee.Number(v).divide(2).log()
+
+    n_x200 = x(200)
+    n_psimu_200 = (
+        log_half(n_x200.add(1)).multiply(2)
+        .add(log_half(n_x200.pow(2).add(1)))
+        .subtract(n_x200.atan().multiply(2))
+        .add(ee.Number(0.5).multiply(3.14159265))
+    )
+    n_psihu_2 = log_half(x(2).pow(2).add(1)).multiply(2)
+    n_psihu_01 = log_half(x(0.1).pow(2).add(1)).multiply(2)
+
+    def select(unstable, stable_value):
+        return ee.Number(
+            ee.Algorithms.If(
+                n_L.eq(0), 0, ee.Algorithms.If(n_L.lt(0), unstable, stable_value)
+            )
+        )
+
+    return (
+        select(n_psimu_200, stable(200)),
+        select(n_psihu_2, stable(2)),
+        select(n_psihu_01, stable(0.1)),
+    )
+
+
+# SENSIBLE HEAT FLUX (H) [W M-2], HOT PIXEL SCALAR ITERATION
+# SEE fexp_sensible_heat_flux_ver_server(solver="scalar")
+def _fexp_sensible_heat_flux_scalar(
+    image, ux, n_Ts_cold, n_Ts_hot, n_H_hot, n_ro_hot, p_hot_pix,
+    i_zom, i_u200, i_ufric, i_rah, i_rah_first, refpoly,
+    scale=30, tolerance=0.01, max_iterations=15,
+):
+    n_hight = ee.Number(200)
+    n_Cp = ee.Number(1004)
+    z1 = ee.Number(0.1)
+    z2 = ee.Number(2)
+    n_dT_cold = ee.Number(0)
+
+    # HOT PIXEL VALUES, A SINGLE reduceRegion
+    d_hot = (
+        ee.Image.cat(i_zom.rename("zom"), i_u200.rename("u200"), i_ufric.rename("ufric"), i_rah.rename("rah"))
+        .reduceRegion(reducer=ee.Reducer.first(), geometry=p_hot_pix, scale=scale, maxPixels=5556)
+    )
+    n_zom_hot = ee.Number(d_hot.get("zom"))
+    n_u200_hot = ee.Number(d_hot.get("u200"))
+
+    # ========ITERATIVE PROCESS ON THE HOT PIXEL=========#
+    def step(n, state):
+        state = ee.Dictionary(state)
+        n_rah_hot = ee.Number(state.get("rah"))
+        n_ufric_hot = ee.Number(state.get("ufric"))
+
+        # NEAR SURFACE TEMPERATURE DIFFERENCE IN HOT PIXEL (dT= Tz1-Tz2)  [K] dThot= Hhot*rah/(ρCp)
+        n_dT_hot = (n_H_hot.multiply(n_rah_hot)).divide(n_ro_hot.multiply(n_Cp))
+
+        # ANGULAR AND LINEAR COEFFICIENTS
+        n_coef_a = (n_dT_cold.subtract(n_dT_hot)).divide(n_Ts_cold.subtract(n_Ts_hot))
+        n_coef_b = n_dT_hot.subtract(n_coef_a.multiply(n_Ts_hot))
+
+        # AIR DENSITY, H AND MONIN-OBUKHOV LENGTH AT THE HOT PIXEL
+        n_ro = ee.Number(-0.0046).multiply(n_Ts_hot.subtract(n_dT_hot)).add(2.5538)
+        n_H = n_ro.multiply(n_Cp).multiply(n_dT_hot).divide(n_rah_hot)
+        n_L = (
+            n_ro.multiply(n_Cp).multiply(n_ufric_hot.pow(3)).multiply(n_Ts_hot)
+            .divide(ee.Number(0.41 * 9.81).multiply(n_H))
+            .multiply(-1)
+        )
+        n_psim_200, n_psih_2, n_psih_01 = _fexp_stability_corrections_number(n_L)
+
+        # CORRECTED FRICTION VELOCITY AND AERODYNAMIC RESISTANCE
+        n_ufric_new = n_u200_hot.multiply(0.41).divide(
+            n_hight.divide(n_zom_hot).log().subtract(n_psim_200)
+        )
+        n_rah_new = (
+            z2.divide(z1).log().subtract(n_psih_2).add(n_psih_01)
+            .divide(n_ufric_new.multiply(0.41))
+        )
+        # CHANGE OF THE HOT PIXEL dT [K] WITH THE CORRECTED rah
+        n_dT_new = (n_H_hot.multiply(n_rah_new)).divide(n_ro_hot.multiply(n_Cp))
+        n_dif = n_dT_new.subtract(n_dT_hot).abs()
+
+        new_state = ee.Dictionary({
+            "rah": n_rah_new,
+            "ufric": n_ufric_new,
+            "coef_a": n_coef_a,
+            "coef_b": n_coef_b,
+            "dif": n_dif,
+            "iterations": ee.Number(state.get("iterations")).add(1),
+            "converged": n_dif.lt(tolerance),
+        })
+        # EARLY EXIT: ONCE CONVERGED THE STATE IS CARRIED THROUGH UNCHANGED
+        return ee.Algorithms.If(ee.Number(state.get("converged")), state, new_state)
+
+    init = ee.Dictionary({
+        "rah": d_hot.get("rah"),
+        "ufric": d_hot.get("ufric"),
+        "coef_a": 0,
+        "coef_b": 0,
+        "dif": -1,
+        "iterations": 0,
+        "converged": 0,
+    })
+    d_final = ee.Dictionary(ee.List.sequence(1, max_iterations).iterate(step, init))
+
+    # =========END ITERATION =========#
+
+    n_coef_a = ee.Number(d_final.get("coef_a"))
+    n_coef_b = ee.Number(d_final.get("coef_b"))
+
+    # dT, AIR DENSITY AND H FOR EACH PIXEL WITH THE CONVERGED COEFFICIENTS
+    i_lst_med = image.select("T_LST_DEM")
+    i_dT = (
+        ee.Image()
+        .clip(refpoly)
+        .expression(
+            "(n_coef_a * i_lst_med) + n_coef_b",
+            {"n_coef_a": n_coef_a, "n_coef_b": n_coef_b, "i_lst_med": i_lst_med},
+        )
+        .rename("dT")
+    )
+    i_Ta = i_lst_med.expression(
+        "i_lst_med - i_dT_int", {"i_lst_med": i_lst_med, "i_dT_int": i_dT}
+    )
+    i_ro = i_Ta.expression("(-0.0046 * i_Ta) + 2.5538", {"i_Ta": i_Ta}).rename("ro")
+    i_H_int = i_dT.expression(
+        "(i_ro*n_Cp*i_dT_int)/i_rah",
+        {"i_ro": i_ro, "n_Cp": n_Cp, "i_dT_int": i_dT, "i_rah": i_rah},
+    ).rename("H")
+
+    # ONE STABILITY CORRECTION FOR EACH PIXEL
+    i_L_int = i_dT.expression(
+        "-(i_ro*n_Cp*(i_ufric**3)*i_lst_med)/(0.41*9.81*i_H_int)",
+        {
+            "i_ro": i_ro,
+            "n_Cp": n_Cp,
+            "i_ufric": i_ufric,
+            "i_lst_med": i_lst_med,
+            "i_H_int": i_H_int,
+        },
+    ).rename("L")
+    i_psim_200, i_psih_2, i_psih_01 = _fexp_stability_corrections(i_L_int, refpoly)
+
+    i_ufric = i_ufric.expression(
+        "(u200*0.41)/(log(hight/i_zom)-i_psim_200)",
+        {"u200": i_u200, "hight": n_hight, "i_zom": i_zom, "i_psim_200": i_psim_200},
+    ).rename("ufric_star")
+    i_rah_final = i_rah.expression(
+        "(log(z2/z1)-psi_h2+psi_h01)/(i_ufric*0.41)",
+        {"z2": z2, "z1": z1, "i_ufric": i_ufric, "psi_h2": i_psih_2, "psi_h01": i_psih_01},
+    ).rename("rah")
+
+    # GET FINAL H
+    i_H_final = i_dT.expression(  # [W M-2]
+        "(i_ro*n_Cp*i_dT_int)/i_rah",
+        {"i_ro": i_ro, "n_Cp": n_Cp, "i_dT_int": i_dT, "i_rah": i_rah_final},
+    ).rename("H")
+
+    # ADD BANDS
+    image = image.addBands(
+        [
+            i_H_final,
+            i_rah_final,
+            i_dT,
+            i_rah_first,
+            image.select("zom"),
+            image.select("u_fr"),
+            i_ufric,
+        ]
+    )
+    return image.set({
+        "H_iterations": d_final.get("iterations"),
+        "H_converged": d_final.get("converged"),
+    })
@@ -0,0 +1,125 @@
+"""Offline stand-in for the ``ee`` module.
+
+Every attribute access and call returns a new ``Node`` instead of talking to
+Earth Engine, so geesebal graphs can be built without credentials. Mapped
+functions are invoked once with a placeholder element, the same way the real
+client traces them into the request graph. All method calls are appended to
+``calls`` as ``(name, args, kwargs)`` so tests can count what a graph asks the
+server to do. ``getInfo()`` returns whatever ``info`` is set to after
+sleeping ``latency`` seconds, like a server round-trip; ``max_in_flight``
+records how many of them overlapped.
+"""
+import sys
+import threading
+import time
+import types
+
+calls = []
+info = 0
+latency = 0
+in_flight = 0
+max_in_flight = 0
+_lock = threading.Lock()
+
+
+def reset():
+    global info, latency, in_flight, max_in_flight
+    del calls[:]
+    info = 0
+    latency = 0
+    in_flight = 0
+    max_in_flight = 0
+
+
+def count(name):
+    return sum(1 for call in calls if call[0] == name)
+
+
+def args_of(name):
+    return [(args, kwargs) for call_name, args, kwargs in calls if call_name == name]
+
+
+class Node:
+
+    def __init__(self, name='ee'):
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return Node(attr)
+
+    def __call__(self, *args, **kwargs):
+        calls.append((self._name, args, kwargs))
+        # trace server-side functions once, like ee.ComputedObject.map does
+        for arg in list(args) + list(kwargs.values()):
+            if callable(arg) and not isinstance(arg, Node):
+                arg(*[Node('element')] * arg.__code__.co_argcount)
+        return Node(self._name + '()')
+
+    def getInfo(self):
+        global in_flight, max_in_flight
+        calls.append(('getInfo', (), {}))
+        with _lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(latency)
+        with _lock:
+            in_flight -= 1
+        return info
+
+    def __repr__(self):
+        return '<fake ee %s>' % self._name
+
+    def _op(self, *args):
+        return Node('op')
+
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = _op
+    __truediv__ = __rtruediv__ = __neg__ = __pow__ = _op
+
+
+class _Module(types.ModuleType):
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return Node(attr)
+
+
+def install():
+    """Replace ``ee`` in sys.modules, returning the module it replaced."""
+    module = _Module('ee')
+    module.Initialize = lambda *args, **kwargs: None
+    module.EEException = Exception
+    previous = sys.modules.get('ee')
+    sys.modules['ee'] = module
+    return previous
+
+
+_saved = {}
+
+
+def _isolated(name):
+    return name == 'ee' or name == 'geesebal' or name.startswith('geesebal.')
+
+
+def load(*names):
+    """Import fresh copies of ``names`` against the stand-in.
+
+    The real ``ee`` and any geesebal modules already imported are set aside
+    until ``restore()``, so other tests keep using the real client.
+    """
+    import importlib
+    for name in list(sys.modules):
+        if _isolated(name):
+            _saved[name] = sys.modules.pop(name)
+    install()
+    return [importlib.import_module(name) for name in names]
+
+
+def restore():
+    for name in list(sys.modules):
+        if _isolated(name):
+            del sys.modules[name]
+    sys.modules.update(_saved)
+    _saved.clear()
@@ -0,0 +1,26 @@
+"""Synthetic scenes shared by the geesebal.local tests."""
+import numpy as np
+
+
+def make_scene(local, shape=(20, 20), seed=0):
+    # synthetic Landsat scene with a vegetated (cool) half and a bare (hot) half,
+    # local is the geesebal.local module of the calling test
+    rng = np.random.default_rng(seed)
+    rows, cols = shape
+    veg = np.zeros(shape)
+    veg[:, : cols // 2] = 1.0
+    noise = rng.uniform(-0.02, 0.02, shape)
+    image = {
+        'UB': 0.03 + noise,
+        'B': 0.04 + noise,
+        'GR': 0.07 + 0.01 * veg + noise,
+        'R': np.where(veg > 0, 0.04, 0.20) + noise,
+        'NIR': np.where(veg > 0, 0.40, 0.25) + noise,
+        'SWIR_1': 0.20 + noise,
+        'SWIR_2': 0.12 + noise,
+        'T_LST': np.where(veg > 0, 298.0, 318.0) + rng.uniform(-2, 2, shape),
+    }
+    lon, lat = np.meshgrid(np.linspace(-121.80, -121.79, cols), np.linspace(38.54, 38.53, rows))
+    image['longitude'] = lon
+    image['latitude'] = lat
+    return local.f_albedoL8_9(image)
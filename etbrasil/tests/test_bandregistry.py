@@ -0,0 +1,69 @@
+import unittest
+import sys
+import os
+import numpy as np
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../geesebal')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import fake_ee
+import scenes
+
+
+def setUpModule():
+    global ee, bandregistry, tools, local
+    ee, bandregistry, tools, local = fake_ee.load(
+        'ee', 'geesebal.bandregistry', 'geesebal.tools', 'geesebal.local')
+
+def tearDownModule():
+    fake_ee.restore()
+
+
+class TestResolver(unittest.TestCase):
+
+    def test_only_required_bands_in_dependency_order(self):
+        order = bandregistry.resolve_bands(local.SPEC_IND_REGISTRY, ['NDVI_neg', 'e_0'])
+        self.assertEqual(order, ['NDVI', 'pos_NDVI', 'NDVI_neg', 'SAVI', 'LAI', 'e_0'])
+
+    def test_unknown_and_cyclic_bands(self):
+        with self.assertRaises(ValueError):
+            bandregistry.resolve_bands(local.SPEC_IND_REGISTRY, ['NDVI', 'BRT'])
+        cyclic = {'a': (('b',), None), 'b': (('a',), None)}
+        with self.assertRaises(ValueError):
+            bandregistry.resolve_bands(cyclic, ['a'])
+
+    def test_registries_declare_the_same_outputs(self):
+        for name in bandregistry.SPEC_IND_BANDS + bandregistry.SEBAL_SPEC_IND_BANDS:
+            self.assertIn(name, local.SPEC_IND_REGISTRY)
+            self.assertIn(name, tools.SPEC_IND_REGISTRY)
+
+
+class TestLazySpectralIndices(unittest.TestCase):
+
+    def setUp(self):
+        fake_ee.reset()
+
+    def test_local_subset_matches_full(self):
+        scene = scenes.make_scene(local)
+        full = local.fexp_spec_ind(scene)
+        subset = local.fexp_spec_ind(scene, bands=['LAI', 'NDWI'])
+        self.assertNotIn('EVI', subset)
+        self.assertNotIn('SAVI', subset)
+        for band in ['LAI', 'NDWI']:
+            np.testing.assert_array_equal(subset[band], full[band])
+
+    def test_gee_builds_only_requested_bands(self):
+        tools.fexp_spec_ind(ee.Image('scene'), bands=['NDVI', 'pos_NDVI'])
+        self.assertEqual(fake_ee.count('expression'), 0)
+        self.assertEqual(fake_ee.count('pixelLonLat'), 0)
+        self.assertEqual(fake_ee.count('normalizedDifference'), 1)
+
+    def test_gee_coordinates_share_one_projection(self):
+        tools.fexp_spec_ind(ee.Image('scene'))
+        self.assertEqual(fake_ee.count('pixelLonLat'), 1)
+        # EVI, SAVI, LAI, e_0, e_NB
+        self.assertEqual(fake_ee.count('expression'), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
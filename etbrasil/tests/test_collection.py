@@ -0,0 +1,97 @@
+import unittest
+import sys
+import os
+from unittest import mock
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../geesebal')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import fake_ee
+
+
+def setUpModule():
+    global ee, collection
+    ee, collection = fake_ee.load('ee', 'geesebal.collection')
+
+def tearDownModule():
+    fake_ee.restore()
+
+
+def scene(index, time_start, satellite='LANDSAT_9', landsat_id='LC09_L1TP_221071_20220101_20220101_02_T1'):
+    return {'properties': {
+        'index': index,
+        'LANDSAT_ID': landsat_id,
+        'SATELLITE': satellite,
+        'SOLAR_ZENITH_ANGLE': 40.0,
+        'time_start': time_start,
+        'date': '2022-01-01',
+        'bounds': {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]]]},
+    }}
+
+
+class TestCollectionMetadata(unittest.TestCase):
+
+    def setUp(self):
+        fake_ee.reset()
+        # every getInfo() answers with the metadata table
+        fake_ee.info = {'features': [scene('2_LC09_B', 3000), scene('1_1_1_LT05_A', 1000, 'LANDSAT_5'),
+                                     scene('2_LC09_C', 2000)]}
+
+    def build(self, **kwargs):
+        # keep the per-scene SEBAL round-trips out of the count
+        with mock.patch.object(collection, 'fexp_sensible_heat_flux', lambda image, *args: image):
+            return collection.Collection(2022, 1, 1, 2022, 3, 1, 20, 221, 71, **kwargs)
+
+    def test_metadata_fetched_once(self):
+        c = self.build()
+        self.assertEqual(c.count, 3)
+        # one request for the whole table plus the cold pixel temperature of each scene
+        self.assertEqual(fake_ee.count('getInfo'), 1 + c.count)
+
+    def test_scenes_in_date_order(self):
+        c = self.build()
+        self.assertEqual(c.CollectionList, ['1_1_1_LT05_A', '2_LC09_C', '2_LC09_B'])
+        self.assertEqual(c.CollectionList_image, ['2_LC09_B', '1_1_1_LT05_A', '2_LC09_C'])
+        self.assertEqual(c.sceneListL5, ['LT05_A'])
+        self.assertEqual(c.sceneListL9, ['LC09_B', 'LC09_C'])
+        self.assertEqual(c.sceneListL8, [])
+
+class TestCollectionConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        fake_ee.reset()
+        fake_ee.latency = 0.05
+        # scene 'X' has no product id, so building its ET band fails
+        fake_ee.info = {'features': [scene('2_D', 4000, landsat_id='LC09_L1TP_221071_20220104_20220104_02_T1'),
+                                     scene('2_A', 1000, landsat_id='LC09_L1TP_221071_20220101_20220101_02_T1'),
+                                     scene('2_X', 2500, landsat_id=None),
+                                     scene('2_C', 3000, landsat_id='LC09_L1TP_221071_20220103_20220103_02_T1'),
+                                     scene('2_B', 2000, landsat_id='LC09_L1TP_221071_20220102_20220102_02_T1')]}
+
+    def build(self, **kwargs):
+        with mock.patch.object(collection, 'fexp_sensible_heat_flux', lambda image, *args: image):
+            return collection.Collection(2022, 1, 1, 2022, 3, 1, 20, 221, 71, **kwargs)
+
+    def test_serial_by_default(self):
+        c = self.build()
+        self.assertEqual(fake_ee.max_in_flight, 1)
+        self.assertEqual(c.ETList, ['LC09_221071_20220101', 'LC09_221071_20220102',
+                                    'LC09_221071_20220103', 'LC09_221071_20220104'])
+
+    def test_scenes_run_concurrently_in_date_order(self):
+        serial = self.build()
+        self.setUp()
+
+        c = self.build(workers=4)
+        self.assertGreater(fake_ee.max_in_flight, 1)
+        self.assertEqual(c.ETList, serial.ETList)
+
+    def test_failed_scene_is_skipped(self):
+        c = self.build(workers=3)
+        self.assertEqual(list(c.errors), ['2_X'])
+        self.assertEqual(len(c.ETList), 4)
+        self.assertIsNotNone(c.Collection_ET)
+
+
+if __name__ == '__main__':
+    unittest.main()
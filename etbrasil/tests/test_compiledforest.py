@@ -0,0 +1,66 @@
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from pipeline import compiledforest as cf
+
+FEATURES = ['ET_24h', 'NDVI', 'LandT_G', 'last_rain', 'sum_precip_priorX']
+
+
+def make_data(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, len(FEATURES))), columns=FEATURES)
+    y = ((X.ET_24h + 0.5 * X.NDVI - 0.3 * X.LandT_G + rng.normal(scale=0.5, size=n)) > 0).astype(int)
+    return X, y
+
+
+class TestCompiledForest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.X, cls.y = make_data()
+        cls.model = RandomForestClassifier(n_estimators=25, random_state=0).fit(cls.X, cls.y)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_matches_sklearn(self):
+        forest = cf.compileForest(self.model)
+        X_new, _ = make_data(n=2000, seed=1)
+        np.testing.assert_allclose(forest.predict_proba(X_new), self.model.predict_proba(X_new))
+        np.testing.assert_array_equal(forest.predict(X_new), self.model.predict(X_new))
+        self.assertEqual(forest.n_trees, 25)
+
+    def test_memory_mapped_round_trip(self):
+        dirname = os.path.join(self.tmpdir.name, 'model_rf_forest')
+        cf.saveForest(cf.compileForest(self.model), dirname)
+        forest = cf.loadForest(dirname)
+        self.assertIsInstance(forest.value, np.memmap)
+        # small batches give the same answer as one pass
+        np.testing.assert_array_equal(forest.predict(self.X, batch_size=7), self.model.predict(self.X))
+
+    def test_save_replaces_existing_forest(self):
+        dirname = os.path.join(self.tmpdir.name, 'best', 'model_rf_forest')
+        cf.saveForest(RandomForestClassifier(n_estimators=3, random_state=0).fit(self.X, self.y), dirname)
+        cf.saveForest(self.model, dirname)
+        self.assertEqual(cf.loadForest(dirname).n_trees, 25)
+        self.assertEqual(os.listdir(os.path.dirname(dirname)), ['model_rf_forest'])
+
+    def test_columns_selected_by_name(self):
+        forest = cf.compileForest(self.model)
+        X = self.X.assign(loc_idx=1)[['loc_idx'] + FEATURES[::-1]]
+        np.testing.assert_array_equal(forest.predict(X), self.model.predict(self.X))
+        with self.assertRaises(ValueError):
+            forest.predict(self.X.to_numpy()[:, :3])
+
+
+if __name__ == '__main__':
+    unittest.main()
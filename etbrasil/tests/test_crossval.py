@@ -0,0 +1,106 @@
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../pipeline')))
+import crossval
+
+
+def make_data(n=600, n_locs=30, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'ET_24h': rng.normal(size=n),
+        'NDVI': rng.normal(size=n),
+        'loc_idx': rng.integers(0, n_locs, n),
+        'yyyy': rng.integers(2019, 2022, n),
+    })
+    y = (df.ET_24h + rng.normal(scale=0.5, size=n) > 0).astype(int).to_numpy()
+    return df, y
+
+
+class TestCrossVal(unittest.TestCase):
+
+    def test_groups_not_shared(self):
+        df, y = make_data()
+        groups = crossval.groupKeys(df)
+        folds = crossval.groupedFolds(y, groups, n_splits=5)
+        self.assertEqual(len(folds), 5)
+        tested = np.concatenate([test for _, test in folds])
+        self.assertEqual(sorted(tested), list(range(len(y))))
+        for train, test in folds:
+            self.assertFalse(set(groups[train]) & set(groups[test]))
+            # stratified, every fold close to the overall positive rate
+            self.assertLess(abs(y[test].mean() - y.mean()), 0.15)
+
+    def test_block_year(self):
+        df, y = make_data()
+        groups = crossval.groupKeys(df, block_year=True)
+        self.assertEqual(len(set(groups)), len(df.groupby(['loc_idx', 'yyyy'])))
+        train, test = crossval.groupedHoldout(y, groups, test_size=0.2)
+        self.assertFalse(set(groups[train]) & set(groups[test]))
+        self.assertAlmostEqual(len(test) / len(y), 0.2, delta=0.05)
+
+    def test_folds_capped_by_groups(self):
+        df, y = make_data(n_locs=3)
+        self.assertEqual(len(crossval.groupedFolds(y, crossval.groupKeys(df), n_splits=10)), 3)
+        with self.assertRaises(ValueError):
+            crossval.groupedFolds(y, np.zeros(len(y)), n_splits=5)
+
+    def test_parallel_matches_sequential(self):
+        df, y = make_data()
+        X = df[['ET_24h', 'NDVI']]
+        folds = crossval.groupedFolds(y, crossval.groupKeys(df), n_splits=3)
+        make_model = crossval.defaultModel(random_state=0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = crossval.FoldCache(X, y, folds, tmpdir)
+            sequential = crossval.crossValidate(cache, make_model, n_jobs=1)
+            parallel = crossval.crossValidate(cache, make_model, n_jobs=3)
+            self.assertEqual(len(os.listdir(tmpdir)), 4 * len(folds))
+        self.assertEqual([r['f1'] for r in sequential], [r['f1'] for r in parallel])
+        self.assertEqual([r['n_test'] for r in sequential], [len(test) for _, test in folds])
+        self.assertEqual([r['n_train'] for r in sequential], [len(train) for train, _ in folds])
+
+        summary = crossval.summarize(sequential, wall_time=1.23456, group='loc_idx')
+        self.assertEqual(summary['n_splits'], 3)
+        self.assertEqual(summary['wall_time'], 1.235)
+        self.assertAlmostEqual(summary['f1_mean'], np.mean([r['f1'] for r in sequential]))
+
+    def test_fold_subsample(self):
+        df, y = make_data()
+        folds = crossval.groupedFolds(y, crossval.groupKeys(df), n_splits=3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = crossval.FoldCache(df[['ET_24h', 'NDVI']], y, folds, tmpdir)
+            self.assertEqual(cache.n_train, [len(train) for train, _ in folds])
+            # training rows are the fold's rows, shuffled
+            X_train = np.load(cache.files[0]['X_train'])
+            expected = df[['ET_24h', 'NDVI']].to_numpy(np.float32)[folds[0][0]]
+            self.assertEqual(sorted(map(tuple, X_train)), sorted(map(tuple, expected)))
+            result = crossval.scoreFold(cache.files[0], crossval.defaultModel(), 0, n_train=50)
+        self.assertEqual(result['n_train'], 50)
+        self.assertEqual(result['n_test'], len(folds[0][1]))
+
+    def test_engines(self):
+        df, y = make_data()
+        folds = crossval.groupedFolds(y, crossval.groupKeys(df), n_splits=3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = crossval.FoldCache(df[['ET_24h', 'NDVI']], y, folds, tmpdir)
+            for engine, make_model in crossval.MODELS.items():
+                results = crossval.crossValidate(cache, make_model(max_leaf_nodes=15), n_jobs=1)
+                self.assertEqual(len(results), 3)
+                self.assertGreater(np.mean([r['f1'] for r in results]), 0.6, engine)
+
+    def test_is_better(self):
+        cv = lambda f1: {'f1_mean': f1}
+        # legacy stats from the row-wise split are always replaced
+        self.assertTrue(crossval.isBetter({'split': 'loc_idx', 'rf_f1': 0.5}, {'rf_f1': 0.9}))
+        self.assertTrue(crossval.isBetter({'split': 'loc_idx', 'rf_f1': 0.5, 'cv': cv(0.8)},
+                                          {'split': 'loc_idx', 'rf_f1': 0.9, 'cv': cv(0.7)}))
+        self.assertFalse(crossval.isBetter({'split': 'loc_idx', 'rf_f1': 0.8},
+                                           {'split': 'loc_idx', 'rf_f1': 0.9, 'cv': cv(0.7)}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../pipeline')))
+import compiledforest
+import eeforest
+
+FEATURES = ['ET_24h', 'NDVI', 'LandT_G', 'last_rain', 'sum_precip_priorX']
+
+
+def make_data(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, len(FEATURES))), columns=FEATURES)
+    y = ((X.ET_24h + 0.5 * X.NDVI - 0.3 * X.LandT_G + rng.normal(scale=0.5, size=n)) > 0).astype(int)
+    return X, y
+
+
+class TestEEForest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.X, cls.y = make_data()
+        cls.model = RandomForestClassifier(n_estimators=12, max_depth=8, random_state=0).fit(cls.X, cls.y)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_tree_format(self):
+        trees, _ = eeforest.forestStrings(self.model)
+        self.assertEqual(len(trees), 12)
+        lines = trees[0].strip('\n').split('\n')
+        self.assertEqual(lines[0], '1) root 9999 9999 9999')
+        self.assertRegex(lines[1], r'^  2\) \w+<=\S+ 9999 9999 ')
+        self.assertTrue(any(line.endswith(' *') for line in lines))
+
+    def test_round_trip_predictions(self):
+        # chunks written to disk, parsed back and evaluated like GEE does
+        manifest = eeforest.exportForest(self.model, self.tmpdir.name, max_bytes=20000)
+        self.assertGreater(len(manifest['chunks']), 1)
+        self.assertEqual(sum(c['n_trees'] for c in manifest['chunks']), 12)
+        for entry in manifest['chunks']:
+            self.assertLessEqual(entry['bytes'], 20000)
+
+        _, chunks = eeforest.loadForestChunks(self.tmpdir.name)
+        X_new, _ = make_data(n=300, seed=1)
+        # GEE compares the band values as doubles, the local model as float32
+        X_new = X_new.astype(np.float32)
+        probability = eeforest.predictChunks(chunks, X_new.to_dict('records'))
+
+        np.testing.assert_allclose(probability, self.model.predict_proba(X_new)[:, 1])
+        predicted = np.where(probability > 0.5, *self.model.classes_[::-1])
+        np.testing.assert_array_equal(predicted, self.model.predict(X_new))
+
+    def test_compiled_forest_and_band_names(self):
+        forest = compiledforest.compileForest(self.model)
+        names = ['ET_24h_R'] + FEATURES[1:]
+        trees, _ = eeforest.forestStrings(forest, feature_names=names)
+        self.assertEqual(trees, eeforest.forestStrings(self.model, feature_names=names)[0])
+        self.assertNotIn(' ET_24h<=', ''.join(trees))
+        with self.assertRaises(ValueError):
+            eeforest.forestStrings(forest, feature_names=names[:3])
+
+    def test_chunk_limits(self):
+        trees, _ = eeforest.forestStrings(self.model)
+        largest = max(len(tree.encode('utf-8')) for tree in trees)
+        chunks = eeforest.chunkTrees(trees, max_bytes=largest)
+        self.assertEqual([tree for chunk in chunks for tree in chunk], trees)
+        with self.assertRaises(ValueError):
+            eeforest.chunkTrees(trees, max_bytes=largest - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
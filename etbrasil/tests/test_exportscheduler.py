@@ -0,0 +1,137 @@
+import unittest
+import sys
+import os
+import tempfile
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from pipeline import exportscheduler as es
+
+
+class FakeTaskService:
+    # tasks finish after `duration` polls, keys in `fail` fail that many times first
+
+    def __init__(self, duration=2, fail=None, reject=None):
+        self.duration = duration
+        self.fail = dict(fail or {})
+        self.reject = dict(reject or {})
+        self.tasks = {}
+        self.started = []
+        self.max_in_flight = 0
+        self.poll_calls = 0
+
+    def start(self, key, payload):
+        if self.reject.get(key, 0) > 0:
+            self.reject[key] -= 1
+            raise RuntimeError('too many tasks')
+        task_id = 'T' + str(len(self.started))
+        self.started.append(key)
+        failing = self.fail.get(key, 0) > 0
+        if failing:
+            self.fail[key] -= 1
+        self.tasks[task_id] = {'key': key, 'polls': 0, 'failing': failing}
+        in_flight = sum(1 for task in self.tasks.values() if task['polls'] < self.duration)
+        self.max_in_flight = max(self.max_in_flight, in_flight)
+        return task_id
+
+    def poll(self, task_ids):
+        self.poll_calls += 1
+        out = {}
+        for task_id in task_ids:
+            task = self.tasks[task_id]
+            task['polls'] += 1
+            if task['polls'] < self.duration:
+                out[task_id] = es.RUNNING
+            else:
+                out[task_id] = es.FAILED if task['failing'] else es.COMPLETED
+        return out
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestExportScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.manifest = os.path.join(self.tmpdir.name, 'exports.sqlite')
+        self.clock = Clock()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def scheduler(self, backend, **kwargs):
+        kwargs.setdefault('max_running', 3)
+        kwargs.setdefault('poll_interval', 10)
+        kwargs.setdefault('backoff', 60)
+        return es.ExportScheduler(self.manifest, backend=backend,
+                                  sleep=self.clock.sleep, clock=self.clock, **kwargs)
+
+    def test_caps_tasks_in_flight(self):
+        backend = FakeTaskService()
+        scheduler = self.scheduler(backend)
+        for key in range(10):
+            scheduler.add(key, 'fc%d' % key)
+        counts = scheduler.run()
+        self.assertEqual(counts, {es.COMPLETED: 10})
+        self.assertEqual(sorted(backend.started), [str(key) for key in range(10)])
+        self.assertEqual(backend.max_in_flight, 3)
+
+    def test_retries_with_backoff(self):
+        backend = FakeTaskService(fail={'a': 2}, reject={'b': 1})
+        scheduler = self.scheduler(backend, max_retries=3)
+        scheduler.add('a', None)
+        scheduler.add('b', None)
+        self.assertEqual(scheduler.run(), {es.COMPLETED: 2})
+        self.assertEqual(backend.started.count('a'), 3)
+        self.assertEqual(backend.started.count('b'), 1)
+        # two failures of 'a' waited 60 + 120 seconds before being restarted
+        self.assertGreaterEqual(self.clock.now, 180)
+
+    def test_gives_up_after_max_retries(self):
+        backend = FakeTaskService(fail={'a': 5})
+        scheduler = self.scheduler(backend, max_retries=2)
+        scheduler.add('a', None)
+        scheduler.add('b', None)
+        self.assertEqual(scheduler.run(), {es.COMPLETED: 1, es.GAVE_UP: 1})
+        self.assertEqual(backend.started.count('a'), 2)
+
+    def test_resumes_from_manifest(self):
+        backend = FakeTaskService(duration=3)
+        scheduler = self.scheduler(backend)
+        for key in range(5):
+            scheduler.add(key, None)
+        # crash after the first tasks finished, leaving the rest queued or running
+        for _ in range(4):
+            scheduler.poll()
+            scheduler.launch()
+        done = scheduler.counts().get(es.COMPLETED, 0)
+        self.assertGreater(done, 0)
+        scheduler.close()
+
+        resumed = self.scheduler(backend)
+        added = [resumed.add(key, None) for key in range(5)]
+        self.assertEqual(added.count(False), done)
+        self.assertEqual(resumed.run(), {es.COMPLETED: 5})
+        # nothing was exported twice
+        self.assertEqual(sorted(backend.started), [str(key) for key in range(5)])
+
+    def test_polls_in_batches(self):
+        backend = FakeTaskService(duration=2)
+        scheduler = self.scheduler(backend, max_running=10)
+        for key in range(10):
+            scheduler.add(key, None)
+        scheduler.run()
+        self.assertEqual(backend.poll_calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../pipeline')))
+import crossval
+import hypersearch
+
+
+class FakeEvaluator:
+    # score is a fixed quality per candidate, records (rung, candidates, resource)
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, candidates, resource, bracket=0, rung=0):
+        self.calls.append((bracket, rung, len(candidates), resource))
+        return [params['q'] for params in candidates]
+
+
+class TestHyperSearch(unittest.TestCase):
+
+    def test_successive_halving(self):
+        evaluate = FakeEvaluator()
+        candidates = [{'q': q} for q in np.random.default_rng(0).permutation(27)]
+        best, score = hypersearch.successiveHalving(candidates, evaluate, 10, 270, eta=3)
+        self.assertEqual(best, {'q': 26})
+        self.assertEqual(score, 26)
+        self.assertEqual([(n, r) for _, _, n, r in evaluate.calls], [(27, 10), (9, 30), (3, 90), (1, 270)])
+
+    def test_single_survivor_fit_once(self):
+        evaluate = FakeEvaluator()
+        candidates = [{'q': q} for q in range(9)]
+        best, score = hypersearch.successiveHalving(candidates, evaluate, 10, 2700, eta=3)
+        self.assertEqual(best, {'q': 8})
+        # one candidate left after 30 rows, refit on the whole budget only
+        self.assertEqual([(n, r) for _, _, n, r in evaluate.calls], [(9, 10), (3, 30), (1, 2700)])
+
+    def test_hyperband(self):
+        evaluate = FakeEvaluator()
+        candidates = [{'q': q} for q in range(81)]
+        best, score = hypersearch.hyperband(candidates, evaluate, 10, 270, eta=3)
+        brackets = sorted(set(bracket for bracket, _, _, _ in evaluate.calls))
+        self.assertEqual(brackets, [0, 1, 2, 3])
+        # every bracket ends on the whole budget
+        for bracket in brackets:
+            self.assertEqual([r for b, _, _, r in evaluate.calls if b == bracket][-1], 270)
+        self.assertEqual(score, best['q'])
+
+    def test_search_trace(self):
+        rng = np.random.default_rng(0)
+        n = 900
+        df = pd.DataFrame({'ET_24h': rng.normal(size=n), 'NDVI': rng.normal(size=n),
+                           'loc_idx': rng.integers(0, 40, n)})
+        y = (df.ET_24h + rng.normal(scale=0.5, size=n) > 0).astype(int).to_numpy()
+        folds = crossval.groupedFolds(y, crossval.groupKeys(df), n_splits=3)
+        grid = {'n_estimators': [5, 10], 'max_depth': [2, 4, None]}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = crossval.FoldCache(df[['ET_24h', 'NDVI']], y, folds, tmpdir)
+            stats = hypersearch.search(cache, mode='halving', param_grid=grid, n_jobs=2)
+
+        self.assertEqual(stats['n_candidates'], 6)
+        self.assertEqual(stats['max_resource'], min(cache.n_train))
+        self.assertIn(stats['best_params'], [entry['params'] for entry in stats['trace']])
+        # the losers stop after the first rung
+        first = [entry for entry in stats['trace'] if entry['rung'] == 0]
+        self.assertEqual(len(first), 6)
+        self.assertLess(len(stats['trace']) - len(first), 6)
+        self.assertEqual(len(stats['config_seconds']), 6)
+        self.assertEqual(stats['trace'][-1]['n_train'], stats['max_resource'])
+
+        with self.assertRaises(ValueError):
+            hypersearch.search(cache, mode='grid')
+
+
+if __name__ == '__main__':
+    unittest.main()
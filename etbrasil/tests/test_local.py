@@ -0,0 +1,298 @@
+import unittest
+import sys
+import os
+import math
+import subprocess
+import tempfile
+from unittest import mock
+import numpy as np
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../geesebal')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from geesebal import local
+import scenes
+
+
+class TestLocalImport(unittest.TestCase):
+
+    def test_imports_without_ee(self):
+        # the NumPy engine must not pull in Earth Engine through the package __init__
+        code = ("import sys; sys.modules['ee'] = None; sys.path.insert(0, %r); "
+                "from geesebal import local, bandregistry" % os.path.join(os.path.dirname(__file__), '..'))
+        subprocess.run([sys.executable, '-c', code], check=True)
+
+
+class TestLocalSpectralIndices(unittest.TestCase):
+
+    def setUp(self):
+        self.image = local.fexp_spec_ind(scenes.make_scene(local))
+
+    def test_band_names(self):
+        for band in ['NDVI', 'EVI', 'SAVI', 'T_LST', 'LAI', 'e_0', 'e_NB', 'longitude',
+                     'latitude', 'NDVI_neg', 'pos_NDVI', 'int', 'sd_ndvi', 'NDWI']:
+            self.assertIn(band, self.image)
+
+    def test_pixel_formulas(self):
+        img = self.image
+        nir, r, b, gr = img['NIR'][3, 4], img['R'][3, 4], img['B'][3, 4], img['GR'][3, 4]
+        ndvi = (nir - r) / (nir + r)
+        savi = (1.5 * (nir - r)) / (0.5 + nir + r)
+        lai = -(math.log((0.69 - min(savi, 0.689)) / 0.59) / 0.91)
+        self.assertAlmostEqual(img['NDVI'][3, 4], ndvi)
+        self.assertAlmostEqual(img['EVI'][3, 4], 2.5 * ((nir - r) / (nir + 6 * r - 7.5 * b + 1)))
+        self.assertAlmostEqual(img['SAVI'][3, 4], savi)
+        self.assertAlmostEqual(img['NDWI'][3, 4], (gr - nir) / (gr + nir))
+        self.assertAlmostEqual(img['LAI'][3, 4], lai)
+        self.assertAlmostEqual(img['e_0'][3, 4], 0.98 if lai > 3 else 0.95 + 0.01 * lai)
+        self.assertAlmostEqual(img['e_NB'][3, 4], 0.98 if lai > 3 else 0.97 + 0.0033 * lai)
+        self.assertAlmostEqual(img['NDVI_neg'][3, 4], -ndvi)
+
+    def test_pos_ndvi_masks_negative(self):
+        image = scenes.make_scene(local)
+        image['R'][0, 0] = 0.5
+        image['NIR'][0, 0] = 0.1
+        out = local.fexp_spec_ind(image)
+        self.assertTrue(np.isnan(out['pos_NDVI'][0, 0]))
+        self.assertTrue(np.isnan(out['NDVI_neg'][0, 0]))
+
+    def test_input_not_modified(self):
+        image = scenes.make_scene(local)
+        local.fexp_spec_ind(image)
+        self.assertNotIn('NDVI', image)
+
+
+class TestLocalRadiation(unittest.TestCase):
+
+    def setUp(self):
+        self.z_alt = np.full((20, 20), 150.0)
+        self.T_air = 25.0
+        self.UR = 40.0
+        self.sun_elevation = 60.0
+        self.doy = 180
+        image = local.fexp_spec_ind(scenes.make_scene(local))
+        self.image = local.LST_DEM_correction(image, self.z_alt, self.T_air, self.UR,
+                                              self.sun_elevation, 18, 30, self.doy)
+
+    def atmosphere(self):
+        pres = 101.3 * ((293 - 0.0065 * 150.0) / 293) ** 5.26
+        es = 0.6108 * math.exp((17.27 * self.T_air) / (self.T_air + 237.3))
+        ea = es * self.UR / 100
+        W = 0.14 * ea * pres + 2.1
+        cos_theta = math.cos((90 - self.sun_elevation) * 0.01745)
+        tao = 0.35 + 0.627 * math.exp((-0.00146 * pres) / cos_theta - 0.075 * (W / cos_theta) ** 0.4)
+        dr = 1 + 0.033 * math.cos(2 * 3.14 / 365 * self.doy)
+        return pres, es, ea, cos_theta, tao, dr
+
+    def test_flat_terrain_lst_dem(self):
+        # flat DEM -> slope == 0, so the Allen et al. (2006) terms reduce to a closed form
+        pres, es, ea, cos_theta, tao, dr = self.atmosphere()
+        img = self.image
+        t_lst = img['T_LST'][5, 5]
+        lat = img['latitude'][5, 5] * 0.01745
+        delta = math.asin(math.sin(23.45 * 0.01745)) * math.sin((360 / 365) * (self.doy - 81) * 0.01745)
+        # slope == 0 -> a = -sin(delta) sin(phi), b = cos(delta) cos(phi), c = 0
+        a = -math.sin(delta) * math.sin(lat)
+        b = math.cos(delta) * math.cos(lat)
+        delta_gtm = int(np.mean(img['longitude']) / 15)
+        w = ((18 + delta_gtm + 30 / 60) - 12) * 15 * 0.01745
+        cos_zn = -a + b * math.cos(w)
+        air_dens = 1000 * pres / (1.01 * t_lst * 287)
+        expected = t_lst + 150.0 * 0.0065 + (1367 * dr * tao * cos_zn - 1367 * dr * tao * cos_theta) / (air_dens * 1004 * 0.05)
+        self.assertAlmostEqual(img['T_LST_DEM'][5, 5], expected, places=6)
+        self.assertAlmostEqual(img['LST_neg'][5, 5], -expected, places=6)
+
+    def test_radiation_balance(self):
+        pres, es, ea, cos_theta, tao, dr = self.atmosphere()
+        img = local.fexp_radlong_up(self.image)
+        img = local.fexp_radshort_down(img, self.z_alt, self.T_air, self.UR, self.sun_elevation, self.doy)
+        img = local.fexp_radlong_down(img, 300.0)
+        img = local.fexp_radbalance(img)
+        img = local.fexp_soil_heat(img)
+
+        lai = img['LAI'][2, 2]
+        emi = 0.98 if lai > 3 else 0.95 + 0.01 * lai
+        rl_up = emi * 5.67e-8 * img['T_LST'][2, 2] ** 4
+        rs_down = 1367 * cos_theta * tao * dr
+        rl_down = 0.85 * (-math.log(tao)) ** 0.09 * 5.67e-8 * 300.0 ** 4
+        alfa = img['ALFA'][2, 2]
+        rn = (1 - alfa) * rs_down + rl_down - rl_up - (1 - img['e_0'][2, 2]) * rl_down
+        g = rn * (img['T_LST_DEM'][2, 2] - 273.15) * (0.0038 + 0.0074 * alfa) * (1 - 0.98 * img['NDVI'][2, 2] ** 4)
+
+        self.assertAlmostEqual(img['Tao_sw'][2, 2], tao)
+        self.assertAlmostEqual(img['ES'][2, 2], es)
+        self.assertAlmostEqual(img['EA'][2, 2], ea)
+        self.assertAlmostEqual(img['Rl_up'][2, 2], rl_up)
+        self.assertAlmostEqual(img['Rs_down'][2, 2], rs_down)
+        self.assertAlmostEqual(img['Rl_down'][2, 2], rl_down)
+        self.assertAlmostEqual(img['Rn'][2, 2], rn)
+        self.assertAlmostEqual(img['G'][2, 2], g)
+
+
+class TestLocalSebal(unittest.TestCase):
+
+    def setUp(self):
+        self.meteorology = {'AirT_G': 25.0, 'ux_G': 2.5, 'RH_G': 40.0, 'Rn24h_G': 180.0}
+        self.image, self.d_cold, self.d_hot = local.fexp_sebal(
+            scenes.make_scene(local), np.full((20, 20), 150.0), self.meteorology,
+            sun_elevation=60.0, hour=18, minuts=30, doy=180, seed=1)
+
+    def test_endmembers(self):
+        # cold pixel is picked on the vegetated half and the hot pixel on the bare half
+        self.assertLess(self.d_cold['col'], 10)
+        self.assertGreaterEqual(self.d_hot['col'], 10)
+        self.assertGreater(self.d_cold['sum'], 0)
+        self.assertGreater(self.d_hot['sum'], 0)
+        self.assertLess(self.d_cold['temp'], self.d_hot['temp'])
+
+    def test_fused_endmembers_match_separate_selection(self):
+        d_cold = local.fexp_cold_pixel(self.image, None, 5, 20, seed=1)
+        d_hot = local.fexp_hot_pixel(self.image, None, 10, 20, seed=1)
+        f_cold, f_hot = local.fexp_endmembers(self.image, None, 5, 20, 10, 20, seed=1)
+        f_hot = local.fexp_hot_pixel_fluxes(self.image, f_hot)
+        self.assertEqual(f_cold, d_cold)
+        self.assertEqual(f_hot, d_hot)
+        self.assertEqual(f_hot, self.d_hot)
+
+    def test_output_bands(self):
+        for band in ['H', 'rah', 'dT', 'rah_first', 'zom', 'u_fr', 'ufric_star',
+                     'ET_inst', 'ET_24h', 'LE', 'EF']:
+            self.assertIn(band, self.image)
+            self.assertEqual(self.image[band].shape, (20, 20))
+
+    def test_dT_vanishes_at_cold_pixel(self):
+        # dT = a*Ts + b is calibrated so that dT(Ts_cold) == 0
+        img = self.image
+        hot = (self.d_hot['row'], self.d_hot['col'])
+        dT = img['dT']
+        ts = img['T_LST_DEM']
+        a = (dT[hot] - dT[0, 0]) / (ts[hot] - ts[0, 0])
+        self.assertAlmostEqual(a * (self.d_cold['temp'] - ts[hot]) + dT[hot], 0.0, places=6)
+
+    def test_et_formulas(self):
+        img = self.image
+        rn, g, ts = img['Rn'][4, 4], img['G'][4, 4], img['T_LST_DEM'][4, 4]
+        h = max(img['H'][4, 4], 0)
+        le = rn - g - h
+        lam = 2.501 - 0.002361 * (ts - 273.15)
+        ef = le / (rn - g)
+        self.assertAlmostEqual(img['LE'][4, 4], le)
+        self.assertAlmostEqual(img['ET_inst'][4, 4], 0.0036 * le / lam)
+        self.assertAlmostEqual(img['EF'][4, 4], ef)
+        self.assertAlmostEqual(img['ET_24h'][4, 4], 0.0864 * ef * 180.0 / lam)
+
+    def test_vegetation_evaporates_more(self):
+        et = self.image['ET_24h']
+        self.assertGreater(np.nanmean(et[:, :10]), np.nanmean(et[:, 10:]))
+
+
+class TestLocalTerrainCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rows, cols = np.mgrid[0:20, 0:20]
+        self.z_alt = 150.0 + 2.0 * rows + 0.5 * cols
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_tile_is_computed_once_and_memory_mapped(self):
+        cache = local.TerrainTileCache(self.tmpdir.name)
+        tile = cache.get('221_071', self.z_alt)
+        self.assertIsInstance(tile['slope'], np.memmap)
+        self.assertIs(cache.get('221_071'), tile)
+        # a second process only maps the files
+        other = local.TerrainTileCache(self.tmpdir.name)
+        self.assertIn('221_071', other)
+        reopened = other.get('221_071')
+        self.assertEqual(other.stats, {'hits': 1, 'misses': 0})
+        expected = local.fexp_terrain(self.z_alt)
+        for band in local.TerrainTileCache.BANDS:
+            np.testing.assert_allclose(reopened[band], expected[band])
+
+    def test_missing_tile_needs_elevation(self):
+        with self.assertRaises(KeyError):
+            local.TerrainTileCache(self.tmpdir.name).get('221_072')
+
+    def test_sebal_with_cached_terrain_matches(self):
+        meteorology = {'AirT_G': 25.0, 'ux_G': 2.5, 'RH_G': 40.0, 'Rn24h_G': 180.0}
+        tile = local.TerrainTileCache(self.tmpdir.name).get('tile', self.z_alt)
+        args = (scenes.make_scene(local), self.z_alt, meteorology)
+        kwargs = dict(sun_elevation=60.0, hour=18, minuts=30, doy=180, seed=1)
+        direct, _, _ = local.fexp_sebal(*args, **kwargs)
+        cached, _, _ = local.fexp_sebal(*args, terrain=tile, **kwargs)
+        for band in ['T_LST_DEM', 'Rs_down', 'ET_24h']:
+            np.testing.assert_allclose(cached[band], direct[band])
+
+
+class TestLocalAtmosphere(unittest.TestCase):
+
+    def test_sebal_computes_atmosphere_once(self):
+        meteorology = {'AirT_G': 25.0, 'ux_G': 2.5, 'RH_G': 40.0, 'Rn24h_G': 180.0}
+        with mock.patch.object(local, '_atmosphere', wraps=local._atmosphere) as atm:
+            local.fexp_sebal(scenes.make_scene(local), np.full((20, 20), 150.0), meteorology,
+                             sun_elevation=60.0, hour=18, minuts=30, doy=180, seed=1)
+        self.assertEqual(atm.call_count, 1)
+
+    def test_shared_state_matches_recomputed(self):
+        z_alt = np.full((20, 20), 150.0)
+        image = local.fexp_spec_ind(scenes.make_scene(local))
+        atm = local.fexp_atmosphere(z_alt, 25.0, 40.0, 60.0, 180)
+        shared = local.fexp_radshort_down(image, z_alt, 25.0, 40.0, 60.0, 180, atmosphere=atm)
+        direct = local.fexp_radshort_down(image, z_alt, 25.0, 40.0, 60.0, 180)
+        np.testing.assert_allclose(shared['Rs_down'], direct['Rs_down'])
+
+
+class TestLocalScalarSolver(unittest.TestCase):
+
+    def setUp(self):
+        self.meteorology = {'AirT_G': 25.0, 'ux_G': 2.5, 'RH_G': 40.0, 'Rn24h_G': 180.0}
+        self.image, self.d_cold, self.d_hot = local.fexp_sebal(
+            scenes.make_scene(local), np.full((20, 20), 150.0), self.meteorology,
+            sun_elevation=60.0, hour=18, minuts=30, doy=180, seed=1)
+
+    def solve(self, **kwargs):
+        return local.fexp_sensible_heat_flux_ver_server(
+            self.image, self.meteorology['ux_G'], None, None,
+            self.d_cold['temp'], self.d_hot, **kwargs)
+
+    def test_same_coefficients_without_early_exit(self):
+        # the hot pixel trajectory of the image iteration only depends on hot pixel values
+        image_mode = self.solve()
+        scalar_mode = self.solve(solver='scalar', tolerance=0)
+        np.testing.assert_allclose(scalar_mode['dT'], image_mode['dT'], rtol=1e-10)
+        # rah and H get a single stability correction from the neutral rah,
+        # the image solver applies 15 per pixel
+        np.testing.assert_allclose(scalar_mode['rah'], image_mode['rah'], rtol=0.2)
+        np.testing.assert_allclose(scalar_mode['H'], image_mode['H'], rtol=0.2, atol=1e-6)
+        self.assertFalse(np.allclose(scalar_mode['rah'], image_mode['rah']))
+
+    def test_early_exit(self):
+        img = self.image
+        hot = (self.d_hot['row'], self.d_hot['col'])
+        u_fr = img['u_fr'][hot]
+        args = (math.log(20) / (u_fr * 0.41), u_fr, u_fr * math.log(200 / 0.36) / 0.41,
+                img['zom'][hot], self.d_cold['temp'], self.d_hot['temp'],
+                self.d_hot['Rn'] - self.d_hot['G'])
+        a_full, b_full, n_full = local._hot_pixel_iteration(*args, tolerance=0)
+        a, b, n = local._hot_pixel_iteration(*args, tolerance=0.01)
+        self.assertEqual(n_full, 15)
+        self.assertLess(n, 15)
+        self.assertAlmostEqual(a, a_full, places=3)
+        self.assertAlmostEqual(b, b_full, places=0)
+
+    def test_scalar_mode_close_to_image_mode(self):
+        image_mode = self.solve()
+        scalar_mode = self.solve(solver='scalar')
+        np.testing.assert_allclose(scalar_mode['dT'], image_mode['dT'], rtol=1e-2, atol=1e-6)
+        np.testing.assert_allclose(scalar_mode['rah'], image_mode['rah'], rtol=0.2)
+        np.testing.assert_allclose(scalar_mode['H'], image_mode['H'], rtol=0.2, atol=1e-6)
+        self.assertEqual(set(scalar_mode), set(image_mode))
+
+    def test_unknown_solver(self):
+        with self.assertRaises(ValueError):
+            self.solve(solver='fast')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import sys
+import os
+from unittest import mock
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../geesebal')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import fake_ee
+
+
+def setUpModule():
+    global ee, meteorology, collection, timeseries
+    ee, meteorology, collection, timeseries = fake_ee.load(
+        'ee', 'geesebal.meteorology', 'geesebal.collection', 'geesebal.timeseries')
+
+def tearDownModule():
+    fake_ee.restore()
+
+
+HOUR = 60 * 60 * 1000
+BOUNDS = {'type': 'Polygon', 'coordinates': [[[-47.9, -15.9], [-47.1, -15.9], [-47.1, -15.1], [-47.9, -15.1], [-47.9, -15.9]]]}
+FAR_BOUNDS = {'type': 'Polygon', 'coordinates': [[[-52.9, -20.9], [-52.1, -20.9], [-52.1, -20.1], [-52.9, -20.1], [-52.9, -20.9]]]}
+
+
+class TestMeteorologyProvider(unittest.TestCase):
+
+    def setUp(self):
+        fake_ee.reset()
+
+    def test_hour_key(self):
+        self.assertEqual(meteorology.fexp_meteo_hour(5 * HOUR + 1234), 5 * HOUR)
+        self.assertEqual(meteorology.fexp_meteo_hour(5 * HOUR), 5 * HOUR)
+
+    def test_same_hour_and_tile_share_a_stack(self):
+        provider = meteorology.MeteorologyProvider()
+        first = provider.stack(5 * HOUR + 10, BOUNDS)
+        self.assertIs(provider.stack(5 * HOUR + 40000, BOUNDS), first)
+        self.assertIsNot(provider.stack(6 * HOUR + 10, BOUNDS), first)
+        self.assertIsNot(provider.stack(5 * HOUR + 10, FAR_BOUNDS), first)
+        self.assertEqual(provider.stats, {'hits': 1, 'misses': 3})
+
+    def test_lru_eviction(self):
+        provider = meteorology.MeteorologyProvider(maxsize=2)
+        a = provider.stack(1 * HOUR, BOUNDS)
+        provider.stack(2 * HOUR, BOUNDS)
+        provider.stack(1 * HOUR, BOUNDS)  # a becomes the most recent
+        provider.stack(3 * HOUR, BOUNDS)  # evicts hour 2
+        self.assertEqual(len(provider.cache), 2)
+        self.assertIs(provider.stack(1 * HOUR, BOUNDS), a)
+        provider.stack(2 * HOUR, BOUNDS)
+        self.assertEqual(provider.stats['misses'], 4)
+
+    def test_one_pass_sets_count_and_bands(self):
+        with mock.patch.object(meteorology, 'fexp_meteo_stack', wraps=meteorology.fexp_meteo_stack) as stack:
+            meteorology.fexp_meteorology(ee.Image('scene'), scale=30)
+        self.assertEqual(stack.call_count, 1)
+        self.assertIn(('meteo_count',), [args[:1] for args, kwargs in fake_ee.args_of('set')])
+
+    def test_collection_builds_one_stack_per_hour(self):
+        with mock.patch.object(meteorology, 'fexp_meteo_stack', wraps=meteorology.fexp_meteo_stack) as stack:
+            meteorology.fexp_meteorology_collection(ee.ImageCollection('landsat'), scale=30)
+        # traced once for the distinct hours, joined to every image
+        self.assertEqual(stack.call_count, 1)
+        self.assertEqual(fake_ee.count('distinct'), 1)
+        self.assertEqual(fake_ee.count('saveFirst'), 1)
+
+    def test_collection_scenes_share_stacks(self):
+        def scene(index, time_start):
+            return {'properties': {'index': index, 'LANDSAT_ID': 'LC09_L1TP_221071_20220101_20220101_02_T1',
+                                   'SATELLITE': 'LANDSAT_9', 'SOLAR_ZENITH_ANGLE': 40.0,
+                                   'time_start': time_start, 'date': '2022-01-01', 'bounds': BOUNDS}}
+        # two scenes of the same overpass and one an hour later
+        fake_ee.info = {'features': [scene('2_A', 13 * HOUR + 100), scene('2_B', 13 * HOUR + 125),
+                                     scene('2_C', 14 * HOUR + 100)]}
+        with mock.patch.object(meteorology, 'fexp_meteo_stack', wraps=meteorology.fexp_meteo_stack) as stack, \
+             mock.patch.object(collection, 'fexp_sensible_heat_flux', lambda image, *args: image):
+            c = collection.Collection(2022, 1, 1, 2022, 3, 1, 20, 221, 71)
+        self.assertEqual(stack.call_count, 2)
+        self.assertEqual(c.meteorology.stats, {'hits': 1, 'misses': 2})
+
+
+class TestPrecipCube(unittest.TestCase):
+
+    def setUp(self):
+        fake_ee.reset()
+
+    def test_cube_built_once_per_extraction(self):
+        with mock.patch.object(timeseries, 'retrievePrecip', wraps=meteorology.retrievePrecip) as precip:
+            ts = timeseries.TimeSeries(2018, 1, 1, 2018, 4, 1, 20, ee.Geometry.Point([-47.0, -15.0]).buffer(50))
+        # every Landsat collection reads its window from the shared cube
+        self.assertEqual(precip.call_count, 4)
+        for args, kwargs in precip.call_args_list:
+            self.assertIs(kwargs['cube'], ts.precip_cube)
+        # the daily sums are only defined once, not per image
+        self.assertEqual(fake_ee.count('sequence'), 1)
+
+    def test_precip_image_uses_array_reductions(self):
+        cube = meteorology.buildPrecipCube('2018-01-01', '2018-04-01')
+        fake_ee.reset()
+        meteorology.retrievePrecipImage('2018-02-10', ee.Image('scene'), cube=cube)
+        self.assertEqual(fake_ee.count('sequence'), 0)
+        self.assertEqual(fake_ee.count('arrayArgmax'), 1)
+        self.assertEqual(fake_ee.args_of('arraySlice'), [((0, 0, 3), {})])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import sys
+import os
+from unittest import mock
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../geesebal')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import fake_ee
+
+
+def setUpModule():
+    global ee, scenebatch, timeseries, meteorology, endmembers
+    ee, scenebatch, timeseries, meteorology, endmembers = fake_ee.load(
+        'ee', 'geesebal.scenebatch', 'geesebal.timeseries', 'geesebal.meteorology', 'geesebal.endmembers')
+
+def tearDownModule():
+    fake_ee.restore()
+
+
+def ok_properties():
+    # property dicts of the features built with status 'ok'
+    return [args[1] for args, kwargs in fake_ee.args_of('Feature')
+            if len(args) > 1 and isinstance(args[1], dict) and args[1].get('status') == 'ok']
+
+
+class TestSceneBatch(unittest.TestCase):
+
+    def setUp(self):
+        fake_ee.reset()
+        self.locations = ee.FeatureCollection([])
+
+    def build(self, **kwargs):
+        return scenebatch.SceneBatch(2018, 1, 1, 2018, 4, 1, 20, self.locations, **kwargs)
+
+    def test_sebal_runs_once_per_scene(self):
+        with mock.patch.object(scenebatch, 'fexp_endmembers', wraps=scenebatch.fexp_endmembers) as endmembers, \
+             mock.patch.object(scenebatch, 'fexp_et', wraps=scenebatch.fexp_et) as et:
+            self.build()
+        # one trace per Landsat collection, independent of the number of locations
+        self.assertEqual(endmembers.call_count, 4)
+        self.assertEqual(et.call_count, 4)
+        # the SEBAL bands and the precipitation window, each sampled once per scene
+        self.assertEqual(fake_ee.count('reduceRegions'), 8)
+        self.assertEqual(fake_ee.count('flatten'), 4)
+
+    def test_locations_sampled_with_reduce_regions(self):
+        self.build()
+        # TimeSeries samples its single location with reduceRegion, so only the batch counts here
+        timeseries.TimeSeries(2018, 1, 1, 2018, 4, 1, 20, ee.Geometry.Point([-47.0, -15.0]).buffer(50))
+        self.assertEqual(fake_ee.count('reduceRegions'), 8)
+        for args, kwargs in fake_ee.args_of('reduceRegions'):
+            self.assertIn('collection', kwargs)
+            self.assertEqual(kwargs['scale'], 30)
+
+    def test_same_properties_as_timeseries(self):
+        timeseries.TimeSeries(2018, 1, 1, 2018, 4, 1, 20, ee.Geometry.Point([-47.0, -15.0]).buffer(50))
+        expected = set(ok_properties()[-1])
+        fake_ee.reset()
+
+        self.build()
+        properties = ok_properties()
+        self.assertEqual(len(properties), 4)
+        for props in properties:
+            self.assertEqual(set(props), expected)
+
+    def test_regional_et_reads_min_and_max(self):
+        self.build(calcRegionalET=True)
+        fetched = [args[0] for args, kwargs in fake_ee.args_of('get')]
+        self.assertIn('ET_24h_first', fetched)
+        self.assertIn('ET_24h_min', fetched)
+        self.assertIn('ET_24h_max', fetched)
+        for args, kwargs in fake_ee.args_of('copyProperties'):
+            self.assertIn('ET_24h_min', kwargs['exclude'])
+            self.assertIn('precip_9', kwargs['exclude'])
+
+    def test_precip_bands_most_recent_first(self):
+        meteorology.retrievePrecipBands('2018-02-10', window_days=10)
+        self.assertIn((('system:time_start', False), {}), fake_ee.args_of('sort'))
+        names = [args[0] for args, kwargs in fake_ee.args_of('rename')]
+        self.assertIn(['precip_' + str(day) for day in range(10)], names)
+
+
+class TestEndmembers(unittest.TestCase):
+
+    def setUp(self):
+        fake_ee.reset()
+
+    def test_hot_candidates_need_valid_lst(self):
+        # water pixels (masked LST_NW) are neither counted nor sampled as hot pixels
+        endmembers.fexp_endmembers(ee.Image(), ee.Geometry.Point([-47.0, -15.0]), 5, 20, 10, 20)
+        self.assertEqual(fake_ee.count('mask'), 1)
+        self.assertIn((('LST_NW',), {}), fake_ee.args_of('select'))
+
+
+if __name__ == '__main__':
+    unittest.main()
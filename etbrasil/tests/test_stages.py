@@ -0,0 +1,100 @@
+import unittest
+import sys
+import os
+import tempfile
+import pandas as pd
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../pipeline')))
+import stages
+
+
+class Counter:
+    # stage function returning a small frame, counts its calls
+
+    def __init__(self, value=1):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return pd.DataFrame({'x': [self.value, self.value + 1]})
+
+
+class TestStageCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = stages.StageCache()
+        fn = Counter()
+        key, first = cache.run('filter', 'parent', fn, ndvi=True)
+        self.assertFalse(cache.last_hit)
+        again, second = cache.run('filter', 'parent', fn, ndvi=True)
+        self.assertTrue(cache.last_hit)
+        self.assertEqual(again, key)
+        self.assertIs(second, first)
+        # another parameter or parent is another output
+        other, _ = cache.run('filter', 'parent', fn, ndvi=False)
+        self.assertFalse(cache.last_hit)
+        self.assertNotEqual(other, key)
+        cache.run('filter', 'other_parent', fn, ndvi=True)
+        self.assertEqual(fn.calls, 3)
+        self.assertEqual(cache.stats, {'stage_hits': 1, 'stage_misses': 3})
+
+    def test_persist_across_instances(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = Counter()
+            key, expected = stages.StageCache(tmpdir).run('featurize', 'parent', fn)
+            stages.StageCache(tmpdir).run('eda', key, fn, persist=False)
+            self.assertEqual(os.listdir(tmpdir), [key + '.pkl'])
+
+            cache = stages.StageCache(tmpdir)
+            _, value = cache.run('featurize', 'parent', fn)
+            self.assertTrue(cache.last_hit)
+            pd.testing.assert_frame_equal(value, expected)
+            cache.run('eda', key, fn, persist=False)
+            self.assertFalse(cache.last_hit)
+            self.assertEqual(fn.calls, 3)
+
+    def test_memory_scoped_to_datafile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = stages.StageCache(tmpdir)
+            fn = Counter()
+            load_a, _ = cache.run('load', None, lambda: 'a', persist=False, filename='A.zip')
+            featurize_a, _ = cache.run('featurize', 'a', fn)
+            eda_a, _ = cache.run('eda', featurize_a, fn, persist=False)
+            # the same datafile keeps its outputs
+            cache.run('load', None, lambda: 'a', persist=False, filename='A.zip')
+            self.assertTrue(cache.last_hit)
+            self.assertIn(featurize_a, cache.memory)
+
+            cache.run('load', None, lambda: 'b', persist=False, filename='B.zip')
+            self.assertEqual(list(cache.memory), [cache.scope_key])
+            self.assertNotEqual(cache.scope_key, load_a)
+
+            # persisted outputs come back from disk, the others are computed again
+            cache.run('featurize', 'a', fn)
+            self.assertTrue(cache.last_hit)
+            cache.run('eda', featurize_a, fn, persist=False)
+            self.assertFalse(cache.last_hit)
+            self.assertEqual(fn.calls, 3)
+
+    def test_materialize(self):
+        frame = Counter()()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'features.pkl')
+            stages.StageCache().materialize('filter_0', frame, filename)
+            pd.testing.assert_frame_equal(pd.read_pickle(filename), frame)
+
+            cachedir = os.path.join(tmpdir, 'cache')
+            cache = stages.StageCache(cachedir)
+            for name in ('exp01.pkl', 'exp02.pkl'):
+                cache.materialize('filter_0', frame, os.path.join(tmpdir, name))
+                pd.testing.assert_frame_equal(pd.read_pickle(os.path.join(tmpdir, name)), frame)
+            # one pickle per key, linked or copied into place
+            self.assertEqual(os.listdir(cachedir), ['filter_0_frame.pkl'])
+            # an existing file is replaced
+            cache.materialize('filter_0', frame, filename)
+            pd.testing.assert_frame_equal(pd.read_pickle(filename), frame)
+
+
+if __name__ == '__main__':
+    unittest.main()
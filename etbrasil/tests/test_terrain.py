@@ -0,0 +1,75 @@
+import unittest
+import sys
+import os
+from unittest import mock
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../geesebal')))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import fake_ee
+
+
+def setUpModule():
+    global ee, terrain, timeseries, image
+    ee, terrain, timeseries, image = fake_ee.load(
+        'ee', 'geesebal.terrain', 'geesebal.timeseries', 'geesebal.image')
+
+def tearDownModule():
+    fake_ee.restore()
+
+
+BOUNDS = {'type': 'Polygon', 'coordinates': [[[-47.9, -15.9], [-47.1, -15.9], [-47.1, -15.1], [-47.9, -15.1], [-47.9, -15.9]]]}
+FAR_BOUNDS = {'type': 'Polygon', 'coordinates': [[[-52.9, -20.9], [-52.1, -20.9], [-52.1, -20.1], [-52.9, -20.1], [-52.9, -20.9]]]}
+
+
+class TestTerrain(unittest.TestCase):
+
+    def setUp(self):
+        fake_ee.reset()
+
+    def test_provider_reuses_terrain_per_aoi(self):
+        provider = terrain.TerrainProvider()
+        first = provider.get(BOUNDS)
+        self.assertIs(provider.get(dict(BOUNDS)), first)
+        self.assertIsNot(provider.get(FAR_BOUNDS), first)
+        self.assertEqual(provider.stats, {'hits': 1, 'misses': 2})
+        self.assertEqual(fake_ee.count('products'), 2)
+
+    def test_timeseries_derives_terrain_once(self):
+        with mock.patch.object(timeseries, 'fexp_terrain', wraps=terrain.fexp_terrain) as built:
+            timeseries.TimeSeries(2018, 1, 1, 2018, 4, 1, 20, ee.Geometry.Point([-47.0, -15.0]).buffer(50))
+        self.assertEqual(built.call_count, 1)
+        # the four Landsat collections only clip the shared image
+        self.assertEqual(fake_ee.count('products'), 1)
+        self.assertEqual(fake_ee.count('slope'), 0)
+
+    def test_radiation_reuses_terrain(self):
+        with mock.patch.object(timeseries, 'LST_DEM_correction', wraps=timeseries.LST_DEM_correction) as lst, \
+             mock.patch.object(timeseries, 'fexp_radshort_down', wraps=timeseries.fexp_radshort_down) as rad:
+            timeseries.TimeSeries(2018, 1, 1, 2018, 4, 1, 20, ee.Geometry.Point([-47.0, -15.0]).buffer(50))
+        self.assertEqual(lst.call_count, 4)
+        for call in lst.call_args_list:
+            self.assertIsNotNone(call.kwargs['terrain'])
+        # both consume the same atmospheric state of the image
+        for lst_call, rad_call in zip(lst.call_args_list, rad.call_args_list):
+            self.assertIs(lst_call.kwargs['atmosphere'], rad_call.kwargs['atmosphere'])
+
+    def test_atmosphere_built_once_per_image(self):
+        tools = sys.modules['geesebal.tools']
+        with mock.patch.object(timeseries, 'fexp_atmosphere', wraps=tools.fexp_atmosphere) as shared, \
+             mock.patch.object(tools, 'fexp_atmosphere', wraps=tools.fexp_atmosphere) as rebuilt:
+            timeseries.TimeSeries(2018, 1, 1, 2018, 4, 1, 20, ee.Geometry.Point([-47.0, -15.0]).buffer(50))
+        # one state per traced image, neither function rebuilds its own
+        self.assertEqual(shared.call_count, 4)
+        self.assertEqual(rebuilt.call_count, 0)
+
+    def test_image_shares_terrain(self):
+        with mock.patch.object(image, 'LST_DEM_correction', wraps=image.LST_DEM_correction) as lst:
+            image.Image(window_start='2022-06-01', window_end='2022-07-01',
+                        aoi=ee.Geometry.Point([-121.8, 38.5]).buffer(500))
+        self.assertEqual(lst.call_count, 4)
+        self.assertEqual(fake_ee.count('products'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
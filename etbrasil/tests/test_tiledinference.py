@@ -0,0 +1,124 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from pipeline import tiledinference as ti
+
+# ~13 x 9 km near Davis, CA
+BOUNDS = [-121.85, 38.50, -121.70, 38.58]
+
+
+def predict(tile):
+    # value encodes the global pixel position, so misplaced tiles show up in the mosaic
+    row, col = tile['offset']
+    rows, cols = np.mgrid[row:row + tile['height'], col:col + tile['width']]
+    return rows * 10000.0 + cols
+
+
+class FlakyBackend(ti.LocalTileBackend):
+
+    def __init__(self, fail=None, delay=0):
+        super().__init__(predict)
+        self.fail = dict(fail or {})
+        self.delay = delay
+        self.fetched = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, tile, path):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            self.fetched.append(tile['key'])
+            if self.fail.get(tile['key'], 0) > 0:
+                self.fail[tile['key']] -= 1
+                raise RuntimeError('Computation timed out.')
+            super().fetch(tile, path)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class TestTileGrid(unittest.TestCase):
+
+    def test_tiles_respect_budget_and_cover_aoi(self):
+        grid, tiles = ti.tileGrid(BOUNDS, scale=30, max_pixels=30000)
+        self.assertGreater(len(tiles), 1)
+        covered = np.zeros((grid['height'], grid['width']), dtype=int)
+        for tile in tiles:
+            self.assertLessEqual(tile['width'] * tile['height'], 30000)
+            row, col = tile['offset']
+            covered[row:row + tile['height'], col:col + tile['width']] += 1
+        # every pixel in exactly one tile
+        self.assertTrue((covered == 1).all())
+        self.assertLessEqual(grid['transform'][2], BOUNDS[0])
+        self.assertGreaterEqual(grid['transform'][5], BOUNDS[3])
+
+    def test_small_aoi_is_one_tile(self):
+        grid, tiles = ti.tileGrid([-121.80, 38.53, -121.79, 38.54], max_pixels=30000)
+        self.assertEqual(len(tiles), 1)
+        self.assertEqual((tiles[0]['height'], tiles[0]['width']), (grid['height'], grid['width']))
+
+
+class TestTiledInference(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.out = self.tmpdir.name
+        self.sleeps = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_tiles(self, backend, **kwargs):
+        kwargs.setdefault('max_pixels', 20000)
+        return ti.runTiledInference(BOUNDS, self.out, backend, sleep=self.sleeps.append, **kwargs)
+
+    def test_mosaic_matches_whole_aoi(self):
+        manifest = self.run_tiles(FlakyBackend())
+        mosaic = np.load(os.path.join(self.out, manifest['mosaic']))
+        whole = predict({'offset': [0, 0], 'width': manifest['width'], 'height': manifest['height']})
+        np.testing.assert_array_equal(mosaic[0], whole)
+        self.assertEqual(manifest['counts'], {'COMPLETED': len(manifest['tiles'])})
+        self.assertEqual(ti.loadManifest(self.out)['mosaic'], manifest['mosaic'])
+
+    def test_bounded_concurrency(self):
+        backend = FlakyBackend(delay=0.02)
+        manifest = self.run_tiles(backend, workers=3)
+        self.assertGreater(len(manifest['tiles']), 3)
+        self.assertEqual(backend.max_in_flight, 3)
+
+    def test_retries_failed_tiles(self):
+        backend = FlakyBackend(fail={'r000_c001': 2})
+        manifest = self.run_tiles(backend, max_retries=3, backoff=30)
+        self.assertEqual(backend.fetched.count('r000_c001'), 3)
+        self.assertEqual(self.sleeps, [30, 60])
+        self.assertEqual(set(manifest['counts']), {'COMPLETED'})
+
+    def test_gives_up_then_resumes(self):
+        backend = FlakyBackend(fail={'r000_c001': 5})
+        manifest = self.run_tiles(backend, max_retries=2)
+        self.assertEqual(manifest['counts']['GAVE_UP'], 1)
+        tile = [t for t in manifest['tiles'] if t['key'] == 'r000_c001'][0]
+        mosaic = np.load(os.path.join(self.out, manifest['mosaic']))
+        row, col = tile['offset']
+        self.assertTrue(np.isnan(mosaic[0, row:row + tile['height'], col:col + tile['width']]).all())
+
+        # the rerun only fetches the missing tile
+        retry = FlakyBackend()
+        manifest = self.run_tiles(retry, max_retries=2)
+        self.assertEqual(retry.fetched, ['r000_c001'])
+        self.assertEqual(set(manifest['counts']), {'COMPLETED'})
+        self.assertFalse(np.isnan(np.load(os.path.join(self.out, manifest['mosaic']))).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
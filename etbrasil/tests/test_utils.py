@@ -0,0 +1,43 @@
+import unittest
+import sys
+import os
+import numpy as np
+# add the path to the module
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../pipeline')))
+import utils
+
+
+class TestParsePrecipMatrix(unittest.TestCase):
+
+    def test_missing_values_stay_in_their_row(self):
+        nan = np.nan
+        cases = [
+            (['[1, 2]', None], [[1, 2], [nan, nan]]),
+            (['[1, 2]', nan, nan], [[1, 2], [nan, nan], [nan, nan]]),
+            ([None, '[1, 2]', '[]'], [[nan, nan], [1, 2], [nan, nan]]),
+            (['[1, 2]', None, '[3, 4]'], [[1, 2], [nan, nan], [3, 4]]),
+            ([None, nan, '[]'], np.zeros((3, 0))),
+        ]
+        for precip, expected in cases:
+            out = utils.parsePrecipMatrix(precip)
+            self.assertEqual(out.dtype, np.float32)
+            np.testing.assert_array_equal(out, np.array(expected, dtype=np.float32), str(precip))
+
+    def test_ragged_rows_padded(self):
+        out = utils.parsePrecipMatrix(['[1]', '[]', '[2, 3, 4]', '[5, x]', None])
+        expected = [[1, np.nan, np.nan],
+                    [np.nan, np.nan, np.nan],
+                    [2, 3, 4],
+                    [5, np.nan, np.nan],
+                    [np.nan, np.nan, np.nan]]
+        np.testing.assert_array_equal(out, np.array(expected, dtype=np.float32))
+
+    def test_width(self):
+        precip = ['[1, 2, 3]', None, '[4]']
+        np.testing.assert_array_equal(utils.parsePrecipMatrix(precip, width=2),
+                                      np.array([[1, 2], [np.nan, np.nan], [4, np.nan]], dtype=np.float32))
+        self.assertEqual(utils.parsePrecipMatrix(precip, width=5).shape, (3, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
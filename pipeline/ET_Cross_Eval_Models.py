@@ -12,17 +12,49 @@ import pandas as pd
 from tqdm import tqdm
 from datetime import datetime
 
+from joblib import Parallel, delayed
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import f1_score
-
+from sklearn.metrics import accuracy_score, f1_score
+
+import compiledforest
+
+
+cols = ['NDVI', 'LandT_G', 'last_rain', 'sum_precip_priorX', 'mm', 'yyyy', 'loc_idx', 'date']
+num_cols_rf = 6 # includes et_var, which is put first
+
+def loadEvalData(path, exp_ref, part, datasets):
+    # testdata.pkl or traindata.pkl of one experiment, read once and kept in datasets
+    key = (path, exp_ref, part)
+    if key not in datasets:
+        datasets[key] = pd.read_pickle(path +'/'+ exp_ref + '/' + part + '.pkl')
+    return datasets[key]
+
+def featureColumns(model, et_var):
+    # columns the model was fit on, selected by name as in compiledforest;
+    # the first num_cols_rf columns for models fit without feature names
+    if isinstance(model, compiledforest.CompiledForest):
+        names = model.meta.get('feature_names')
+    else:
+        names = getattr(model, 'feature_names_in_', None)
+    if names is None:
+        return ([et_var] + cols)[:num_cols_rf]
+    return [str(name) for name in names]
+
+def scoreModel(model, X_test, y_test):
+    # one prediction per (model, dataset), both scores derived from it
+    y_pred = model.predict(X_test)
+    # true_label is 0/1 as in ET_Train_RF.fit
+    return accuracy_score(y_test, y_pred), f1_score(y_test, y_pred, pos_label=1)
 
 def eval(inpath='',
-        outpath=''):
+        outpath='',
+        workers=1):
 
     if not os.path.exists(outpath):
         os.mkdir(outpath)
 
-    paths = glob.glob(inpath+'*')
+    # one folder per model, other files in inpath are skipped
+    paths = [path for path in glob.glob(inpath+'*') if os.path.isdir(path)]
 
 
     # for each file
@@ -42,39 +74,37 @@ def eval(inpath='',
     filtrain = []
     etvar = []
     tempor = []
-    rf_accuracy = []
-    rf_f1 = []
 
+    # ## Load every model and dataset once
+    models = {}
     for path_outer in tqdm(paths):
-
         bestmodel_path = path_outer + '/best/'
-        bestmodel = joblib.load(bestmodel_path + "model_rf.pkl")
+        if os.path.exists(bestmodel_path + "model_rf_forest"):
+            # memory-mapped arrays, no unpickling of the estimator
+            bestmodel = compiledforest.loadForest(bestmodel_path + "model_rf_forest")
+        else:
+            bestmodel = joblib.load(bestmodel_path + "model_rf.pkl")
 
         with open(bestmodel_path + 'summary_stats.json', 'r', encoding='utf-8') as f:
-            bestmodel_stats = json.load(f)
+            models[path_outer] = (bestmodel, json.load(f))
 
+    datasets = {}
+    matrices = {}
+    tasks = []
+    for path_outer in paths:
+        bestmodel, bestmodel_stats = models[path_outer]
         exp_ref = bestmodel_stats['exp_ref']
-        et_var = bestmodel_stats['et_var']
-
-        for path_inner in tqdm(paths, leave=False):
-            testdatapath = path_inner +'/'+ exp_ref + '/testdata.pkl'
-            df_test = pd.read_pickle(testdatapath)
-
-            if path_inner != path_outer:
-                traindatapath = path_inner +'/'+ exp_ref + '/traindata.pkl'
-                df_train = pd.read_pickle(traindatapath)
-                df_test = pd.concat([df_test, df_train])
-
-            cols = [et_var, 'NDVI', 'LandT_G', 'last_rain', 'sum_precip_priorX', 'mm', 'yyyy', 'loc_idx', 'date']
-            num_cols_rf = 6
-
-            X_test = df_test[cols[:num_cols_rf]]
-            y_test = df_test['true_label']
-
-            rf_accuracy.append(bestmodel.score(X_test, y_test))
-
-            y_pred = bestmodel.predict(X_test)
-            rf_f1.append(f1_score(y_test, y_pred, pos_label='Irrigated'))
+        columns = featureColumns(bestmodel, bestmodel_stats['et_var'])
+
+        for path_inner in paths:
+            key = (path_inner, exp_ref, tuple(columns), path_inner != path_outer)
+            if key not in matrices:
+                df_test = loadEvalData(path_inner, exp_ref, 'testdata', datasets)
+                if path_inner != path_outer:
+                    df_train = loadEvalData(path_inner, exp_ref, 'traindata', datasets)
+                    df_test = pd.concat([df_test, df_train])
+                matrices[key] = (df_test[columns], df_test['true_label'])
+            tasks.append((path_outer, path_inner, key))
 
             evalmodelname.append(path_outer.split('/')[-1])
             evaldataname.append(path_inner.split('/')[-1])
@@ -83,6 +113,15 @@ def eval(inpath='',
             filtrain.append(bestmodel_stats['filter_rain'])
             etvar.append(bestmodel_stats['et_var'])
             tempor.append(bestmodel_stats['temporality'])
+    datasets.clear()
+
+    # ## Score every (model, dataset) pair, optionally on threads
+    scores = Parallel(n_jobs=workers, prefer='threads')(
+        delayed(scoreModel)(models[path_outer][0], *matrices[key])
+        for path_outer, path_inner, key in tqdm(tasks, leave=False))
+
+    rf_accuracy = [float(acc) for acc, _ in scores]
+    rf_f1 = [float(f1) for _, f1 in scores]
 
     df_results = pd.DataFrame({
             'eval_model': evalmodelname,
@@ -106,6 +145,7 @@ def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument('--inpath', required=False, default='../runs/', help='Path for input files')
     parser.add_argument('--outpath', required=False, default='../crosseval/', help='Path for output files')
+    parser.add_argument('--workers', type=int, required=False, default=1, help='Number of threads scoring (model, dataset) pairs')
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -29,6 +29,8 @@ import argparse
 import sys
 import os
 import glob
+import json
+from datetime import datetime
 
 import ee
 service_account = 'data-access@second-impact-342800.iam.gserviceaccount.com'
@@ -39,8 +41,83 @@ ee.Initialize(creds)
 import ET_EDA as eda
 import ET_Featurization as feat
 import ET_Train_RF as trainRF
+import stages as stagedag
 import utils
 
+def prepare(datafile=None,
+        nofilterndvi=False,
+        nofilterrain=False,
+        inpath='',
+        outpath='',
+        noeda=False,
+        verbose=False,
+        showPlot=False,
+        readers=None,
+        snap=None,
+        stages=None):
+    # Runs every stage before training in a new expNN directory.
+    # Returns the directory, the filtered features for trainRF.fit and their stage key
+
+    newpath = utils.setupOutputPaths(datafile, outpath)
+
+    # stages shared between runs (e.g. by ET_Gen_All_Models) are computed once
+    if stages is None:
+        stages = stagedag.StageCache()
+
+    # ## Load and transform
+    zipname = inpath + datafile
+    zipstat = os.stat(zipname)
+    _, digest = stages.run('load', None, lambda: utils.hashFile(zipname), persist=False,
+                           filename=os.path.abspath(zipname), size=zipstat.st_size, mtime=zipstat.st_mtime)
+    transform_key, (df, cache_hit) = stages.run('transform', digest,
+                           lambda: utils.loadTransformedET(datafile, inpath=inpath, readers=readers,
+                                                           snap=snap, digest=digest),
+                           persist=False, snap=snap)
+    cache_hit = cache_hit or stages.last_hit
+
+    ts = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    out_stats = {
+        'dataname': datafile,
+        'runtime': ts
+    }
+
+    if (not noeda):
+        if verbose:
+            print('EDA Step')
+        _, eda_stats = stages.run('eda', transform_key,
+                           lambda: eda.analyze(datafile=datafile, outpath=newpath, verbose=verbose,
+                                               showPlot=showPlot, df=df, cache_hit=cache_hit),
+                           persist=False)
+        out_stats.update({k: v for k, v in eda_stats.items()
+                          if k not in out_stats and not k.startswith('cache_')})
+
+    if verbose:
+        print('Featurization Step')
+
+    def featurizeStage():
+        data, num_ET_err = utils.baseETcleanse(df)
+        return feat.featurize(data.copy()), feat.sampleStats(data, num_ET_err)
+
+    featurize_key, (features, sample_stats) = stages.run('featurize', transform_key, featurizeStage)
+    filter_key, (features, filter_stats) = stages.run('filter', featurize_key,
+                           lambda: feat.filterFeatures(features, not nofilterndvi, not nofilterrain),
+                           ndvi=not nofilterndvi, rain=not nofilterrain)
+
+    for key, value in sample_stats.items():
+        out_stats.setdefault(key, value)
+    utils.recordCacheStats(out_stats, cache_hit)
+    out_stats.update(filter_stats)
+    out_stats['stages'] = {'transform': transform_key, 'featurize': featurize_key, 'filter': filter_key}
+    out_stats.update(stages.stats)
+
+    utils.generateETlocationTable(df, source=datafile).to_csv(newpath + 'locations.csv', index=False)
+    # filtered features of this run, read by ET_Infer for the best model's exp_ref
+    stages.materialize(filter_key, features, newpath + 'features.pkl')
+    with open(newpath + 'summary_stats.json', 'w', encoding='utf-8') as f:
+        json.dump(out_stats, f, ensure_ascii=False, indent=4)
+
+    return newpath, features, filter_key
+
 def run(aoi=None,
         datafile=None,
         nofilterndvi=False,
@@ -53,7 +130,11 @@ def run(aoi=None,
         infer=False,
         nosavemodel=False,
         verbose=False,
-        showPlot=False):
+        showPlot=False,
+        readers=None,
+        snap=None,
+        stages=None,
+        engine='rf'):
 
     if extract:
         if (not aoi) or (not os.path.exists(aoi)):
@@ -70,17 +151,10 @@ def run(aoi=None,
         print('Error: Valid input data file required')
         exit()
 
-    newpath = utils.setupOutputPaths(datafile, outpath)
-
-    if (not noeda):
-        if verbose:
-            print('EDA Step')
-        eda.analyze(datafile=datafile, inpath=inpath, outpath=newpath, verbose=verbose, showPlot=showPlot)
-
-    if verbose:
-        print('Featurization Step')
-    feat.generateFeatures(datafile=datafile, inpath=inpath, outpath=newpath,
-                    nofilterndvi=nofilterndvi, nofilterrain=nofilterrain)
+    newpath, features, _ = prepare(datafile=datafile, inpath=inpath, outpath=outpath,
+                                   nofilterndvi=nofilterndvi, nofilterrain=nofilterrain,
+                                   noeda=noeda, verbose=verbose, showPlot=showPlot,
+                                   readers=readers, snap=snap, stages=stages)
 
     if not infer:
         if verbose:
@@ -88,7 +162,8 @@ def run(aoi=None,
         # requires setting inpath=outpath
         trainRF.fit(datafile=datafile, inpath=newpath, outpath=newpath,
                     nofilterndvi=nofilterndvi, nofilterrain=nofilterrain,
-                    calcETregion=calcETregion, nosavemodel=nosavemodel)
+                    calcETregion=calcETregion, nosavemodel=nosavemodel,
+                    df=features, engine=engine)
 
     if infer:
         pass
@@ -96,6 +171,8 @@ def run(aoi=None,
             print('Infer Step')
         #serveET.predict(aoi, ...) # to be completed
 
+    return newpath
+
 
 def parse_opt():
     parser = argparse.ArgumentParser()
@@ -112,6 +189,9 @@ def parse_opt():
     parser.add_argument('--nosavemodel', action='store_true', help='Disable saving model')
     parser.add_argument('--verbose', action='store_true', help='Print output to console')
     parser.add_argument('--showPlot', action='store_true', help='Display EDA plots (this will freeze processing until popup window is dismissed)')
+    parser.add_argument('--readers', type=int, required=False, default=None, help='Number of threads reading the zip members')
+    parser.add_argument('--engine', required=False, default='rf', choices=['rf', 'hgb'], help='Classifier to train (rf: random forest, hgb: histogram gradient boosting)')
+    parser.add_argument('--snap', type=float, required=False, default=None, help='Grid spacing in degrees for matching sample locations (e.g. 0.00027 for ~30 m)')
     return parser.parse_args()
 
 if __name__ == "__main__":
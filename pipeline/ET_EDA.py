@@ -68,22 +68,20 @@ def analyze(datafile=None,
         inpath='',
         outpath='',
         verbose=False,
-        showPlot=False):
-
-    df = pd.DataFrame()
-    zf = ZipFile(inpath + datafile)
-    files = zf.filelist
-    for file in tqdm(files):
-        try:
-            tmp = pd.read_csv(zf.open(file))
-            df = pd.concat([df, tmp], ignore_index=True)
-        except:
-            logging.error(f' in file {file.filename}')
-
-    df = utils.baseETtransforms(df)
-    df = utils.generateETlocationLabels(df)
+        showPlot=False,
+        readers=None,
+        cachedir=None,
+        snap=None,
+        df=None,
+        cache_hit=False):
+
+    # df: an already transformed frame (see utils.loadTransformedET), skips loading
+    if df is None:
+        df, cache_hit = utils.loadTransformedET(datafile, inpath=inpath, cachedir=cachedir,
+                                                readers=readers, snap=snap)
 
     path = utils.setupOutputPaths(datafile, outpath)
+    utils.generateETlocationTable(df, source=datafile).to_csv(path + 'locations.csv', index=False)
 
     # ## EDA
     ts = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
@@ -91,6 +89,7 @@ def analyze(datafile=None,
         'dataname': datafile,
         'runtime': ts
     }
+    utils.recordCacheStats(out_stats, cache_hit)
 
     # ##### Basic counts
     out_stats['num_samples'] = int(len(df))
@@ -179,6 +178,8 @@ def analyze(datafile=None,
 
     plt.close('all')
 
+    return out_stats
+
 def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument('--datafile', required=True, help='Filename of ET data to process')
@@ -186,6 +187,9 @@ def parse_opt():
     parser.add_argument('--outpath', required=False, default='../runs/', help='Path for output files')
     parser.add_argument('--verbose', action='store_true', help='Print output to console')
     parser.add_argument('--showPlot', action='store_true', help='Display EDA plots (this will freeze processing until popup window is dismissed)')
+    parser.add_argument('--readers', type=int, required=False, default=None, help='Number of threads reading the zip members')
+    parser.add_argument('--cachedir', required=False, default=None, help='Path for the parsed data cache (default: inpath/.etcache)')
+    parser.add_argument('--snap', type=float, required=False, default=None, help='Grid spacing in degrees for matching sample locations (e.g. 0.00027 for ~30 m)')
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -57,74 +57,53 @@ logging.basicConfig(format='%(asctime)s %(message)s',
                     filename='et_featurization.log',
                     filemode='w')
 
-def generateFeatures(datafile=None,
-            nofilterndvi=False,
-            nofilterrain=False,
-            inpath='',
-            outpath=''):
-
-    filter_ndvi = not nofilterndvi
-    filter_rain = not nofilterrain
-
-    # ## Load, transform and cleanse data
-    df = pd.DataFrame()
-    zf = ZipFile(inpath + datafile)
-    files = zf.filelist
-    for file in tqdm(files):
-        try:
-            tmp = pd.read_csv(zf.open(file))
-            df = pd.concat([df, tmp], ignore_index=True)
-        except:
-            logging.error(f' in file {file.filename}')
-
-    df = utils.baseETtransforms(df)
-    df, num_ET_err = utils.baseETcleanse(df)
-    df = utils.generateETlocationLabels(df)
-
-    path = utils.setupOutputPaths(datafile, outpath)
-
-    statsfilename = path + 'summary_stats.json'
-    ts = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    out_stats = {
-        'dataname': datafile,
-        'runtime': ts
+# ##### Terrain-type labels
+terrain_types = {
+    'Irrigated': [0], # can contain multiple values
+    'Rainfed':   [1], # can contain multiple values
+}
+
+def sampleStats(df, num_ET_err):
+    return {
+        'num_samples': int(len(df)),
+        'num_blank_ET_samples': int(df.ET_24h.isna().sum()),
+        'num_locations': int(len(df['loc_idx'].unique())),
+        'num_ET_too_low': int(num_ET_err),
     }
-    if os.path.exists(statsfilename):
-        with open(statsfilename, 'r', encoding='utf-8') as f:
-            out_stats = json.load(f)
-    else:
-        out_stats['num_samples'] = int(len(df))
-        out_stats['num_blank_ET_samples'] = int(df.ET_24h.isna().sum())
-        out_stats['num_locations'] = int(len(df['loc_idx'].unique()))
-        out_stats['num_ET_too_low'] = int(num_ET_err)
 
+def featurize(df):
     # ## Feature Engineering
     df_features = df
 
     # ##### Add terrain-type label
-    terrain_types = {
-        'Irrigated': [0], # can contain multiple values
-        'Rainfed':   [1], # can contain multiple values
-    }
-    df_features['type'] = np.nan
+    df_features['type'] = None
     for key in terrain_types:
         df_features.loc[df_features.loc_type.isin(terrain_types[key]), 'type'] = key
     df_features = df_features.dropna(subset=['type'])
 
+    # Daily precipitation, one row per sample and one column per prior day
+    precip = utils.parsePrecipMatrix(df_features.precip)
+
     # Cumulative precipitation over prior X days
-    df_features['sum_precip_priorX'] = df_features.precip.apply(lambda x: sum([float(y) for y in x.strip('][').split(', ')][:3]))
+    df_features['sum_precip_priorX'] = np.nansum(precip[:, :3], axis=1, dtype=np.float64)
 
 
     # ##### Number of days since last precipitation
     rain_threshold = 0.254 # 0.254 mm = 0.01 inches of rainfall in a day, source:  Paolo
-    def findFirstPrecip(x):
-        # values of 10+ indicate that the date of last rain was outside the number of weather days available in the data
-        y1 = [float(y) for y in x.strip('][').split(', ')]
-        y2 = np.where(np.array(y1) > rain_threshold)[0][:1]
-        y3 = y2.item() if len(y2)>0 else 9
-        return y3 + 1
+    # values of 10+ indicate that the date of last rain was outside the number of weather days available in the data
+    rained = precip > np.float32(rain_threshold)
+    df_features['last_rain'] = np.where(rained.any(axis=1), rained.argmax(axis=1), 9) + 1
 
-    df_features['last_rain'] = df_features.precip.apply(findFirstPrecip)
+    # ##### Regionalized ET_24h score: ET_24h_R
+    df_features['ET_24h_R'] = (df_features['ET_24h'].subtract(df_features['ET_R_min'])) \
+                       .divide(
+                               df_features['ET_R_max'].subtract(df_features['ET_R_min']).replace(0,np.nan)
+                              )
+
+    return df_features
+
+def filterFeatures(df_features, filter_ndvi=True, filter_rain=True):
+    out_stats = {}
 
     # ##### Remove low NDVI
     if filter_ndvi:
@@ -137,19 +116,53 @@ def generateFeatures(datafile=None,
         out_stats['num_rain_filtered_out'] = int((df_features.last_rain > 3).sum())
         df_features = df_features[df_features.last_rain > 3] # threshold defined in team meeting on 22 Feb 2022
 
-    # ##### Regionalized ET_24h score: ET_24h_R
-    df_features['ET_24h_R'] = (df_features['ET_24h'].subtract(df_features['ET_R_min'])) \
-                       .divide(
-                               df_features['ET_R_max'].subtract(df_features['ET_R_min']).replace(0,np.nan)
-                              )
+    for key in terrain_types.keys():
+        out_stats['num_'+key+'_post_filters'] = int(len(df_features['type'] == key))
+
+    return df_features, out_stats
+
+def generateFeatures(datafile=None,
+            nofilterndvi=False,
+            nofilterrain=False,
+            inpath='',
+            outpath='',
+            readers=None,
+            cachedir=None,
+            snap=None):
+
+    filter_ndvi = not nofilterndvi
+    filter_rain = not nofilterrain
+
+    # ## Load, transform and cleanse data
+    df, cache_hit = utils.loadTransformedET(datafile, inpath=inpath, cachedir=cachedir,
+                                            readers=readers, snap=snap)
+    locations = utils.generateETlocationTable(df, source=datafile)
+    df, num_ET_err = utils.baseETcleanse(df)
+
+    path = utils.setupOutputPaths(datafile, outpath)
+    locations.to_csv(path + 'locations.csv', index=False)
+
+    statsfilename = path + 'summary_stats.json'
+    ts = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    out_stats = {
+        'dataname': datafile,
+        'runtime': ts
+    }
+    if os.path.exists(statsfilename):
+        with open(statsfilename, 'r', encoding='utf-8') as f:
+            out_stats = json.load(f)
+    else:
+        out_stats.update(sampleStats(df, num_ET_err))
+    utils.recordCacheStats(out_stats, cache_hit)
+
+    df_features = featurize(df)
+    df_features, filter_stats = filterFeatures(df_features, filter_ndvi, filter_rain)
+    out_stats.update(filter_stats)
 
     # ## Save working dataframe for next step in pipeline
     df_features.to_pickle(path + 'features.pkl')
 
     # ## Save summary statistics
-    for key in terrain_types.keys():
-        out_stats['num_'+key+'_post_filters'] = int(len(df_features['type'] == key))
-
     filename = path + 'summary_stats.json'
     with open(filename, 'w', encoding='utf-8') as f:
         json.dump(out_stats, f, ensure_ascii=False, indent=4)
@@ -162,6 +175,9 @@ def parse_opt():
     parser.add_argument('--nofilterrain', action='store_true', help='Disable Rain filter')
     parser.add_argument('--inpath', required=False, default='../raw_data/', help='Path for input files')
     parser.add_argument('--outpath', required=False, default='../runs/', help='Path for output files')
+    parser.add_argument('--readers', type=int, required=False, default=None, help='Number of threads reading the zip members')
+    parser.add_argument('--cachedir', required=False, default=None, help='Path for the parsed data cache (default: inpath/.etcache)')
+    parser.add_argument('--snap', type=float, required=False, default=None, help='Grid spacing in degrees for matching sample locations (e.g. 0.00027 for ~30 m)')
     return parser.parse_args()
 
 if __name__ == "__main__":
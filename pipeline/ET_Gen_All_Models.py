@@ -14,21 +14,32 @@
 #     python ET_Gen_All_Models.py --all
 # or
 #     python ET_Gen_All_Models.py --datafile ET_20220308_wesus8_WA.zip
+# add --workers N to train the models on N processes
+# add --engines rf hgb to train every variation with both classifiers, the
+# runs of the sweep are compared in engine_comparison.csv of each model folder
 
 import argparse
 import sys
 import os
 import glob
+import json
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
 # custom libraries
 import ET_Driver as driver
+import ET_Train_RF as trainRF
+import stages as stagedag
+import utils
 
 def run(all=False,
         datafile=None,
         inpath='',
         outpath='',
-        showPlot=False):
+        showPlot=False,
+        workers=1,
+        engines=None):
 
     if (not all) and (not datafile):
         print('Requires either specifying a datafile or using the --all flag')
@@ -43,19 +54,123 @@ def run(all=False,
     ndvi_opt = [False, True]
     rain_opt = [False, True]
     calc_ET_region_opt = [False, True]
+    engines = engines or ['rf']
 
+    # load, transform and featurize once per datafile, filter once per filter combination
+    stages = stagedag.StageCache(outpath + '.stages/')
+
+    if workers and workers > 1:
+        newpaths = runPool(files, ndvi_opt, rain_opt, calc_ET_region_opt, engines, inpath, outpath, showPlot, stages, workers)
+    else:
+        newpaths = runSerial(files, ndvi_opt, rain_opt, calc_ET_region_opt, engines, inpath, outpath, showPlot, stages)
+
+    if len(engines) > 1:
+        compareEngines(newpaths)
+
+def runSerial(files, ndvi_opt, rain_opt, calc_ET_region_opt, engines, inpath, outpath, showPlot, stages):
+    # returns the expNN directories created, in order
+    newpaths = []
     for file in tqdm(files):
       for nopt in tqdm(ndvi_opt, leave=False):
         for ropt in tqdm(rain_opt, leave=False):
           for copt in tqdm(calc_ET_region_opt, leave=False):
+            for engine in engines:
+              filename = file.split('/')[-1]
+              newpaths.append(driver.run(datafile=filename,
+                          inpath=inpath,
+                          outpath=outpath,
+                          nofilterndvi=nopt,
+                          nofilterrain=ropt,
+                          calcETregion=copt,
+                          showPlot=showPlot,
+                          stages=stages,
+                          engine=engine))
+    return newpaths
+
+def runPool(files, ndvi_opt, rain_opt, calc_ET_region_opt, engines, inpath, outpath, showPlot, stages, workers):
+    # Upstream stages run here, in order, so expNN directories are numbered as
+    # in the serial sweep. Each filtered frame is saved once as memory-mapped
+    # columns and the training cells run on a process pool.
+    # Returns the expNN directories created, in order
+    num_cpus = os.cpu_count() or 1
+    workers = min(workers, num_cpus)
+    n_jobs = max(1, num_cpus // workers) # trees per model use the cores left per worker
+
+    cells = []
+    for file in tqdm(files):
+      for nopt in ndvi_opt:
+        for ropt in rain_opt:
+          for copt in calc_ET_region_opt:
+            for engine in engines:
               filename = file.split('/')[-1]
-              driver.run(datafile=filename,
+              newpath, features, filter_key = driver.prepare(datafile=filename,
                           inpath=inpath,
                           outpath=outpath,
                           nofilterndvi=nopt,
                           nofilterrain=ropt,
+                          showPlot=showPlot,
+                          stages=stages)
+              _, manifest = stages.run('share', filter_key,
+                          lambda: utils.shareFrame(features, outpath + '.stages/shared/' + filter_key),
+                          persist=False)
+              cells.append((len(features), manifest, dict(datafile=filename,
+                          inpath=newpath,
+                          outpath=newpath,
+                          nofilterndvi=nopt,
+                          nofilterrain=ropt,
                           calcETregion=copt,
-                          showPlot=showPlot)
+                          n_jobs=n_jobs,
+                          engine=engine)))
+
+    # largest cells first so the pool does not end waiting on a single big fit
+    cells.sort(key=lambda cell: -cell[0])
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(trainRF.fitShared, manifest, **kwargs) for _, manifest, kwargs in cells]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+    return [kwargs['outpath'] for _, _, kwargs in cells]
+
+def compareEngines(newpaths):
+    # one row per model trained in the expNN directories of this sweep, written
+    # to engine_comparison.csv of each model folder, then the mean per engine
+    rows = []
+    for newpath in sorted(newpaths):
+        statsfile = newpath + 'summary_stats.json'
+        if not os.path.exists(statsfile):
+            continue
+        with open(statsfile, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        if 'rf_f1' not in stats:
+            continue
+        folder = os.path.dirname(os.path.dirname(newpath))
+        rows.append({
+            'folder': folder,
+            'dataname': os.path.basename(folder),
+            'exp_ref': stats.get('exp_ref'),
+            'engine': stats.get('engine', 'rf'),
+            'filter_ndvi': stats.get('filter_ndvi'),
+            'filter_rain': stats.get('filter_rain'),
+            'et_var': stats.get('et_var'),
+            'accuracy': stats.get('rf_accuracy'),
+            'f1': stats.get('rf_f1'),
+            'cv_f1': stats.get('cv', {}).get('f1_mean'),
+            'train_seconds': stats.get('train_seconds'),
+            'model_bytes': stats.get('model_bytes'),
+        })
+    if not rows:
+        return None
+
+    metrics = ['accuracy', 'f1', 'cv_f1', 'train_seconds', 'model_bytes']
+    comparison = pd.DataFrame(rows)
+    # runs from before cv / timings were recorded have None
+    comparison[metrics] = comparison[metrics].apply(pd.to_numeric)
+    for folder, runs in comparison.groupby('folder'):
+        runs.drop(columns='folder').to_csv(folder + '/engine_comparison.csv', index=False)
+    summary = comparison.groupby('engine')[metrics].mean()
+    print(summary.to_string())
+    return comparison
 
 def parse_opt():
     parser = argparse.ArgumentParser()
@@ -64,6 +179,8 @@ def parse_opt():
     parser.add_argument('--inpath', required=False, default='../raw_data/', help='Path for input files')
     parser.add_argument('--outpath', required=False, default='../runs/', help='Path for output files')
     parser.add_argument('--showPlot', action='store_true', help='Display EDA plots (this will freeze processing until popup window is dismissed)')
+    parser.add_argument('--workers', type=int, required=False, default=1, help='Number of processes training models in parallel')
+    parser.add_argument('--engines', nargs='+', required=False, default=['rf'], choices=['rf', 'hgb'], help='Classifiers to train for every variation')
     return parser.parse_args()
 
 if __name__ == "__main__":
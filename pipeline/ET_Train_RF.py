@@ -4,6 +4,7 @@
 # ## Description
 
 # This notebook is used to train a RandomForestClassifier on the ET data
+# (--engine hgb trains a HistGradientBoostingClassifier instead)
 #
 # The SEBAL calculations for ET are leveraged from https://github.com/gee-hydro/geeSEBAL
 #
@@ -43,11 +44,14 @@ import pandas as pd
 import json
 
 from sklearn import tree
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
 from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay, f1_score
 
+import io
 import os
+import shutil
+import tempfile
+import time
 import joblib
 from datetime import datetime
 from tqdm import tqdm
@@ -57,6 +61,9 @@ import seaborn as sns
 
 # custom libraries
 import utils
+import compiledforest
+import crossval
+import hypersearch
 
 # ## Load, transform and cleanse data
 
@@ -66,17 +73,25 @@ def fit(datafile=None,
         inpath='',
         outpath='',
         calcETregion=False,
-        nosavemodel=False):
+        nosavemodel=False,
+        df=None,
+        n_jobs=None,
+        cvfolds=5,
+        cvblockyear=False,
+        search=None,
+        engine='rf'):
 
     filter_ndvi = not nofilterndvi
     filter_rain = not nofilterrain
     save_model = not nosavemodel
 
-    infilename = inpath + '/features.pkl'
-    if not os.path.exists(infilename):
-        print('Missing input datafile')
+    # df: features passed in directly (see ET_Driver), skips reading features.pkl
+    if df is None:
+        infilename = inpath + '/features.pkl'
+        if not os.path.exists(infilename):
+            print('Missing input datafile')
 
-    df = pd.read_pickle(infilename)
+        df = pd.read_pickle(infilename)
 
     path = utils.setupOutputPaths(datafile, outpath)
 
@@ -118,13 +133,11 @@ def fit(datafile=None,
         et_var = 'ET_24h_R'
     out_stats['et_var'] = et_var
     out_stats['temporality'] = 'all_months'
+    out_stats['engine'] = engine
 
     cols = [et_var, 'NDVI', 'LandT_G', 'last_rain', 'sum_precip_priorX', 'mm', 'yyyy', 'loc_idx', 'date']
     num_cols_rf = 5 # changed from 6 on 2022.08.02 to remove yyyy from predictors
 
-    use_gridsearchcv = False # flag added to code in July 2022.
-                              # Disabled on 2022.08.02 because accuracy and f1 score not correctly output.
-
     # ##### Setup training/validation dataset
     train_val_data = df.dropna(subset=cols)
     out_stats['num_samples_train_total'] = int(len(train_val_data))
@@ -136,47 +149,65 @@ def fit(datafile=None,
     y = train_val_data['type']
     y = y.astype('int')
 
-    if use_gridsearchcv:
-        X_train = X_test = X
-        y_train = y_test = y
-    else:
-        strat = train_val_data[['type']]
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=strat)
-
-        out_stats['num_samples_train_irr'] = int(len(y_train[y_train == 0]))
-        out_stats['num_samples_train_rain'] = int(len(y_train[y_train==1]))
-
-        out_stats['num_samples_test_irr'] = int((y_test == 0).sum())
-        out_stats['num_samples_test_rain'] = int((y_test == 1).sum())
+    # grouped by location (and year), a location is never in both train and test
+    groups = crossval.groupKeys(X, block_year=cvblockyear)
+    out_stats['split'] = 'loc_idx_year' if cvblockyear else 'loc_idx'
+    train_pos, test_pos = crossval.groupedHoldout(y, groups, test_size=0.2, random_state=42)
+    X_train, X_test = X.iloc[train_pos], X.iloc[test_pos]
+    y_train, y_test = y.iloc[train_pos], y.iloc[test_pos]
+
+    out_stats['num_samples_train_irr'] = int(len(y_train[y_train == 0]))
+    out_stats['num_samples_train_rain'] = int(len(y_train[y_train==1]))
+
+    out_stats['num_samples_test_irr'] = int((y_test == 0).sum())
+    out_stats['num_samples_test_rain'] = int((y_test == 1).sum())
+
+    # ##### Search hyper-parameters and cross-validate on the training split
+    # the fold arrays are cached once and shared by the search and the CV
+    out_stats.pop('cv', None)
+    out_stats.pop('search', None)
+    params = {}
+    if cvfolds or search:
+        folds = crossval.groupedFolds(y_train, groups[train_pos], n_splits=cvfolds or 5, random_state=42)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = crossval.FoldCache(X_train[cols[:num_cols_rf]], y_train, folds, tmpdir)
+
+            if search:
+                out_stats['search'] = hypersearch.search(cache, mode=search, engine=engine, n_jobs=n_jobs)
+                params = out_stats['search']['best_params']
+                print(f"{search} search best = {params}, f1 = {out_stats['search']['best_f1']:.3f}")
+
+            if cvfolds:
+                start = datetime.now()
+                results = crossval.crossValidate(cache, crossval.MODELS[engine](**params), n_jobs=n_jobs)
+                out_stats['cv'] = crossval.summarize(results, wall_time=(datetime.now() - start).total_seconds(),
+                                                     group=out_stats['split'])
+                print(f"CV f1 = {out_stats['cv']['f1_mean']:.3f} +/- {out_stats['cv']['f1_std']:.3f}")
+    out_stats['rf_params'] = params
 
     # ##### Create and train model
-    clf = RandomForestClassifier()
-
-    if use_gridsearchcv:
-        # ##### Cross-Validation and GridSearch
-        param_grid = {
-                     'n_estimators': [10, 50, 100],
-                     'max_depth': [4, 8, None],
-                     'min_samples_split': [2, 4, 8],
-                     'min_samples_leaf': [1, 2, 4]
-                 }
-        classifier = GridSearchCV(clf, param_grid, scoring='f1', n_jobs=-1, cv=10) # uses Stratified k-fold
-
+    start = time.time()
+    if engine == 'hgb':
+        # binned gradient boosting, stops adding trees when the loss on a
+        # grouped validation split (10% of the training locations) stops improving
+        fit_pos, val_pos = crossval.groupedHoldout(y_train, groups[train_pos], test_size=0.1, random_state=42)
+        X_fit = X_train[cols[:num_cols_rf]]
+        classifier = HistGradientBoostingClassifier(early_stopping=True, random_state=42, **params)
+        classifier.fit(X_fit.iloc[fit_pos], y_train.iloc[fit_pos],
+                       X_val=X_fit.iloc[val_pos], y_val=y_train.iloc[val_pos])
+        out_stats['hgb_n_iter'] = int(classifier.n_iter_)
     else:
-        classifier = clf
-
-    classifier.fit(X_train[cols[:num_cols_rf]], y_train)
+        classifier = RandomForestClassifier(n_jobs=n_jobs, **params)
+        classifier.fit(X_train[cols[:num_cols_rf]], y_train)
+    out_stats['train_seconds'] = round(time.time() - start, 3)
 
     # ##### Score model
     X_test_sub = X_test[cols[:num_cols_rf]]
     y_pred = classifier.predict(X_test_sub)
 
-    if use_gridsearchcv:
-        out_stats['rf_f1'] = classifier.best_score_
-    else:
-        out_stats['rf_accuracy'] = float(classifier.score(X_test_sub, y_test))
-        f1_rf = f1_score(y_test, y_pred, pos_label=1)
-        out_stats['rf_f1'] = float(f1_rf)
+    out_stats['rf_accuracy'] = float(classifier.score(X_test_sub, y_test))
+    f1_rf = f1_score(y_test, y_pred, pos_label=1)
+    out_stats['rf_f1'] = float(f1_rf)
 
     # ## Create plots
 
@@ -246,8 +277,18 @@ def fit(datafile=None,
 
 
     # ## Save trained model
+    # model_rf.pkl for every engine, downstream steps only call predict
     if save_model:
         joblib.dump(classifier, path + "model_rf.pkl", compress=3)
+        out_stats['model_bytes'] = os.path.getsize(path + "model_rf.pkl")
+        if engine == 'rf':
+            # flat arrays for fast, memory-mapped scoring (see compiledforest)
+            forest = compiledforest.compileForest(classifier)
+            compiledforest.saveForest(forest, path + "model_rf_forest")
+    else:
+        buffer = io.BytesIO()
+        joblib.dump(classifier, buffer, compress=3)
+        out_stats['model_bytes'] = buffer.tell()
 
 
     # ## Save summary statistics
@@ -264,27 +305,43 @@ def fit(datafile=None,
     if save_model:
         bestpath = '/'.join(path.split('/')[:-2]) + '/best/'
         statsfilename = bestpath + 'summary_stats.json'
-        if not os.path.exists(bestpath):
-            os.mkdir(bestpath)
-            save_as_best = True
-
-        elif os.path.exists(statsfilename):
-            with open(statsfilename, 'r', encoding='utf-8') as f:
-                priorbest = json.load(f)
+        os.makedirs(bestpath, exist_ok=True)
 
-            if out_stats['rf_f1'] > priorbest['rf_f1']:
+        # compare and promote under a lock, parallel sweeps may finish together
+        with utils.FileLock(bestpath + '.lock'):
+            if not os.path.exists(statsfilename):
                 save_as_best = True
 
-        if save_as_best:
-            # save summary stats
-            with open(statsfilename, 'w', encoding='utf-8') as f:
-                json.dump(out_stats, f, ensure_ascii=False, indent=4)
+            else:
+                with open(statsfilename, 'r', encoding='utf-8') as f:
+                    priorbest = json.load(f)
+
+                if crossval.isBetter(out_stats, priorbest):
+                    save_as_best = True
 
-            joblib.dump(classifier, bestpath + "model_rf.pkl", compress=3)
+            if save_as_best:
+                # model first, the summary stats mark the promotion as complete
+                utils.atomicWrite(bestpath + "model_rf.pkl",
+                                  lambda tmpname: joblib.dump(classifier, tmpname, compress=3))
+                if engine == 'rf':
+                    compiledforest.saveForest(forest, bestpath + "model_rf_forest")
+                elif os.path.exists(bestpath + "model_rf_forest"):
+                    # compiled forest of the previous best, would shadow model_rf.pkl
+                    shutil.rmtree(bestpath + "model_rf_forest")
+
+                def writeStats(tmpname):
+                    with open(tmpname, 'w', encoding='utf-8') as f:
+                        json.dump(out_stats, f, ensure_ascii=False, indent=4)
+                utils.atomicWrite(statsfilename, writeStats)
 
     plt.close('all')
 
 
+def fitShared(manifest, **kwargs):
+    # fit on a frame saved by utils.shareFrame, used by ET_Gen_All_Models --workers
+    return fit(df=utils.loadSharedFrame(manifest), **kwargs)
+
+
 def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument('--datafile', required=True, help='Filename of ET data to process')
@@ -294,6 +351,10 @@ def parse_opt():
     parser.add_argument('--inpath', required=False, default='../runs/', help='Path for input files')
     parser.add_argument('--outpath', required=False, default='../runs/', help='Path for output files')
     parser.add_argument('--nosavemodel', action='store_true', help='Disable saving model')
+    parser.add_argument('--cvfolds', type=int, required=False, default=5, help='Grouped cross-validation folds (0 disables)')
+    parser.add_argument('--engine', required=False, default='rf', choices=sorted(crossval.MODELS), help='Classifier to train (rf: random forest, hgb: histogram gradient boosting)')
+    parser.add_argument('--search', required=False, default=None, choices=hypersearch.MODES, help='Hyper-parameter search mode')
+    parser.add_argument('--cvblockyear', action='store_true', help='Group cross-validation folds by location and year')
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+# Array-backed random forest for fast local inference.
+#
+# compileForest flattens a trained scikit-learn forest into contiguous arrays
+# (all trees concatenated, child indices global):
+#     nodes.npy   structured (feature, threshold, left, right), left == -1 at leaves
+#     value.npy   class probabilities of every node, (n_nodes, n_classes)
+#     roots.npy   first node of every tree
+#     forest.json classes, feature names, number of features and max depth
+# saveForest writes them uncompressed to a folder so loadForest can
+# memory-map them: loading is instant and worker processes share the pages
+# instead of unpickling their own copy of the estimator.
+#
+# CompiledForest.predict / predict_proba walk all trees of a batch of rows at
+# once, one vectorized step per tree level, and agree with the scikit-learn
+# estimator (features are compared as float32, like sklearn's trees).
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+NODE_DTYPE = np.dtype([('feature', np.int32), ('threshold', np.float64),
+                       ('left', np.int32), ('right', np.int32)])
+
+def compileForest(model):
+    # model: fitted RandomForestClassifier (or a search wrapping one)
+    model = getattr(model, 'best_estimator_', model)
+    estimators = model.estimators_
+
+    nodes, values, roots = [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        n = tree.node_count
+        tree_nodes = np.empty(n, dtype=NODE_DTYPE)
+        leaf = tree.children_left < 0
+        tree_nodes['feature'] = np.where(leaf, -1, tree.feature)
+        tree_nodes['threshold'] = tree.threshold
+        tree_nodes['left'] = np.where(leaf, -1, tree.children_left + offset)
+        tree_nodes['right'] = np.where(leaf, -1, tree.children_right + offset)
+        nodes.append(tree_nodes)
+
+        # counts or fractions depending on the sklearn version, normalized per node
+        value = tree.value[:, 0, :].astype(np.float64)
+        values.append(value / value.sum(axis=1, keepdims=True))
+
+        roots.append(offset)
+        offset += n
+        max_depth = max(max_depth, int(tree.max_depth))
+
+    feature_names = getattr(model, 'feature_names_in_', None)
+    return CompiledForest(
+        nodes=np.concatenate(nodes),
+        value=np.concatenate(values),
+        roots=np.asarray(roots, dtype=np.int32),
+        meta={
+            'version': FORMAT_VERSION,
+            'classes': np.asarray(model.classes_).tolist(),
+            'feature_names': None if feature_names is None else [str(name) for name in feature_names],
+            'n_features': int(model.n_features_in_),
+            'max_depth': max_depth,
+        },
+    )
+
+class CompiledForest:
+
+    def __init__(self, nodes, value, roots, meta):
+        self.nodes = nodes
+        self.value = value
+        self.roots = roots
+        self.meta = meta
+        self.classes_ = np.asarray(meta['classes'])
+        # field views, memory-mapped too when nodes is
+        self.feature = nodes['feature']
+        self.threshold = nodes['threshold']
+        self.left = nodes['left']
+        self.right = nodes['right']
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def _matrix(self, X):
+        names = self.meta.get('feature_names')
+        if names is not None and hasattr(X, 'columns'):
+            # select by name, extra columns (e.g. loc_idx) are ignored
+            X = X[names]
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.meta['n_features']:
+            raise ValueError(f"Expected {self.meta['n_features']} features, got shape {X.shape}")
+        return X
+
+    def predict_proba(self, X, batch_size=16384):
+        # batch_size bounds the (rows x trees) node index arrays
+        X = self._matrix(X)
+        out = np.empty((len(X), len(self.classes_)))
+        for start in range(0, len(X), batch_size):
+            batch = X[start:start + batch_size]
+            rows = np.arange(len(batch))[:, np.newaxis]
+            node = np.repeat(self.roots[np.newaxis, :], len(batch), axis=0)
+            for _ in range(self.meta['max_depth']):
+                left = self.left[node]
+                internal = left >= 0
+                if not internal.any():
+                    break
+                feature = np.where(internal, self.feature[node], 0)
+                go_left = batch[rows, feature] <= self.threshold[node]
+                node = np.where(internal, np.where(go_left, left, self.right[node]), node)
+            out[start:start + len(batch)] = self.value[node].mean(axis=1)
+        return out
+
+    def predict(self, X, batch_size=16384):
+        return self.classes_.take(np.argmax(self.predict_proba(X, batch_size), axis=1))
+
+def saveForest(forest, dirname):
+    # written to a temporary folder that then replaces dirname, readers never
+    # see a partial forest
+    if not isinstance(forest, CompiledForest):
+        forest = compileForest(forest)
+    parent = os.path.dirname(os.path.normpath(dirname)) or '.'
+    os.makedirs(parent, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=parent)
+    np.save(os.path.join(tmpdir, 'nodes.npy'), np.ascontiguousarray(forest.nodes))
+    np.save(os.path.join(tmpdir, 'value.npy'), np.ascontiguousarray(forest.value))
+    np.save(os.path.join(tmpdir, 'roots.npy'), np.ascontiguousarray(forest.roots))
+    with open(os.path.join(tmpdir, 'forest.json'), 'w', encoding='utf-8') as f:
+        json.dump(forest.meta, f, indent=4)
+
+    if os.path.exists(dirname):
+        old = tempfile.mkdtemp(dir=parent)
+        os.replace(dirname, os.path.join(old, 'forest'))
+        os.replace(tmpdir, dirname)
+        shutil.rmtree(old)
+    else:
+        os.replace(tmpdir, dirname)
+    return dirname
+
+def loadForest(dirname, mmap_mode='r'):
+    with open(os.path.join(dirname, 'forest.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported forest format {meta.get('version')} in {dirname}")
+    load = lambda name: np.load(os.path.join(dirname, name), mmap_mode=mmap_mode)
+    return CompiledForest(load('nodes.npy'), load('value.npy'), load('roots.npy'), meta)
@@ -0,0 +1,142 @@
+# Grouped, stratified cross-validation for ET_Train_RF.
+#
+# Samples of one location (loc_idx) are a series of dates with nearly the
+# same features, so a row-wise split puts near duplicates in train and test
+# and inflates the scores. Folds here keep every group on one side:
+#     groups = loc_idx                  (default)
+#     groups = loc_idx + year           (block_year, one block per location and year)
+# and are stratified on the label with StratifiedGroupKFold.
+#
+# FoldCache writes the train and test arrays of every fold once as .npy and
+# the workers memory-map them, so folds running in parallel (joblib) share
+# one copy of the data instead of pickling it per fit, and every candidate of
+# a hyper-parameter search (see hypersearch) reuses the same files. The train
+# rows of a fold are stored in a fixed random order: the first n rows are a
+# random subsample, read as one contiguous slice when a fit uses fewer rows.
+# Every fold reports its metrics and fit / predict timings; summarize adds the
+# mean and std used to select the best model.
+
+import os
+import time
+from functools import partial
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedGroupKFold
+
+def groupKeys(df, block_year=False):
+    keys = df['loc_idx'].astype(str)
+    if block_year:
+        keys = keys + '_' + df['yyyy'].astype(str)
+    return keys.to_numpy()
+
+def groupedFolds(y, groups, n_splits=5, random_state=42):
+    # list of (train positions, test positions), n_splits is capped by the number of groups
+    y = np.asarray(y)
+    n_splits = min(n_splits, len(np.unique(groups)))
+    if n_splits < 2:
+        raise ValueError(f'Need at least 2 groups for cross-validation, got {len(np.unique(groups))}')
+    cv = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    return [(train.astype(np.int64), test.astype(np.int64))
+            for train, test in cv.split(np.zeros(len(y)), y, groups)]
+
+def groupedHoldout(y, groups, test_size=0.2, random_state=42):
+    # one fold of the grouped, stratified k-fold as the test set
+    n_splits = max(2, int(round(1 / test_size)))
+    return groupedFolds(y, groups, n_splits=n_splits, random_state=random_state)[0]
+
+def defaultModel(random_state=42, **params):
+    # single threaded, the parallelism is across folds
+    return partial(RandomForestClassifier, n_jobs=1, random_state=random_state, **params)
+
+def hgbModel(random_state=42, **params):
+    # inside a fold, early stopping holds out validation_fraction of the fold's training rows
+    params = dict({'early_stopping': True}, **params)
+    return partial(HistGradientBoostingClassifier, random_state=random_state, **params)
+
+# model factories by ET_Train_RF --engine
+MODELS = {
+    'rf': defaultModel,
+    'hgb': hgbModel,
+}
+
+class FoldCache:
+
+    def __init__(self, X, y, folds, dirname, random_state=42):
+        # X: feature matrix (rows aligned with the fold positions), y: 0/1 labels
+        X = np.asarray(X, dtype=np.float32)
+        y = np.asarray(y, dtype=np.int64)
+        rng = np.random.default_rng(random_state)
+        self.files = []
+        for fold, (train, test) in enumerate(folds):
+            order = rng.permutation(train)
+            files = {name: os.path.join(dirname, f'fold{fold}_{name}.npy')
+                     for name in ('X_train', 'y_train', 'X_test', 'y_test')}
+            np.save(files['X_train'], np.ascontiguousarray(X[order]))
+            np.save(files['y_train'], y[order])
+            np.save(files['X_test'], np.ascontiguousarray(X[test]))
+            np.save(files['y_test'], y[test])
+            self.files.append(files)
+        self.n_train = [len(train) for train, _ in folds]
+
+    def __len__(self):
+        return len(self.files)
+
+def scoreFold(files, make_model, fold, n_train=None):
+    # n_train: fit on the first n_train (shuffled) training rows only
+    load = lambda name: np.load(files[name], mmap_mode='r')
+    X_train, y_train = load('X_train')[:n_train], load('y_train')[:n_train]
+    X_test, y_test = load('X_test'), load('y_test')
+
+    start = time.time()
+    model = make_model().fit(X_train, y_train)
+    fit_seconds = time.time() - start
+
+    start = time.time()
+    y_pred = model.predict(X_test)
+    predict_seconds = time.time() - start
+
+    return {
+        'fold': fold,
+        'n_train': int(len(y_train)),
+        'n_test': int(len(y_test)),
+        'n_test_pos': int((y_test == 1).sum()),
+        'accuracy': float(accuracy_score(y_test, y_pred)),
+        'f1': float(f1_score(y_test, y_pred, pos_label=1, zero_division=0)),
+        'fit_seconds': round(fit_seconds, 3),
+        'predict_seconds': round(predict_seconds, 3),
+    }
+
+def workers(n_jobs, n_tasks):
+    # joblib n_jobs, None runs sequentially, never more workers than tasks
+    n_jobs = n_jobs or 1
+    return min(n_jobs, n_tasks) if n_jobs > 0 else n_jobs
+
+def crossValidate(cache, make_model=None, n_jobs=None):
+    # cache: FoldCache, make_model: picklable callable returning an unfitted estimator
+    make_model = make_model or defaultModel()
+    return Parallel(n_jobs=workers(n_jobs, len(cache)))(
+        delayed(scoreFold)(files, make_model, fold) for fold, files in enumerate(cache.files))
+
+def summarize(results, wall_time=None, **info):
+    # stats block for summary_stats.json
+    summary = dict(info, n_splits=len(results), folds=results)
+    for metric in ('f1', 'accuracy', 'fit_seconds'):
+        values = np.array([result[metric] for result in results], dtype=np.float64)
+        summary[metric + '_mean'] = float(values.mean())
+        summary[metric + '_std'] = float(values.std())
+    if wall_time is not None:
+        summary['wall_time'] = round(wall_time, 3)
+    return summary
+
+def isBetter(stats, prior):
+    # promotion rule for best/: cross-validated F1 when both runs have it,
+    # the grouped holdout F1 otherwise
+    if 'split' not in prior:
+        # scored on the old row-wise split, inflated and not comparable
+        return True
+    if 'cv' in stats and 'cv' in prior:
+        return stats['cv']['f1_mean'] > prior['cv']['f1_mean']
+    return stats['rf_f1'] > prior['rf_f1']
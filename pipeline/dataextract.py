@@ -1,11 +1,17 @@
 import ee
+import urllib.request
 from tqdm import tqdm
 from datetime import datetime, timedelta
 
-from etbrasil.geesebal import TimeSeries
+from etbrasil.geesebal import TimeSeries, SceneBatch, Image
 from pipeline import cropmasks as msk
 
-def exportETdata(etFC, lbl, loc, folder='irrigation'):
+def runScheduler(scheduler):
+    # starts the queued exports, skipping those completed in a previous run
+    if scheduler is not None:
+        print('Export task states =', scheduler.run())
+
+def exportETdata(etFC, lbl, loc, folder='irrigation', scheduler=None):
     #filename = ee.String('et_TS_')
     #filename = filename.cat(ee.String(lbl))
     #filename = filename.cat(ee.String('_'))
@@ -13,6 +19,12 @@ def exportETdata(etFC, lbl, loc, folder='irrigation'):
     filename = str(loc)
     #filename = filename.getInfo()
 
+    # with an exportscheduler.ExportScheduler the export is only queued,
+    # it starts when the scheduler runs
+    if scheduler is not None:
+        scheduler.add(filename, etFC)
+        return None
+
     task = ee.batch.Export.table.toDrive(
       collection = etFC,
       description = filename,
@@ -28,6 +40,7 @@ def extractData(aoi, aoi_label,
                 buffer_range=50,
                 calc_ET_region=False,
                 scale=30,
+                scheduler=None,
     ):
 
     # buffer_range is in meters, max 7000 for GEE limits.
@@ -78,11 +91,66 @@ def extractData(aoi, aoi_label,
 
             exportETdata(etFC=sebalTS.ETandMeteo,
                          lbl=aoi_label,
-                         loc=str(idx)+'_'+str(start_yr+yr_inc))
+                         loc=str(idx)+'_'+str(start_yr+yr_inc),
+                         scheduler=scheduler)
             out.append(sebalTS.ETandMeteo)
             cnt+=1
 
     print('Number of tasks launched =', cnt)
+    runScheduler(scheduler)
+    return out
+
+def extractBulkData(aoi, aoi_label,
+                start_yr=2015, start_mo=6, start_dy=1,
+                end_yr=2021, end_mo=8, end_dy=31,
+                max_cloud_cover=30,
+                buffer_range=50,
+                calc_ET_region=False,
+                scale=30,
+                batch_size=500,
+                scheduler=None,
+    ):
+
+    # same output as extractData, but SEBAL runs once per scene
+    # (WRS path/row + date) instead of once per location and scene:
+    # every batch of batch_size locations becomes one SceneBatch and is
+    # exported as one table, with the same per-location properties
+
+    # buffer_range is in meters, see extractData
+    out = []
+    max_points = 10000 # set arbitrarily high to capture all values
+    num_sample_years = end_yr - start_yr
+
+    locs_list = aoi.toList(max_points)
+    num_locations = locs_list.size().getInfo()
+    print('Number of locations to extract =', num_locations)
+
+    def bufferLocation(f):
+        f = ee.Feature(f)
+        return ee.Feature(f.geometry().buffer(buffer_range), {'loc_type': f.get('POINT_TYPE')})
+
+    cnt = 0
+    for yr_inc in tqdm(range(num_sample_years)):
+        for batch_start in tqdm(range(0, num_locations, batch_size), leave=False):
+            locations = ee.FeatureCollection(locs_list.slice(batch_start, batch_start + batch_size)) \
+                            .map(bufferLocation)
+
+            sebalBatch = SceneBatch(start_yr+yr_inc, start_mo, start_dy,
+                                    start_yr+yr_inc, end_mo, end_dy,
+                                    max_cloud_cover, locations,
+                                    calcRegionalET=calc_ET_region,
+                                    scale=scale
+                                 )
+
+            exportETdata(etFC=sebalBatch.ETandMeteo,
+                         lbl=aoi_label,
+                         loc='batch'+str(batch_start // batch_size)+'_'+str(start_yr+yr_inc),
+                         scheduler=scheduler)
+            out.append(sebalBatch.ETandMeteo)
+            cnt+=1
+
+    print('Number of tasks launched =', cnt)
+    runScheduler(scheduler)
     return out
 
 def extractMonthlyData(aoi, aoi_label,
@@ -90,7 +158,8 @@ def extractMonthlyData(aoi, aoi_label,
                         buffer_range=50,
                         calc_ET_region=False,
                         restart_index=-1,
-                        scale=30
+                        scale=30,
+                        scheduler=None,
                         ):
 
     # ======================
@@ -161,13 +230,15 @@ def extractMonthlyData(aoi, aoi_label,
         export_task = exportETdata(
                 etFC=sebalTS.ETandMeteo,
                 lbl=aoi_label,
-                loc=idx
+                loc=idx,
+                scheduler=scheduler
             )
 
         #out.append(export_task)
         cnt+=1
 
     print('Number of tasks launched =', cnt)
+    runScheduler(scheduler)
     return out
 
 def buildImageCollection(aoi, start, end, max_cloud=10, ls5=False, ls7=False, ls_all=False):
@@ -192,7 +263,39 @@ def buildImageCollection(aoi, start, end, max_cloud=10, ls5=False, ls7=False, ls
         return imgcol8.merge(imgcol5)
     return imgcol8
 
-def exportRaster(classified_image, type='unknown', region=None, scale=30):
+def predictImage(aoi, start, end, classifier, et_var='ET_24h_R', cloud_max=30, applyCropMask=False):
+    # mean of the class predictions of every ET image in the window, i.e. the
+    # probability of the pixel being irrigated (same as the ET_Infer notebook)
+    etcol = Image(window_start=start, window_end=end,
+                  aoi=aoi, cloud_max=cloud_max, et_var=et_var) \
+                .ETandMeteo
+
+    if applyCropMask:
+        etcol = etcol.map(lambda x: x.updateMask(msk.createGFSADmask(aoi)))
+
+    return (
+        etcol
+            .map(lambda x: x.classify(classifier))
+            .mean()
+            .clip(aoi)
+            .set('custom:date', f'{start}_{end}')
+    )
+
+def exportRaster(classified_image, type='unknown', region=None, scale=30,
+                 filename=None, crs=None, crs_transform=None, dimensions=None, timeout=300):
+    # with a filename the image is downloaded as a local GeoTIFF (no GEE task),
+    # crs_transform and dimensions pin the pixel grid so tiles line up
+    if filename is not None:
+        params = {'format': 'GEO_TIFF', 'region': region}
+        if crs_transform is not None:
+            params.update({'crs': crs or 'EPSG:4326', 'crs_transform': crs_transform, 'dimensions': dimensions})
+        else:
+            params.update({'crs': crs, 'scale': scale})
+        url = classified_image.getDownloadURL({k: v for k, v in params.items() if v is not None})
+        with urllib.request.urlopen(url, timeout=timeout) as response, open(filename, 'wb') as f:
+            f.write(response.read())
+        return filename
+
     snapshot_path_prefix = 'projects/eda-bjonesneu-proto/assets/irrigation/'
     date = classified_image.get('custom:date').getInfo()
     asset_description = f'{type}_{date}'
@@ -203,7 +306,7 @@ def exportRaster(classified_image, type='unknown', region=None, scale=30):
         description=asset_description,
         assetId=asset_name,
         scale=scale,
-        region=aoi,
+        region=region,
         maxPixels=1e13,
     )
     task.start()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Converts the locally trained forest (best/model_rf.pkl) into the decision
+# tree text format read by ee.Classifier.decisionTreeEnsemble, so GEE
+# inference uses the same model as the local pipeline instead of retraining a
+# smileRandomForest from features.pkl (see ET_Infer).
+#
+# Every tree is written in the rpart-like format of ee.Classifier.decisionTree:
+#     1) root 9999 9999 9999
+#       2) NDVI<=0.41 9999 9999 9999
+#         4) ET_24h<=2.5 9999 9999 0.12 *
+#         5) ET_24h>2.5 9999 9999 0.87 *
+#       3) NDVI>0.41 9999 9999 0.95 *
+# children of node n are 2n (<=) and 2n+1 (>), leaves end with '*'. The leaf
+# value is the probability of the positive class (classes_[1]); with the
+# ensemble in REGRESSION mode GEE averages them like predict_proba, and
+# probability > 0.5 reproduces the local predict().
+#
+# Large forests exceed the size of a single GEE request, so the trees are
+# packed into chunks of at most max_bytes. classifyImage combines the chunks
+# into one probability band weighted by their number of trees.
+#
+# Usage:
+#
+#     python eeforest.py --model ../runs/<name>/best/model_rf.pkl --outpath ../runs/<name>/best/ee_forest/
+
+import argparse
+import json
+import os
+import re
+
+import joblib
+import numpy as np
+
+import compiledforest
+
+# comfortably under the ~10MB payload limit of a GEE request
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+PLACEHOLDER = '9999'
+
+def formatNumber(value):
+    # shortest repr that parses back to the same double
+    return repr(float(value))
+
+def treeString(forest, tree, feature_names):
+    # rpart-like text of one tree of a compiledforest.CompiledForest
+    lines = [f'1) root {PLACEHOLDER} {PLACEHOLDER} {PLACEHOLDER}']
+
+    def leafValue(node):
+        return formatNumber(forest.value[node][1])
+
+    def visit(node, node_id, depth):
+        left, right = int(forest.left[node]), int(forest.right[node])
+        name = feature_names[int(forest.feature[node])]
+        threshold = formatNumber(forest.threshold[node])
+        for child, child_id, op in ((left, 2 * node_id, '<='), (right, 2 * node_id + 1, '>')):
+            indent = '  ' * depth
+            if forest.left[child] < 0:
+                lines.append(f'{indent}{child_id}) {name}{op}{threshold} {PLACEHOLDER} {PLACEHOLDER} {leafValue(child)} *')
+            else:
+                lines.append(f'{indent}{child_id}) {name}{op}{threshold} {PLACEHOLDER} {PLACEHOLDER} {PLACEHOLDER}')
+                visit(child, child_id, depth + 1)
+
+    root = int(forest.roots[tree])
+    if forest.left[root] < 0:
+        # single leaf tree, a constant split keeps the format valid
+        value = leafValue(root)
+        name = feature_names[0]
+        lines.append(f'  2) {name}<=inf {PLACEHOLDER} {PLACEHOLDER} {value} *')
+        lines.append(f'  3) {name}>inf {PLACEHOLDER} {PLACEHOLDER} {value} *')
+    else:
+        visit(root, 1, 1)
+    return '\n'.join(lines) + '\n'
+
+def forestStrings(model, feature_names=None):
+    # model: fitted RandomForestClassifier or compiledforest.CompiledForest
+    # feature_names: band names on GEE, defaults to the training column names
+    forest = model if isinstance(model, compiledforest.CompiledForest) else compiledforest.compileForest(model)
+    if len(forest.classes_) != 2:
+        raise ValueError(f'Only binary forests are supported, got classes {forest.classes_.tolist()}')
+    if feature_names is None:
+        feature_names = forest.meta.get('feature_names')
+    if feature_names is None or len(feature_names) != forest.meta['n_features']:
+        raise ValueError('feature_names must name every feature of the forest')
+    trees = [treeString(forest, tree, list(feature_names)) for tree in range(forest.n_trees)]
+    return trees, forest
+
+def chunkTrees(trees, max_bytes=DEFAULT_MAX_BYTES):
+    # greedy packing in tree order, every chunk holds at most max_bytes of tree text
+    chunks, chunk, size = [], [], 0
+    for i, tree in enumerate(trees):
+        nbytes = len(tree.encode('utf-8'))
+        if nbytes > max_bytes:
+            raise ValueError(f'Tree {i} is {nbytes} bytes, over max_bytes={max_bytes}; train with a smaller max_depth')
+        if chunk and size + nbytes > max_bytes:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(tree)
+        size += nbytes
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def exportForest(model, outpath, feature_names=None, max_bytes=DEFAULT_MAX_BYTES):
+    # writes chunk_NNN.txt (trees separated by blank lines) and manifest.json
+    trees, forest = forestStrings(model, feature_names)
+    chunks = chunkTrees(trees, max_bytes)
+    os.makedirs(outpath, exist_ok=True)
+
+    manifest = {
+        'classes': forest.classes_.tolist(),
+        'positive_class': forest.classes_.tolist()[1],
+        'feature_names': list(feature_names or forest.meta['feature_names']),
+        'n_trees': len(trees),
+        'max_bytes': max_bytes,
+        'chunks': [],
+    }
+    for i, chunk in enumerate(chunks):
+        filename = f'chunk_{i:03d}.txt'
+        with open(os.path.join(outpath, filename), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(chunk))
+        manifest['chunks'].append({'file': filename, 'n_trees': len(chunk),
+                                   'bytes': sum(len(tree.encode('utf-8')) for tree in chunk)})
+
+    with open(os.path.join(outpath, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    return manifest
+
+def loadForestChunks(outpath):
+    # manifest and the list of tree strings of every chunk
+    with open(os.path.join(outpath, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    chunks = []
+    for entry in manifest['chunks']:
+        with open(os.path.join(outpath, entry['file']), 'r', encoding='utf-8') as f:
+            chunks.append([tree + '\n' for tree in f.read().strip('\n').split('\n\n')])
+    return manifest, chunks
+
+def classifyImage(image, chunks, name='probability'):
+    # probability of the positive class, mean over all trees of all chunks
+    import ee
+    n_trees = sum(len(chunk) for chunk in chunks)
+    bands = []
+    for chunk in chunks:
+        classifier = ee.Classifier.decisionTreeEnsemble(chunk).setOutputMode('REGRESSION')
+        bands.append(image.classify(classifier).multiply(len(chunk) / n_trees))
+    return ee.ImageCollection(bands).sum().rename(name)
+
+# ## Local parser, mirrors how GEE reads the format
+
+LINE = re.compile(r'^\s*(\d+)\) (?:root|(\S+?)(<=|>)(\S+)) (\S+) (\S+) (\S+)( \*)?$')
+
+def parseTree(text):
+    # {node id: (feature, op, threshold, value, is_leaf)}
+    nodes = {}
+    for line in text.strip('\n').split('\n'):
+        match = LINE.match(line)
+        if match is None:
+            raise ValueError(f'Cannot parse tree line: {line!r}')
+        node_id, feature, op, threshold, _, _, value, leaf = match.groups()
+        nodes[int(node_id)] = (feature, op, None if threshold is None else float(threshold),
+                               None if leaf is None else float(value), leaf is not None)
+    return nodes
+
+def predictTree(nodes, row):
+    # row: {feature name: value}
+    node_id = 1
+    while not nodes[node_id][4]:
+        feature, _, threshold, _, _ = nodes[2 * node_id]
+        node_id = 2 * node_id if row[feature] <= threshold else 2 * node_id + 1
+    return nodes[node_id][3]
+
+def predictChunks(chunks, rows):
+    # mean leaf value over all trees, i.e. the REGRESSION output of the ensemble
+    trees = [parseTree(tree) for chunk in chunks for tree in chunk]
+    return np.array([np.mean([predictTree(nodes, row) for nodes in trees]) for row in rows])
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='Trained model (model_rf.pkl or a model_rf_forest folder)')
+    parser.add_argument('--outpath', required=True, help='Folder for the tree chunks and manifest')
+    parser.add_argument('--max_bytes', type=int, required=False, default=DEFAULT_MAX_BYTES, help='Maximum bytes of tree text per chunk')
+    parser.add_argument('--feature_names', nargs='+', required=False, default=None, help='GEE band names, in training column order')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    if os.path.isdir(opt.model):
+        model = compiledforest.loadForest(opt.model)
+    else:
+        model = joblib.load(opt.model)
+    manifest = exportForest(model, opt.outpath, feature_names=opt.feature_names, max_bytes=opt.max_bytes)
+    print(f"{manifest['n_trees']} trees in {len(manifest['chunks'])} chunks written to {opt.outpath}")
@@ -0,0 +1,176 @@
+# Resumable scheduler for Earth Engine export tasks.
+#
+# Every export is registered under a key (e.g. the sample index) in a SQLite
+# manifest with its task id, state and number of attempts. run() keeps at most
+# max_running tasks in flight, polls their status in one batched call, retries
+# failures with exponential backoff and returns when every known export is
+# completed or out of retries. Re-running the same extraction after a crash
+# skips the exports the manifest has as completed and reattaches to the ones
+# still running, replacing the manual restart_index.
+#
+# The task service is a pluggable backend with two methods:
+#     start(key, payload) -> task id
+#     poll(task_ids)      -> {task id: state}, state one of PENDING, RUNNING, COMPLETED, FAILED
+# EETableBackend exports tables to Google Drive, tests plug in a local fake.
+
+import logging
+import sqlite3
+import time
+
+import ee
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+
+# manifest states besides the task states above
+QUEUED = 'QUEUED'   # waiting to be started (again)
+GAVE_UP = 'GAVE_UP' # failed max_retries times
+
+class EETableBackend:
+
+    # ee.batch.Task states -> scheduler states
+    states = {
+        'UNSUBMITTED': PENDING,
+        'READY': PENDING,
+        'RUNNING': RUNNING,
+        'COMPLETED': COMPLETED,
+        'FAILED': FAILED,
+        'CANCEL_REQUESTED': FAILED,
+        'CANCELLED': FAILED,
+        'UNKNOWN': FAILED,
+    }
+
+    def __init__(self, folder='irrigation'):
+        self.folder = folder
+
+    def start(self, key, payload):
+        task = ee.batch.Export.table.toDrive(
+          collection = payload,
+          description = str(key),
+          folder = self.folder,
+        )
+        task.start()
+        return task.id
+
+    def poll(self, task_ids):
+        # one request for all tasks
+        return {status['id']: self.states.get(status['state'], FAILED)
+                    for status in ee.data.getTaskStatus(list(task_ids))}
+
+class ExportScheduler:
+
+    def __init__(self, manifest, backend=None, max_running=10, poll_interval=30,
+                 max_retries=3, backoff=60, retry_gave_up=False,
+                 sleep=time.sleep, clock=time.time):
+        # manifest: path of the SQLite file, created if missing
+        # backoff: seconds before the first retry, doubled on every further failure
+        # retry_gave_up: give exports that ran out of retries in a previous run a new set of attempts
+        self.backend = backend if backend is not None else EETableBackend()
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_gave_up = retry_gave_up
+        self.sleep = sleep
+        self.clock = clock
+        self.payloads = {}
+
+        self.db = sqlite3.connect(manifest)
+        with self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS tasks (
+                                   key TEXT PRIMARY KEY,
+                                   task_id TEXT,
+                                   state TEXT,
+                                   attempts INTEGER,
+                                   not_before REAL,
+                                   error TEXT,
+                                   updated REAL)''')
+
+    def add(self, key, payload):
+        # registers an export, returns False when the manifest already has it completed
+        key = str(key)
+        row = self.db.execute('SELECT state FROM tasks WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._update(key, state=QUEUED, attempts=0, not_before=0, insert=True)
+        elif row[0] == COMPLETED:
+            return False
+        elif row[0] == GAVE_UP and self.retry_gave_up:
+            self._update(key, state=QUEUED, attempts=0, not_before=0)
+        self.payloads[key] = payload
+        return True
+
+    def _update(self, key, insert=False, **values):
+        values['updated'] = self.clock()
+        with self.db:
+            if insert:
+                values['key'] = key
+                names = ', '.join(values)
+                self.db.execute(f'INSERT INTO tasks ({names}) VALUES ({", ".join("?" * len(values))})',
+                                list(values.values()))
+            else:
+                names = ', '.join(name + ' = ?' for name in values)
+                self.db.execute(f'UPDATE tasks SET {names} WHERE key = ?', list(values.values()) + [key])
+
+    def _rows(self, *states):
+        return self.db.execute(f'SELECT key, task_id, attempts, not_before FROM tasks WHERE state IN ({", ".join("?" * len(states))}) ORDER BY rowid',
+                               states).fetchall()
+
+    def _failed(self, key, attempts, error):
+        if attempts >= self.max_retries:
+            logging.error(f'export {key} gave up after {attempts} attempts: {error}')
+            self._update(key, state=GAVE_UP, error=error)
+        else:
+            delay = self.backoff * 2 ** (attempts - 1)
+            logging.warning(f'export {key} failed (attempt {attempts}), retrying in {delay}s: {error}')
+            self._update(key, state=QUEUED, not_before=self.clock() + delay, error=error)
+
+    def poll(self):
+        # refreshes the state of every in-flight task with one backend call
+        running = self._rows(PENDING, RUNNING)
+        if not running:
+            return
+        states = self.backend.poll([task_id for key, task_id, attempts, not_before in running])
+        for key, task_id, attempts, not_before in running:
+            state = states.get(task_id, FAILED)
+            if state == FAILED:
+                self._failed(key, attempts, 'task ' + str(task_id) + ' failed')
+            else:
+                self._update(key, state=state)
+
+    def launch(self):
+        # starts queued exports until max_running are in flight
+        free = self.max_running - len(self._rows(PENDING, RUNNING))
+        now = self.clock()
+        for key, task_id, attempts, not_before in self._rows(QUEUED):
+            if free <= 0:
+                break
+            if not_before > now or key not in self.payloads:
+                continue
+            attempts += 1
+            try:
+                task_id = self.backend.start(key, self.payloads[key])
+            except Exception as e:
+                self._update(key, attempts=attempts)
+                self._failed(key, attempts, str(e))
+                continue
+            self._update(key, task_id=task_id, state=PENDING, attempts=attempts)
+            free -= 1
+
+    def counts(self):
+        return dict(self.db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+
+    def run(self):
+        # blocks until all added exports are completed or gave up, returns the state counts
+        while True:
+            self.poll()
+            self.launch()
+            waiting = [key for key, task_id, attempts, not_before in self._rows(QUEUED) if key in self.payloads]
+            if not self._rows(PENDING, RUNNING) and not waiting:
+                break
+            self.sleep(self.poll_interval)
+        return self.counts()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,157 @@
+# Budget-aware hyper-parameter search for ET_Train_RF.
+#
+# Replaces the GridSearchCV block of fit, which trained every combination of
+# PARAM_GRID (81) on every fold with all the training data. The grid depends
+# on the engine (PARAM_GRIDS). Here the budget of a fit is the number of
+# training rows per fold:
+#     halving     successive halving: all candidates start on few rows, after
+#                 every rung only the best 1/eta continue with eta times more
+#                 rows, until the survivors use the whole fold (a single
+#                 survivor goes straight to the whole fold)
+#     hyperband   several successive halving brackets, from many candidates
+#                 on few rows to few candidates on all rows, candidates
+#                 sampled from the grid
+# Candidates are scored with the mean F1 over the grouped folds of a
+# crossval.FoldCache, so the fold arrays are written once and every fit of
+# every candidate memory-maps the same files (the first n shuffled rows of a
+# fold are its subsample). The (candidate, fold) fits of a rung run in
+# parallel with joblib.
+#
+# search() returns the stats block saved under 'search' in
+# summary_stats.json: best parameters, the trace of every evaluation (bracket,
+# rung, rows, F1, seconds) and the total fit time spent on each configuration.
+
+import json
+import math
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.model_selection import ParameterGrid
+
+import crossval
+
+PARAM_GRID = {
+    'n_estimators': [10, 50, 100],
+    'max_depth': [4, 8, None],
+    'min_samples_split': [2, 4, 8],
+    'min_samples_leaf': [1, 2, 4],
+}
+
+HGB_PARAM_GRID = {
+    'learning_rate': [0.05, 0.1, 0.2],
+    'max_leaf_nodes': [15, 31, 63],
+    'min_samples_leaf': [10, 20, 40],
+    'l2_regularization': [0.0, 1.0],
+}
+
+# grids by ET_Train_RF --engine
+PARAM_GRIDS = {
+    'rf': PARAM_GRID,
+    'hgb': HGB_PARAM_GRID,
+}
+
+# smallest subsample a candidate is trained on
+MIN_RESOURCE = 100
+
+MODES = ('halving', 'hyperband')
+
+def paramsKey(params):
+    return json.dumps(params, sort_keys=True)
+
+class Evaluator:
+    # scores candidates on the cached folds and keeps the trace
+
+    def __init__(self, cache, make_model=crossval.defaultModel, n_jobs=None):
+        self.cache = cache
+        self.make_model = make_model
+        self.n_jobs = n_jobs
+        self.trace = []
+        self.seconds = {}
+
+    def __call__(self, candidates, n_train, bracket=0, rung=0):
+        tasks = [(i, fold, files) for i in range(len(candidates)) for fold, files in enumerate(self.cache.files)]
+        results = Parallel(n_jobs=crossval.workers(self.n_jobs, len(tasks)))(
+            delayed(crossval.scoreFold)(files, self.make_model(**candidates[i]), fold, n_train)
+            for i, fold, files in tasks)
+
+        scores = []
+        for i, params in enumerate(candidates):
+            folds = [result for (j, _, _), result in zip(tasks, results) if j == i]
+            f1 = float(np.mean([result['f1'] for result in folds]))
+            seconds = round(sum(result['fit_seconds'] + result['predict_seconds'] for result in folds), 3)
+            key = paramsKey(params)
+            self.seconds[key] = round(self.seconds.get(key, 0) + seconds, 3)
+            self.trace.append({'bracket': bracket, 'rung': rung, 'params': params,
+                               'n_train': int(min(n_train, max(self.cache.n_train))),
+                               'f1_mean': f1, 'seconds': seconds})
+            scores.append(f1)
+        return scores
+
+def successiveHalving(candidates, evaluate, min_resource, max_resource, eta=3, bracket=0):
+    # returns the best candidate and its score on max_resource rows
+    resource = min(min_resource, max_resource)
+    rung = 0
+    while True:
+        scores = evaluate(candidates, resource, bracket=bracket, rung=rung)
+        if resource >= max_resource:
+            break
+        # stable sort, ties keep the grid order
+        ranked = sorted(range(len(candidates)), key=lambda i: -scores[i])
+        candidates = [candidates[i] for i in ranked[:max(1, len(candidates) // eta)]]
+        # a single survivor has nothing left to compete with, fit it once on all rows
+        resource = max_resource if len(candidates) == 1 else min(max_resource, resource * eta)
+        rung += 1
+    best = int(np.argmax(scores))
+    return candidates[best], scores[best]
+
+def hyperband(candidates, evaluate, min_resource, max_resource, eta=3, random_state=42):
+    # brackets from many candidates on min_resource rows to few on max_resource
+    rng = np.random.default_rng(random_state)
+    s_max = max(0, int(math.floor(math.log(max_resource / min_resource, eta) + 1e-9)))
+    best, best_score = None, -np.inf
+    for bracket, s in enumerate(range(s_max, -1, -1)):
+        n = min(len(candidates), int(math.ceil((s_max + 1) / (s + 1) * eta ** s)))
+        sampled = [candidates[i] for i in sorted(rng.choice(len(candidates), size=n, replace=False))]
+        params, score = successiveHalving(sampled, evaluate, max(min_resource, max_resource // eta ** s),
+                                          max_resource, eta=eta, bracket=bracket)
+        if score > best_score:
+            best, best_score = params, score
+    return best, best_score
+
+def search(cache, mode='halving', engine='rf', param_grid=None, eta=3, min_resource=None,
+           n_jobs=None, random_state=42):
+    # cache: crossval.FoldCache of the training split
+    if mode not in MODES:
+        raise ValueError(f'Unknown search mode {mode}, expected one of {MODES}')
+    start = time.time()
+    candidates = list(ParameterGrid(param_grid or PARAM_GRIDS[engine]))
+    max_resource = min(cache.n_train)
+    if min_resource is None:
+        # enough rungs to halve the whole grid down to one candidate
+        rungs = int(math.ceil(math.log(len(candidates), eta))) if len(candidates) > 1 else 0
+        min_resource = max(MIN_RESOURCE, max_resource // eta ** rungs)
+    min_resource = min(min_resource, max_resource)
+
+    evaluate = Evaluator(cache, make_model=crossval.MODELS[engine], n_jobs=n_jobs)
+    if mode == 'halving':
+        best, best_score = successiveHalving(candidates, evaluate, min_resource, max_resource, eta=eta)
+    else:
+        best, best_score = hyperband(candidates, evaluate, min_resource, max_resource,
+                                     eta=eta, random_state=random_state)
+
+    return {
+        'mode': mode,
+        'engine': engine,
+        'eta': eta,
+        'min_resource': int(min_resource),
+        'max_resource': int(max_resource),
+        'n_candidates': len(candidates),
+        'n_evaluations': len(evaluate.trace),
+        'best_params': best,
+        'best_f1': float(best_score),
+        'trace': evaluate.trace,
+        'config_seconds': [{'params': json.loads(key), 'seconds': seconds}
+                           for key, seconds in evaluate.seconds.items()],
+        'wall_time': round(time.time() - start, 3),
+    }
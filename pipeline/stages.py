@@ -0,0 +1,93 @@
+# Stage DAG for the ET pipeline:
+#
+#     load -> transform -> featurize -> filter -> train
+#
+# Every stage output is addressed by the key of its input plus its own
+# parameters, so runs sharing upstream stages (e.g. the 8 combinations of
+# ET_Gen_All_Models) compute them once per datafile and only run the leaves
+# that differ. See ET_Driver.run for the wiring.
+#
+# Outputs are kept in memory for the current datafile only: a new key of the
+# scope stage (load, i.e. another zip) drops them, so a sweep over many
+# datafiles holds the frames of one at a time. Persisted outputs are read
+# back from cachedir when needed again.
+
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+
+# custom libraries
+import utils
+
+# bump when a stage changes its output for the same input
+STAGE_VERSION = 2
+
+class StageCache:
+
+    def __init__(self, cachedir=None, scope='load'):
+        # cachedir: where persistable stage outputs are pickled, None keeps them in memory only
+        # scope: stage whose key starts a new datafile and clears the in-memory outputs
+        self.cachedir = cachedir
+        self.scope = scope
+        self.scope_key = None
+        self.memory = {}
+        self.stats = {'stage_hits': 0, 'stage_misses': 0}
+        self.last_hit = False
+
+    def key(self, stage, parent, **params):
+        blob = json.dumps([STAGE_VERSION, stage, parent, params], sort_keys=True, default=str)
+        return stage + '_' + hashlib.sha256(blob.encode('utf-8')).hexdigest()[:16]
+
+    def run(self, stage, parent, fn, persist=True, **params):
+        # returns (key, output of fn()), computing fn only once per key
+        key = self.key(stage, parent, **params)
+        if stage == self.scope and key != self.scope_key:
+            # another datafile, the outputs of the previous one are released
+            self.memory.clear()
+            self.scope_key = key
+        self.last_hit = True
+        if key in self.memory:
+            self.stats['stage_hits'] += 1
+            return key, self.memory[key]
+
+        filename = None
+        if persist and self.cachedir:
+            filename = os.path.join(self.cachedir, key + '.pkl')
+            if os.path.exists(filename):
+                self.stats['stage_hits'] += 1
+                self.memory[key] = pd.read_pickle(filename)
+                return key, self.memory[key]
+
+        self.last_hit = False
+        self.stats['stage_misses'] += 1
+        value = fn()
+        self.memory[key] = value
+
+        if filename:
+            os.makedirs(self.cachedir, exist_ok=True)
+            utils.atomicWrite(filename, lambda tmpname: pd.to_pickle(value, tmpname))
+
+        return key, value
+
+    def materialize(self, key, frame, filename):
+        # writes a stage output frame to filename (e.g. expNN/features.pkl). With a
+        # cachedir the pickle is written once per key and hardlinked into place
+        if not self.cachedir:
+            utils.atomicWrite(filename, lambda tmpname: frame.to_pickle(tmpname))
+            return filename
+
+        source = os.path.join(self.cachedir, key + '_frame.pkl')
+        if not os.path.exists(source):
+            os.makedirs(self.cachedir, exist_ok=True)
+            utils.atomicWrite(source, lambda tmpname: frame.to_pickle(tmpname))
+        if os.path.exists(filename):
+            os.remove(filename)
+        try:
+            os.link(source, filename)
+        except OSError:
+            # other filesystem or no hardlink support
+            shutil.copyfile(source, filename)
+        return filename
@@ -0,0 +1,240 @@
+# Tiled inference for large areas of interest.
+#
+# Exports of AOIs over ~3,000 ha tend to crash (see ET_Infer), so instead of
+# drawing smaller polygons by hand the AOI is split into a grid of tiles that
+# each hold at most max_pixels pixels. Every tile is predicted and downloaded
+# on its own, at most `workers` at a time, failed tiles are retried with
+# exponential backoff, and the tiles are mosaicked locally into one raster.
+#
+# The tiles share one pixel grid (EPSG:4326, resolution derived from scale),
+# so the mosaic only pastes arrays at their offsets. manifest.json in the
+# output folder records the grid, the state of every tile and the mosaic;
+# re-running with the same folder skips the tiles already downloaded.
+#
+# The tile source is a pluggable backend with four methods:
+#     suffix                         file extension of the tile files
+#     fetch(tile, path)              predicts one tile and writes it to path
+#     read(path)       -> ndarray    (bands, height, width)
+#     write(path, array, transform)  writes the mosaic
+# EETileBackend predicts with dataextract.predictImage and downloads GeoTIFFs
+# through dataextract.exportRaster. LocalTileBackend runs a local predictor on
+# NumPy arrays (tests, offline models).
+
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pipeline.exportscheduler import COMPLETED, FAILED, GAVE_UP, QUEUED
+
+# ~2,700 ha at 30 m, under the size where whole-AOI exports started failing
+DEFAULT_MAX_PIXELS = 30000
+
+# metres per degree of latitude
+DEGREE_METRES = 111320.0
+
+MANIFEST = 'manifest.json'
+
+def tileGrid(bounds, scale=30, max_pixels=DEFAULT_MAX_PIXELS):
+    # bounds: [xmin, ymin, xmax, ymax] in degrees
+    # returns the grid of the whole AOI and its tiles, no tile has more than max_pixels pixels
+    xmin, ymin, xmax, ymax = bounds
+    res_y = scale / DEGREE_METRES
+    res_x = res_y / math.cos(math.radians((ymin + ymax) / 2))
+
+    # snap to the global grid so reruns and neighbouring AOIs line up
+    x0 = math.floor(xmin / res_x) * res_x
+    y0 = math.ceil(ymax / res_y) * res_y
+    width = max(1, math.ceil((xmax - x0) / res_x))
+    height = max(1, math.ceil((y0 - ymin) / res_y))
+
+    side = max(1, int(math.sqrt(max_pixels)))
+    ncols = math.ceil(width / side)
+    nrows = math.ceil(height / side)
+    tile_w = math.ceil(width / ncols)
+    tile_h = math.ceil(height / nrows)
+
+    tiles = []
+    for row in range(nrows):
+        for col in range(ncols):
+            off_x, off_y = col * tile_w, row * tile_h
+            w = min(tile_w, width - off_x)
+            h = min(tile_h, height - off_y)
+            if w <= 0 or h <= 0:
+                continue
+            left, top = x0 + off_x * res_x, y0 - off_y * res_y
+            tiles.append({
+                'key': f'r{row:03d}_c{col:03d}',
+                'offset': [off_y, off_x],
+                'width': w,
+                'height': h,
+                'bounds': [left, top - h * res_y, left + w * res_x, top],
+                'transform': [res_x, 0, left, 0, -res_y, top],
+            })
+
+    grid = {
+        'bounds': list(bounds),
+        'scale': scale,
+        'max_pixels': max_pixels,
+        'width': width,
+        'height': height,
+        'transform': [res_x, 0, x0, 0, -res_y, y0],
+    }
+    return grid, tiles
+
+def aoiBounds(aoi):
+    # [xmin, ymin, xmax, ymax] of an ee.Geometry / Feature / FeatureCollection
+    ring = aoi.geometry().bounds().getInfo()['coordinates'][0]
+    xs = [point[0] for point in ring]
+    ys = [point[1] for point in ring]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+class EETileBackend:
+
+    suffix = '.tif'
+
+    def __init__(self, predict, timeout=300):
+        # predict(region) -> ee.Image, e.g.
+        #   lambda region: dx.predictImage(region, start, end, classifier)
+        self.predict = predict
+        self.timeout = timeout
+
+    def fetch(self, tile, path):
+        import ee
+        from pipeline import dataextract as dx
+        region = ee.Geometry.Rectangle(tile['bounds'], 'EPSG:4326', False)
+        dx.exportRaster(self.predict(region), region=region, filename=path,
+                        crs='EPSG:4326', crs_transform=tile['transform'],
+                        dimensions=f"{tile['width']}x{tile['height']}",
+                        timeout=self.timeout)
+
+    def read(self, path):
+        import rasterio
+        with rasterio.open(path) as src:
+            return src.read().astype(np.float32)
+
+    def write(self, path, array, transform):
+        import rasterio
+        from rasterio.transform import Affine
+        res_x, _, x0, _, res_y, y0 = transform
+        with rasterio.open(path, 'w', driver='GTiff', width=array.shape[2], height=array.shape[1],
+                           count=array.shape[0], dtype=array.dtype, crs='EPSG:4326', nodata=np.nan,
+                           transform=Affine(res_x, 0, x0, 0, res_y, y0), compress='deflate') as dst:
+            dst.write(array)
+
+class LocalTileBackend:
+
+    suffix = '.npy'
+
+    def __init__(self, predict):
+        # predict(tile) -> ndarray of shape (height, width) or (bands, height, width)
+        self.predict = predict
+
+    def fetch(self, tile, path):
+        array = np.asarray(self.predict(tile), dtype=np.float32)
+        if array.ndim == 2:
+            array = array[np.newaxis]
+        if array.shape[1:] != (tile['height'], tile['width']):
+            raise ValueError(f"tile {tile['key']} has shape {array.shape[1:]}, expected {(tile['height'], tile['width'])}")
+        np.save(path, array)
+
+    def read(self, path):
+        return np.load(path)
+
+    def write(self, path, array, transform):
+        np.save(path, array)
+        with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+            json.dump({'transform': transform, 'shape': list(array.shape)}, f)
+
+def loadManifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def saveManifest(out_dir, manifest):
+    # write then rename, a crash never leaves a truncated manifest
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def runTiles(manifest, backend, out_dir, workers=4, max_retries=3, backoff=30, sleep=time.sleep):
+    # fetches every tile not yet completed, at most `workers` at a time
+    lock = threading.Lock()
+
+    def fetchTile(tile):
+        path = os.path.join(out_dir, tile['key'] + backend.suffix)
+        start = time.time()
+        while True:
+            tile['attempts'] += 1
+            try:
+                backend.fetch(tile, path)
+                state, error = COMPLETED, None
+            except Exception as e:
+                state, error = FAILED, repr(e)
+            if state == COMPLETED or tile['attempts'] >= max_retries:
+                break
+            # 30s, 60s, 120s, ... before the next attempt
+            sleep(backoff * 2 ** (tile['attempts'] - 1))
+
+        with lock:
+            tile.update(state=state if state == COMPLETED else GAVE_UP, error=error,
+                        path=os.path.basename(path), seconds=round(time.time() - start, 3))
+            saveManifest(out_dir, manifest)
+        return tile['state']
+
+    pending = [tile for tile in manifest['tiles'] if tile['state'] != COMPLETED]
+    for tile in pending:
+        tile.update(state=QUEUED, attempts=0)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fetchTile, pending))
+
+def mosaicTiles(manifest, backend, out_dir, filename='mosaic'):
+    # pastes the completed tiles into one raster, missing tiles stay NaN
+    mosaic = None
+    for tile in manifest['tiles']:
+        if tile['state'] != COMPLETED:
+            continue
+        array = backend.read(os.path.join(out_dir, tile['path']))
+        if mosaic is None:
+            mosaic = np.full((array.shape[0], manifest['height'], manifest['width']), np.nan, dtype=np.float32)
+        row, col = tile['offset']
+        mosaic[:, row:row + tile['height'], col:col + tile['width']] = array
+
+    if mosaic is None:
+        return None
+    path = os.path.join(out_dir, filename + backend.suffix)
+    backend.write(path, mosaic, manifest['transform'])
+    return os.path.basename(path)
+
+def runTiledInference(aoi, out_dir, backend, scale=30, max_pixels=DEFAULT_MAX_PIXELS,
+                      workers=4, max_retries=3, backoff=30, sleep=time.sleep):
+    # aoi: [xmin, ymin, xmax, ymax] in degrees or an ee geometry / feature collection
+    # returns the manifest, manifest['mosaic'] is the mosaic file in out_dir
+    start = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+    bounds = list(aoi) if isinstance(aoi, (list, tuple)) else aoiBounds(aoi)
+    grid, tiles = tileGrid(bounds, scale=scale, max_pixels=max_pixels)
+
+    # resume only when the previous run used the same grid
+    manifest = loadManifest(out_dir)
+    if manifest is None or any(manifest.get(k) != v for k, v in grid.items()):
+        manifest = dict(grid, tiles=[dict(tile, state=QUEUED, attempts=0) for tile in tiles])
+    saveManifest(out_dir, manifest)
+
+    runTiles(manifest, backend, out_dir, workers=workers,
+             max_retries=max_retries, backoff=backoff, sleep=sleep)
+
+    states = [tile['state'] for tile in manifest['tiles']]
+    manifest['counts'] = {state: states.count(state) for state in sorted(set(states))}
+    manifest['mosaic'] = mosaicTiles(manifest, backend, out_dir)
+    manifest['wall_time'] = round(time.time() - start, 3)
+    saveManifest(out_dir, manifest)
+    print('Tile states =', manifest['counts'])
+    return manifest
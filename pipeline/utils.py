@@ -1,34 +1,252 @@
+import numpy as np
 import pandas as pd
 import json
 import glob
 import os
+import hashlib
+import io
+import logging
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
 import ee
 import geemap
+from tqdm import tqdm
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# bump when baseETtransforms/generateETlocationLabels change the cached frame
+ET_CACHE_VERSION = 1
 
 def setupOutputPaths(datafile, outpath):
-    if not os.path.exists(outpath):
-        os.mkdir(outpath)
+    os.makedirs(outpath, exist_ok=True)
 
     if '/exp' in outpath.split('.')[-1]:
         return outpath
 
     data_filename = datafile.split('.')[0]
-    exppath = 'exp01/'
-    rootpaths = glob.glob(outpath + data_filename)
+    os.makedirs(outpath + data_filename, exist_ok=True)
+
+    exppaths = glob.glob(outpath + data_filename + '/exp*')
+    expnums = [int(p.split('/exp')[-1]) for p in exppaths if p.split('/exp')[-1].isdigit()]
+    lastnum = max(expnums, default=0) + 1
+
+    # mkdir fails if another process claimed the same number first, try the next one
+    while True:
+        newpath = outpath + data_filename + '/' + f'exp{lastnum:02d}/'
+        try:
+            os.mkdir(newpath)
+            return newpath
+        except FileExistsError:
+            lastnum += 1
+
+def atomicWrite(filename, write):
+    # write(tmpname) writes the content, which then replaces filename in one step
+    # so readers never see a partial file
+    dirname = os.path.dirname(filename) or '.'
+    suffix = os.path.splitext(filename)[1]
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix=suffix)
+    os.close(fd)
+    try:
+        write(tmpname)
+        os.replace(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+class FileLock:
+    # Cross-process lock held while filename exists
+    def __init__(self, filename, timeout=600, poll=0.1):
+        self.filename = filename
+        self.timeout = timeout
+        self.poll = poll
+
+    def __enter__(self):
+        start = time.time()
+        while True:
+            try:
+                fd = os.open(self.filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return self
+            except FileExistsError:
+                if time.time() - start > self.timeout:
+                    raise TimeoutError(f'Could not acquire lock {self.filename}')
+                time.sleep(self.poll)
+
+    def __exit__(self, *args):
+        os.remove(self.filename)
+
+
+def _readETmember(zf, member):
+    try:
+        return pd.read_csv(zf.open(member))
+    except Exception:
+        logging.error(f' in file {member.filename}')
+        return None
+
+def iterETzip(zippath, workers=None, max_bytes=None):
+    # Yield the CSV members of an ET export zip as DataFrames, in archive order.
+    # Members are grouped so that each chunk holds at most max_bytes of
+    # uncompressed CSV (a single larger member is its own chunk); with
+    # max_bytes=None the whole archive is one chunk. Each chunk is concatenated
+    # once. Members that fail to parse are logged and skipped.
+    with ZipFile(zippath) as zf:
+        members = [m for m in zf.infolist() if not m.is_dir()]
+
+        chunks, chunk, chunk_bytes = [], [], 0
+        for member in members:
+            if chunk and max_bytes is not None and chunk_bytes + member.file_size > max_bytes:
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(member)
+            chunk_bytes += member.file_size
+        if chunk:
+            chunks.append(chunk)
+
+        executor = ThreadPoolExecutor(workers) if workers and workers > 1 else None
+        try:
+            with tqdm(total=len(members)) as progress:
+                for chunk in chunks:
+                    if executor is None:
+                        frames = (_readETmember(zf, m) for m in chunk)
+                    else:
+                        frames = executor.map(lambda m: _readETmember(zf, m), chunk)
+                    tmp = []
+                    for frame in frames:
+                        progress.update()
+                        if frame is not None:
+                            tmp.append(frame)
+                    if tmp:
+                        yield pd.concat(tmp, ignore_index=True)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+def loadETzip(zippath, workers=None):
+    # Read every CSV member of an ET export zip into a single DataFrame
+    return next(iterETzip(zippath, workers=workers), pd.DataFrame())
+
+def hashFile(filename, blocksize=1 << 20):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-    if rootpaths:
-        exppaths = glob.glob(outpath + data_filename + '/exp*')
-        if exppaths:
-            lastnum = int(max(exppaths)[-2:]) + 1
-            exppath = f'exp{lastnum:02d}/'
-    else:
-        os.mkdir(outpath + data_filename)
+def _writeFrame(df, filename):
+    def write(tmpname):
+        if filename.endswith('.parquet'):
+            df.to_parquet(tmpname, index=False)
+        else:
+            columns = list(df.columns)
+            arrays = {f'c{i}': df[col].to_numpy() for i, col in enumerate(columns)}
+            np.savez(tmpname, __columns__=np.array(columns, dtype=object), **arrays)
 
-    newpath = outpath + data_filename + '/' + exppath
-    os.mkdir(newpath)
+    # write to a temporary file first so a partial cache is never picked up
+    atomicWrite(filename, write)
 
-    return newpath
+def _readFrame(filename):
+    if filename.endswith('.parquet'):
+        return pd.read_parquet(filename)
+    with np.load(filename, allow_pickle=True) as data:
+        columns = list(data['__columns__'])
+        return pd.DataFrame({col: data[f'c{i}'] for i, col in enumerate(columns)})
 
+def loadTransformedET(datafile, inpath='', cachedir=None, readers=None, snap=None, digest=None):
+    # Returns the zip contents after baseETtransforms and generateETlocationLabels,
+    # and whether it came from the cache. The cache is keyed on the zip content,
+    # stored as Parquet (or .npz when pyarrow is not installed) in cachedir,
+    # which defaults to inpath/.etcache. digest: sha256 of the zip when the
+    # caller already hashed it
+    zipname = inpath + datafile
+    if cachedir is None:
+        cachedir = os.path.join(inpath or '.', '.etcache')
+    ext = '.parquet' if pyarrow is not None else '.npz'
+    key = f'{digest or hashFile(zipname)}_v{ET_CACHE_VERSION}'
+    if snap:
+        key += f'_snap{snap:g}'
+    cachename = os.path.join(cachedir, key + ext)
+
+    if os.path.exists(cachename):
+        try:
+            return _readFrame(cachename), True
+        except Exception:
+            logging.error(f' reading cache {cachename}')
+
+    df = loadETzip(zipname, workers=readers)
+    df = baseETtransforms(df)
+    df = generateETlocationLabels(df, snap=snap)
+
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        _writeFrame(df, cachename)
+    except Exception:
+        logging.error(f' writing cache {cachename}')
+
+    return df, False
+
+def shareFrame(df, dirname):
+    # Save df one column per .npy file so worker processes can open it with
+    # mmap_mode='r' instead of receiving a pickled copy. String columns are
+    # stored as fixed-width unicode, other object columns are pickled.
+    # Returns a small manifest for loadSharedFrame
+    manifest_name = os.path.join(dirname, 'manifest.json')
+    if os.path.exists(manifest_name):
+        with open(manifest_name, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    parent = os.path.dirname(os.path.normpath(dirname)) or '.'
+    os.makedirs(parent, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=parent)
+    entries = []
+    for i, (name, values) in enumerate([(None, df.index.to_numpy())] +
+                                       [(col, df[col].to_numpy()) for col in df.columns]):
+        mmap = True
+        if values.dtype == object:
+            if all(isinstance(v, str) for v in values):
+                values = values.astype(str)
+            else:
+                mmap = False
+        np.save(os.path.join(tmpdir, f'c{i}.npy'), values, allow_pickle=not mmap)
+        entries.append({'name': name, 'file': f'c{i}.npy', 'mmap': mmap})
+
+    manifest = {'dir': os.path.abspath(dirname), 'index': entries[0], 'columns': entries[1:]}
+    with open(os.path.join(tmpdir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    try:
+        os.replace(tmpdir, dirname)
+    except OSError:
+        # another process shared the same frame first
+        for filename in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, filename))
+        os.rmdir(tmpdir)
+    return manifest
+
+def loadSharedFrame(manifest):
+    def load(entry):
+        filename = os.path.join(manifest['dir'], entry['file'])
+        if not entry['mmap']:
+            return np.load(filename, allow_pickle=True)
+        return np.load(filename, mmap_mode='r')
+
+    index = load(manifest['index'])
+    df = pd.DataFrame({entry['name']: load(entry) for entry in manifest['columns']}, index=index)
+    for entry in manifest['columns']:
+        if df[entry['name']].dtype.kind not in 'biufcmM':
+            # strings go back to object columns, as in the original frame
+            df[entry['name']] = df[entry['name']].astype(object)
+    return df
+
+def recordCacheStats(out_stats, hit):
+    key = 'cache_hits' if hit else 'cache_misses'
+    out_stats[key] = int(out_stats.get(key, 0)) + 1
+    return out_stats
 
 def baseETtransforms(df):
     # Convert LandT_G from Kelvin to Celsius
@@ -56,17 +274,57 @@ def baseETcleanse(df):
     num_errs = len(df[df.ET_24h < -2])
     return df[df['ET_24h'] > -2], num_errs
 
-def generateETlocationLabels(df):
-    df['loc_idx_tmp'] = df['longitude'].astype(str) + ', ' + df['latitude'].astype(str)
+def parsePrecipMatrix(precip, width=None):
+    # Decode a column of stringified lists ('[0.1, 0, 2.5]') into a float32
+    # matrix of shape (rows, width), padded with NaN. width defaults to the
+    # longest list. Missing or unparseable values are NaN.
+    lines = [x.strip('[] ') if isinstance(x, str) else '' for x in precip]
+    ncols = max([x.count(',') + 1 for x in lines if x], default=0)
+    if width is None:
+        width = ncols
 
-    num_locs = len(df['loc_idx_tmp'].unique())
-    for i in range(num_locs):
-        vals = df['loc_idx_tmp'].unique()[i]
-        df.loc[df['loc_idx_tmp'] == vals, 'loc_idx'] = int(i)
+    out = np.full((len(lines), width), np.nan, dtype=np.float32)
+    if ncols == 0 or width == 0:
+        return out
 
-    df.drop(['loc_idx_tmp'], axis=1, inplace=True)
+    # only the non-empty lines are parsed, the csv parser drops a trailing empty
+    # line, and written back to their rows; the missing rows stay NaN
+    rows = np.flatnonzero([bool(x) for x in lines])
+    text = '\n'.join(lines[i] for i in rows)
+    # the C csv parser handles the ragged rows and pads them with NaN
+    kwargs = dict(header=None, names=range(ncols), skipinitialspace=True)
+    try:
+        values = pd.read_csv(io.StringIO(text), dtype=np.float32, **kwargs)
+    except ValueError:
+        values = pd.read_csv(io.StringIO(text), dtype=str, **kwargs)
+        values = values.apply(pd.to_numeric, errors='coerce')
+    ncopy = min(width, ncols)
+    out[rows, :ncopy] = values.to_numpy(np.float32)[:, :ncopy]
+    return out
+
+def generateETlocationLabels(df, snap=None):
+    # loc_idx numbers the distinct (longitude, latitude) pairs in order of
+    # first appearance. With snap (degrees, e.g. 0.00027 for ~30 m) the
+    # coordinates are rounded to a grid of that spacing before matching
+    lon, lat = df['longitude'], df['latitude']
+    if snap:
+        lon = (lon / snap).round() * snap
+        lat = (lat / snap).round() * snap
+
+    codes = pd.DataFrame({'lon': lon, 'lat': lat}).groupby(['lon', 'lat'], sort=False, dropna=False).ngroup()
+    df['loc_idx'] = codes.to_numpy(dtype=float)
     return df
 
+def generateETlocationTable(df, source=None):
+    # one row per loc_idx with its coordinates, location type and source datafile
+    table = df.groupby('loc_idx', sort=True).agg(
+        longitude=('longitude', 'first'),
+        latitude=('latitude', 'first'),
+        loc_type=('loc_type', 'first')).reset_index()
+    table['loc_idx'] = table['loc_idx'].astype(int)
+    table['source'] = source
+    return table
+
 def train_test_split(data_fc):
     split = 0.8
     with_random = data_fc.randomColumn('random', 112358)